@@ -0,0 +1,151 @@
+"""Compares the threaded and asyncio download engines on many concurrent transfers from a local server, i.e.
+
+    python benchmarks/bench_async_download.py --transfers 200 --size 2M
+
+The server runs in a separate process so that it does not compete with the engines for the GIL.
+Reports wall time, throughput and the peak number of threads of each engine.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import argparse, asyncio, http.server, multiprocessing, os, re, sys, tempfile, threading, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from yt_downloader_core.segmented_download import segmented_downloader
+from yt_downloader_core.async_download import async_downloader
+from yt_downloader_core.bandwidth import parse_rate
+
+
+
+class range_handler(http.server.BaseHTTPRequestHandler):
+    """Serves size bytes at any path, with Range and keep-alive support."""
+
+    protocol_version = 'HTTP/1.1'
+    data = b''
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        start, end = 0, len(self.data) - 1
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+
+        if match:
+            start, end = int(match[1]), int(match[2] or end)
+
+        self.send_response(206 if match else 200)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        self.wfile.write(self.data[start:end + 1])
+
+
+
+class range_server(http.server.ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    # the default listen backlog of 5 drops connections opened at the same time, which then wait for TCP retransmits
+    request_queue_size = 1024
+
+
+
+def serve(size, port_queue):
+
+    range_handler.data = os.urandom(size)
+
+    server = range_server(('127.0.0.1', 0), range_handler)
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+
+
+class thread_monitor():
+    """Samples the number of threads of the process while running."""
+
+    def __init__(self):
+
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+
+        while not self._stop.wait(0.01):
+            self.peak = max(self.peak, threading.active_count())
+
+
+
+def bench_threads(base_url, transfers, size, connections, work_dir):
+
+    engine = segmented_downloader(connections)
+
+    # the threaded engine needs a thread per transfer to run them all at once
+    with ThreadPoolExecutor(max_workers=transfers) as executor:
+        futures = [executor.submit(engine.download, f'{base_url}/{i}', os.path.join(work_dir, f'threads_{i}'), size) for i in range(transfers)]
+
+        for future in futures:
+            future.result()
+
+
+
+def bench_asyncio(base_url, transfers, size, connections, work_dir):
+
+    engine = async_downloader(connections)
+
+    async def download_all():
+        await asyncio.gather(*(engine.download_async(f'{base_url}/{i}', os.path.join(work_dir, f'asyncio_{i}'), size) for i in range(transfers)))
+
+    engine.loop_thread.run(download_all())
+
+    return engine.loop_thread.pool
+
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--transfers', type=int, default=200, help='files downloaded at the same time (default: 200)')
+    parser.add_argument('--size', type=parse_rate, default=parse_rate('2M'), help='bytes per file, i.e. 512K or 2M (default: 2M)')
+    parser.add_argument('--connections', type=int, default=1, help='connections per file (default: 1)')
+    args = parser.parse_args()
+
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(args.size, port_queue), daemon=True)
+    server.start()
+    base_url = f'http://127.0.0.1:{port_queue.get()}'
+
+    print(f'{args.transfers} transfers of {args.size} bytes, {args.connections} connection(s) each')
+
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            for name, bench in (('threads', bench_threads), ('asyncio', bench_asyncio)):
+                with thread_monitor() as monitor:
+                    start = time.perf_counter()
+                    result = bench(base_url, args.transfers, args.size, args.connections, work_dir)
+                    elapsed = time.perf_counter() - start
+
+                throughput = args.transfers * args.size / elapsed / 1024 ** 2
+                print(f'{name:>8}: {elapsed:6.2f} s  {throughput:8.1f} MiB/s  peak threads: {monitor.peak}', end='')
+
+                if name == 'asyncio':
+                    print(f'  connections opened: {result.opened}, reused: {result.reused}', end='')
+
+                print()
+
+    finally:
+        server.terminate()
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+"""Benchmarks the whole download pipeline (metadata, streams, mux) against a local fake YouTube server, i.e.
+
+    python benchmarks/bench_pipeline.py --videos 200 --latency 0.05 --bandwidth 4M
+
+Reports throughput, time to first byte, metadata time, per-video overhead, mux (or audio remux) time and peak RSS
+for a single video and for a playlist. Each scenario runs in a fresh process so that peak RSS is its own
+(ffmpeg's is not included), and the server runs in another process so that it does not compete with the downloads for the GIL.
+Requires ffmpeg, like the app.
+"""
+
+import argparse, json, multiprocessing, os, resource, statistics, sys, tempfile, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_youtube
+from yt_downloader_core.bandwidth import parse_rate
+
+
+
+class pipeline_probe():
+    """Records per-video timings by wrapping yt_downloader's stages, without changing what they do."""
+
+    def __init__(self):
+
+        # per video id: when its streams can start, i.e. once both resolved and scheduled for download
+        self.started = {}
+        self.first_byte = {}
+        self.last_byte = {}
+        self.finished = {}
+        self.metadata_times = []
+        self.mux_times = []
+        self.bytes = 0
+
+
+
+    def install(self):
+
+        from pytube import extract
+        from yt_downloader_core import downloader
+
+        probe = self
+        yt_downloader = downloader.yt_downloader
+        resolve_streams, download, finalize, mux = yt_downloader.resolve_streams, yt_downloader.download, yt_downloader.finalize, downloader.mux
+        save_audio = yt_downloader.save_audio
+        video_callback = downloader.playlist_progress.video_callback
+
+        def timed_resolve_streams(self):
+            if self.formats is not None:
+                return
+
+            start = time.perf_counter()
+            resolve_streams(self)
+            probe.metadata_times.append(time.perf_counter() - start)
+            probe.mark_started(extract.video_id(self.url))
+
+        def timed_download(self, *args, **kwargs):
+            if not self.isplaylist:
+                probe.mark_started(extract.video_id(self.url))
+            return download(self, *args, **kwargs)
+
+        def timed_finalize(self, *args, **kwargs):
+            finalize(self, *args, **kwargs)
+            probe.finished[extract.video_id(self.url)] = time.perf_counter()
+
+        def timed_mux(*args, **kwargs):
+            start = time.perf_counter()
+            mux(*args, **kwargs)
+            probe.mux_times.append(time.perf_counter() - start)
+
+        # audio downloads are tagged/remuxed instead of muxed
+        def timed_save_audio(*args, **kwargs):
+            start = time.perf_counter()
+            save_audio(*args, **kwargs)
+            probe.mux_times.append(time.perf_counter() - start)
+
+        # a playlist's progress callback only gets the combined progress, so its videos' bytes are counted per video
+        def counted_video_callback(self, vid, res):
+            callback = video_callback(self, vid, res)
+            video_id = extract.video_id(vid.url)
+
+            def counted_callback(stream, chunk, bytes_remaining):
+                probe.count_bytes(video_id, chunk)
+                callback(stream, chunk, bytes_remaining)
+
+            return counted_callback
+
+        yt_downloader.resolve_streams = timed_resolve_streams
+        yt_downloader.download = timed_download
+        yt_downloader.finalize = timed_finalize
+        downloader.mux = timed_mux
+        yt_downloader.save_audio = timed_save_audio
+        downloader.playlist_progress.video_callback = counted_video_callback
+
+
+
+    def mark_started(self, video_id):
+
+        # a playlist's videos are resolved ahead of their download, a single video's after download starts
+        self.started[video_id] = time.perf_counter()
+
+
+
+    def progress(self, stream, chunk, bytes_remaining):
+
+        # the fake video titles end with the video id
+        if stream.type != 'playlist':
+            self.count_bytes(stream.title.rsplit(' ', 1)[-1], chunk)
+
+
+
+    def count_bytes(self, video_id, chunk):
+
+        now = time.perf_counter()
+
+        self.first_byte.setdefault(video_id, now)
+        self.last_byte[video_id] = now
+        self.bytes += len(chunk)
+
+
+
+    def report(self, wall):
+
+        ttfb = [self.first_byte[video_id] - start for video_id, start in self.started.items() if video_id in self.first_byte]
+        overhead = [
+            (self.finished[video_id] - start) - (self.last_byte[video_id] - self.first_byte[video_id])
+            for video_id, start in self.started.items() if video_id in self.finished and video_id in self.first_byte
+        ]
+
+        return {
+            'videos': len(self.finished),
+            'wall_s': round(wall, 3),
+            'mib': round(self.bytes / 1024 ** 2, 1),
+            'throughput_mib_s': round(self.bytes / wall / 1024 ** 2, 1),
+            'ttfb_ms': _summary(ttfb),
+            'metadata_ms': _summary(self.metadata_times),
+            'overhead_ms': _summary(overhead),
+            'mux_ms': _summary(self.mux_times),
+            'peak_rss_mib': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+
+
+
+def _summary(values):
+
+    """Returns the mean and 95th percentile of durations in seconds, in milliseconds.
+    """
+
+    if not values:
+        return None
+
+    values = sorted(values)
+
+    return {'mean': round(statistics.mean(values) * 1000, 1), 'p95': round(values[min(len(values) - 1, int(len(values) * 0.95))] * 1000, 1)}
+
+
+
+def run_scenario(name, url, isplaylist, base_url, args, result_queue):
+
+    """Downloads url in a fresh process and puts its report in result_queue.
+    """
+
+    with tempfile.TemporaryDirectory() as home:
+        os.environ['HOME'] = os.environ['USERPROFILE'] = home
+
+        fake_youtube.use_fake_youtube(base_url)
+
+        from yt_downloader_core.downloader import yt_downloader
+        from yt_downloader_core.metadata_cache import metadata_cache
+
+        probe = pipeline_probe()
+        probe.install()
+
+        for_download = yt_downloader(url, isplaylist=isplaylist, progress_callback=probe.progress, max_workers=args.jobs, connections=args.connections,
+                                     cache=metadata_cache(os.path.join(home, 'metadata.sqlite3')), pipe_mux=args.pipe_mux, engine=args.engine,
+                                     audio_format=args.audio_format)
+
+        start = time.perf_counter()
+        for_download.download(args.res)
+
+        result_queue.put({'scenario': name, **probe.report(time.perf_counter() - start)})
+
+
+
+def print_report(report):
+
+    def summary(values):
+        return f"{values['mean']:8.1f} {values['p95']:8.1f}" if values else f"{'-':>8} {'-':>8}"
+
+    print(f"{report['scenario']:>10} {report['videos']:>6} {report['wall_s']:8.2f} {report['throughput_mib_s']:9.1f} "
+          f"{summary(report['ttfb_ms'])} {summary(report['metadata_ms'])} {summary(report['overhead_ms'])} {summary(report['mux_ms'])} "
+          f"{report['peak_rss_mib']:8.1f}")
+
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', default='single,playlist', help='comma separated scenarios: single, playlist (default: both)')
+    parser.add_argument('--videos', type=int, default=100, help='videos in the playlist (default: 100)')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds before the server answers each request (default: 0.02)')
+    parser.add_argument('--bandwidth', type=parse_rate, default=None, help='bytes per second per connection, i.e. 4M (default: unlimited)')
+    parser.add_argument('--duration', type=int, default=10, help='seconds of media per video (default: 10)')
+    parser.add_argument('--video-bitrate', default='2M', help='bitrate of the video streams (default: 2M)')
+    parser.add_argument('--res', default='720p', help="resolution downloaded, 360p, 720p or 'audio' (default: 720p)")
+    parser.add_argument('--jobs', type=int, default=4, help='playlist videos downloaded at the same time (default: 4)')
+    parser.add_argument('--connections', type=int, default=4, help='connections per stream (default: 4)')
+    parser.add_argument('--engine', choices=('threads', 'asyncio'), default='threads', help='download engine (default: threads)')
+    parser.add_argument('--audio-format', choices=('mp4', 'm4a', 'opus'), default='mp4', help="file format of --res audio downloads (default: mp4)")
+    parser.add_argument('--pipe-mux', action='store_true', help='merge through pipes while downloading')
+    parser.add_argument('--json', action='store_true', help='print the reports as JSON lines instead of a table')
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+
+    with tempfile.TemporaryDirectory() as media_dir:
+        video_path, audio_path = fake_youtube.make_media(media_dir, args.duration, args.video_bitrate)
+        opus_path = fake_youtube.make_opus(media_dir, args.duration) if args.audio_format == 'opus' else None
+
+        port_queue = context.Queue()
+        server = context.Process(target=fake_youtube.serve, args=(video_path, audio_path, args.latency, args.bandwidth, port_queue, opus_path), daemon=True)
+        server.start()
+        base_url = f'http://127.0.0.1:{port_queue.get()}'
+
+        scenarios = {
+            'single': ('https://www.youtube.com/watch?v=v0000000000', False),
+            'playlist': (f'https://www.youtube.com/playlist?list=PLbench{args.videos}', True),
+        }
+
+        if not args.json:
+            print(f'video {os.path.getsize(video_path)} B, audio {os.path.getsize(audio_path)} B, latency {args.latency} s, '
+                  f'bandwidth {args.bandwidth or "unlimited"} B/s per connection, engine {args.engine}')
+            print(f"{'scenario':>10} {'videos':>6} {'wall s':>8} {'MiB/s':>9} {'ttfb ms':>17} {'metadata ms':>17} {'overhead ms':>17} {'mux ms':>17} {'rss MiB':>8}")
+            print(f"{'':>10} {'':>6} {'':>8} {'':>9} {'mean':>8} {'p95':>8} {'mean':>8} {'p95':>8} {'mean':>8} {'p95':>8} {'mean':>8} {'p95':>8}")
+
+        try:
+            for name in filter(None, args.scenarios.split(',')):
+                url, isplaylist = scenarios[name]
+                result_queue = context.Queue()
+
+                process = context.Process(target=run_scenario, args=(name, url, isplaylist, base_url, args, result_queue))
+                process.start()
+                report = result_queue.get()
+                process.join()
+
+                if args.json:
+                    print(json.dumps(report))
+                else:
+                    print_report(report)
+
+        finally:
+            server.terminate()
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Measures the peak memory of downloading playlists of growing length from a local fake YouTube server, i.e.
+
+    python benchmarks/bench_playlist_memory.py --videos 100,1000,5000
+
+Each playlist is downloaded in a fresh process, whose peak RSS is reported with its growth over the process
+right before the download (imports and caches included) and that growth per video, which should stay flat.
+Downloads audio by default, which is tagged in-process from stub media (see fake_youtube.make_stub_media), so that
+ffmpeg is not needed and the run is bound by the per-video bookkeeping. Other resolutions are muxed, and need ffmpeg.
+"""
+
+import argparse, json, multiprocessing, os, resource, sys, tempfile, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_youtube
+
+
+
+def peak_rss():
+
+    """Returns the peak RSS of the process in bytes (ru_maxrss is in KiB on Linux, in bytes on macOS).
+    """
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+
+def run_playlist(videos, base_url, args, result_queue):
+
+    """Downloads a playlist of videos in a fresh process and puts its report in result_queue.
+    """
+
+    with tempfile.TemporaryDirectory() as home:
+        os.environ['HOME'] = os.environ['USERPROFILE'] = home
+
+        fake_youtube.use_fake_youtube(base_url)
+
+        from yt_downloader_core.downloader import yt_downloader
+        from yt_downloader_core.metadata_cache import metadata_cache
+
+        for_download = yt_downloader(f'https://www.youtube.com/playlist?list=PLbench{videos}', isplaylist=True, max_workers=args.jobs,
+                                     cache=metadata_cache(os.path.join(home, 'metadata.sqlite3')), engine=args.engine)
+
+        before = peak_rss()
+        start = time.perf_counter()
+        for_download.download(args.res)
+        wall = time.perf_counter() - start
+        peak = peak_rss()
+
+        result_queue.put({
+            'videos': videos,
+            'wall_s': round(wall, 2),
+            'peak_rss_mib': round(peak / 1024 ** 2, 1),
+            'growth_mib': round((peak - before) / 1024 ** 2, 1),
+            'growth_kib_per_video': round((peak - before) / 1024 / videos, 2),
+        })
+
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--videos', default='100,1000,3000', help='comma separated playlist lengths (default: 100,1000,3000)')
+    parser.add_argument('--res', default='audio', help="resolution downloaded, 360p, 720p or 'audio' (default: audio)")
+    parser.add_argument('--jobs', type=int, default=8, help='playlist videos downloaded at the same time (default: 8)')
+    parser.add_argument('--engine', choices=('threads', 'asyncio'), default='threads', help='download engine (default: threads)')
+    parser.add_argument('--json', action='store_true', help='print the reports as JSON lines instead of a table')
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+
+    with tempfile.TemporaryDirectory() as media_dir:
+        # short media, the memory of the bookkeeping is measured, not of the downloads
+        make_media = fake_youtube.make_stub_media if args.res == 'audio' else fake_youtube.make_media
+        video_path, audio_path = make_media(media_dir, 1, '200k')
+
+        port_queue = context.Queue()
+        server = context.Process(target=fake_youtube.serve, args=(video_path, audio_path, 0, None, port_queue), daemon=True)
+        server.start()
+        base_url = f'http://127.0.0.1:{port_queue.get()}'
+
+        if not args.json:
+            print(f"{'videos':>8} {'wall s':>8} {'peak RSS MiB':>13} {'growth MiB':>11} {'KiB/video':>10}")
+
+        try:
+            for videos in (int(count) for count in args.videos.split(',') if count):
+                result_queue = context.Queue()
+
+                process = context.Process(target=run_playlist, args=(videos, base_url, args, result_queue))
+                process.start()
+                report = result_queue.get()
+                process.join()
+
+                if args.json:
+                    print(json.dumps(report))
+                else:
+                    print(f"{report['videos']:>8} {report['wall_s']:>8.2f} {report['peak_rss_mib']:>13.1f} {report['growth_mib']:>11.1f} {report['growth_kib_per_video']:>10.2f}")
+
+        finally:
+            server.terminate()
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Measures the cold start of the GUI: import time of main.py and time to the first paint of the window, i.e.
+
+    python benchmarks/bench_startup.py --runs 10
+
+Every run is a fresh interpreter, timed from before it is spawned, with an empty download queue in a temp home.
+Also lists the slowest top-level imports of main.py (from python -X importtime).
+Set QT_QPA_PLATFORM=offscreen to run without a display.
+"""
+
+import argparse, os, re, statistics, subprocess, sys, tempfile, time
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# run in the child interpreter, prints time.time() once imported and once the window painted
+FIRST_PAINT = '''
+import sys, time
+import main
+print('imported', time.time(), flush=True)
+
+from PyQt5 import QtWidgets as qtw
+from PyQt5.QtCore import QObject, QEvent, QTimer
+
+class paint_watcher(QObject):
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Paint:
+            print('painted', time.time(), flush=True)
+            QTimer.singleShot(0, app.quit)
+            self.deleteLater()
+        return False
+
+app = qtw.QApplication(sys.argv)
+window = main.MainWindow(app, quiet=True)
+watcher = paint_watcher()
+window.installEventFilter(watcher)
+window.show()
+app.exec_()
+'''
+
+
+
+def run_once(env):
+
+    """Returns the seconds from spawning an interpreter to main.py imported and to the first paint.
+    """
+
+    start = time.time()
+    output = subprocess.run([sys.executable, '-c', FIRST_PAINT], cwd=REPO_DIR, env=env, capture_output=True, text=True, check=True).stdout
+    # other threads of the app may print on the same lines
+    times = dict(re.findall(r'(imported|painted) (\d+\.\d+)', output))
+
+    return float(times['imported']) - start, float(times['painted']) - start
+
+
+
+def slowest_imports(env, count):
+
+    """Returns the (cumulative microseconds, module) pairs of the slowest imports made by main.py at the top level of its import tree.
+    """
+
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], cwd=REPO_DIR, env=env, capture_output=True, text=True, check=True).stderr
+    imports = []
+
+    for line in stderr.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \| (\s*)(\S+)', line)
+
+        # imports made by main.py itself are indented once
+        if match and len(match[2]) == 2:
+            imports.append((int(match[1]), match[3]))
+
+    return sorted(imports, reverse=True)[:count]
+
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='cold starts measured (default: 5)')
+    parser.add_argument('--imports', type=int, default=10, help='slowest imports listed (default: 10)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home:
+        env = {**os.environ, 'HOME': home, 'USERPROFILE': home, 'XDG_DATA_HOME': os.path.join(home, 'data'), 'XDG_CACHE_HOME': os.path.join(home, 'cache')}
+
+        # the first run fills the bytecode caches, it is not a cold start of an installed app
+        run_once(env)
+        results = [run_once(env) for _ in range(args.runs)]
+
+        for name, values in (('import main.py', [imported for imported, painted in results]), ('first paint', [painted for imported, painted in results])):
+            print(f'{name:>15}: median {statistics.median(values) * 1000:7.1f} ms  min {min(values) * 1000:7.1f} ms  max {max(values) * 1000:7.1f} ms')
+
+        print('\nslowest imports of main.py:')
+
+        for microseconds, module in slowest_imports(env, args.imports):
+            print(f'{microseconds / 1000:8.1f} ms  {module}')
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,438 @@
+"""Local stand-in for YouTube, used by the benchmarks.
+
+Serves synthetic watch pages, InnerTube player responses (stream manifests), playlist pages with
+continuations of 100 videos like YouTube's, and Range-capable media bytes, with a configurable latency
+per request and bandwidth per connection.
+
+Every video serves the same real mp4 video and audio files (generated with ffmpeg), so downloads can be muxed,
+and optionally the same webm/opus audio file. Without ffmpeg, make_stub_media writes mp4 files with a valid box
+layout whose samples are not decodable, enough for downloads and in-process audio tagging but not for muxing.
+Stream urls are pre-signed, so pytube's signature deciphering is not exercised (see use_fake_youtube).
+"""
+
+from urllib.parse import urlsplit, parse_qs
+import http.server, json, os, re, struct, subprocess, threading, time
+
+
+PLAYLIST_PAGE_SIZE = 100
+CHUNK_SIZE = 64 * 1024
+
+JS_PATH = '/s/player/fake0000/player_ias.vflset/en_US/base.js'
+
+# itag -> (resolution, mime type), as in pytube.itags
+VIDEO_ITAGS = {134: ('360p', 'video/mp4; codecs="avc1.4d401e"'), 136: ('720p', 'video/mp4; codecs="avc1.4d401f"')}
+AUDIO_ITAG = 140
+OPUS_ITAG = 251
+
+
+
+def make_media(work_dir, duration=10, video_bitrate='2M'):
+
+    """Generates the fragmented mp4 video and audio files served for every video.
+
+    Returns:
+        (video_path, audio_path) tuple
+    """
+
+    video_path = os.path.join(work_dir, f'video_{duration}_{video_bitrate}.mp4')
+    audio_path = os.path.join(work_dir, f'audio_{duration}.mp4')
+    flags = ['-movflags', 'frag_keyframe+empty_moov']
+
+    if not os.path.isfile(video_path):
+        subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'lavfi', '-i', f'testsrc2=size=1280x720:rate=30:duration={duration}',
+                        '-c:v', 'libx264', '-preset', 'ultrafast', '-b:v', video_bitrate, *flags, video_path], check=True)
+
+    if not os.path.isfile(audio_path):
+        subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}',
+                        '-c:a', 'aac', '-b:a', '128k', *flags, audio_path], check=True)
+
+    return video_path, audio_path
+
+
+
+def make_stub_media(work_dir, duration=10, video_bitrate='2M'):
+
+    """Generates mp4 video and audio files like make_media's, without ffmpeg: ftyp, moov (one track with its sample
+    tables) and mdat boxes, the moov first so that tagging the file shifts its chunk offsets. The samples are not
+    encoded media, every byte of sample i is i % 256 so that misplaced chunk offsets can be told apart.
+
+    Returns:
+        (video_path, audio_path) tuple
+    """
+
+    video_path = os.path.join(work_dir, f'stub_video_{duration}_{video_bitrate}.mp4')
+    audio_path = os.path.join(work_dir, f'stub_audio_{duration}.mp4')
+
+    # AAC frames of 1024 samples at 44.1 kHz and 128 kbit/s, video frames at 30 fps
+    tracks = (
+        (audio_path, 'soun', 44100, 1024, duration * 44100 // 1024, 128000 * 1024 // 44100 // 8),
+        (video_path, 'vide', 30, 1, duration * 30, _bits(video_bitrate) // 30 // 8),
+    )
+
+    for path, handler, timescale, sample_delta, sample_count, sample_size in tracks:
+        if not os.path.isfile(path):
+            with open(path, 'wb') as fh:
+                fh.write(_stub_mp4(handler, timescale, sample_delta, sample_count, sample_size))
+
+    return video_path, audio_path
+
+
+
+def _bits(rate):
+
+    """Parses a bitrate like ffmpeg's, i.e. '200k' or '2M', into bits per second.
+    """
+
+    units = {'k': 1000, 'K': 1000, 'm': 1000 ** 2, 'M': 1000 ** 2}
+
+    return int(float(rate[:-1]) * units[rate[-1]]) if rate[-1] in units else int(rate)
+
+
+
+def _box(kind, *payloads):
+
+    data = b''.join(payloads)
+
+    return struct.pack('>I4s', 8 + len(data), kind) + data
+
+
+
+def _full_box(kind, flags, *payloads):
+
+    return _box(kind, struct.pack('>I', flags), *payloads)
+
+
+
+def _stub_mp4(handler, timescale, sample_delta, sample_count, sample_size):
+
+    """Returns the bytes of a single track mp4 file with one sample per chunk, see make_stub_media.
+    """
+
+    duration = sample_count * sample_delta
+    matrix = struct.pack('>9I', 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+
+    if handler == 'soun':
+        # AAC LC, 44.1 kHz stereo (AudioSpecificConfig 0x1210) in an MPEG-4 elementary stream descriptor
+        decoder_config = bytes([0x04, 17, 0x40, 0x15, 0, 0, 0]) + struct.pack('>II', 128000, 128000) + bytes([0x05, 2, 0x12, 0x10])
+        es_descriptor = bytes([0x03, 3 + len(decoder_config) + 3, 0, 1, 0]) + decoder_config + bytes([0x06, 1, 0x02])
+        sample_entry = _box(b'mp4a', bytes(6), struct.pack('>H8xHHHHI', 1, 2, 16, 0, 0, 44100 << 16), _full_box(b'esds', 0, es_descriptor))
+        media_header = _full_box(b'smhd', 0, bytes(4))
+        width, height, volume = 0, 0, 0x100
+
+    else:
+        avc_config = bytes([1, 0x4d, 0x40, 0x1f, 0xff, 0xe1]) + struct.pack('>H', 4) + b'\x67\x4d\x40\x1f' + bytes([1]) + struct.pack('>H', 4) + b'\x68\xee\x3c\x80'
+        sample_entry = _box(b'avc1', bytes(6), struct.pack('>H16xHHIIIH32sHh', 1, 1280, 720, 0x480000, 0x480000, 0, 1, b'', 0x18, -1), _box(b'avcC', avc_config))
+        media_header = _full_box(b'vmhd', 1, bytes(8))
+        width, height, volume = 1280, 720, 0
+
+    def moov(mdat_offset):
+        sample_table = _box(b'stbl',
+            _full_box(b'stsd', 0, struct.pack('>I', 1), sample_entry),
+            _full_box(b'stts', 0, struct.pack('>III', 1, sample_count, sample_delta)),
+            _full_box(b'stsc', 0, struct.pack('>IIII', 1, 1, 1, 1)),
+            _full_box(b'stsz', 0, struct.pack('>II', sample_size, sample_count)),
+            _full_box(b'stco', 0, struct.pack(f'>I{sample_count}I', sample_count, *(mdat_offset + 8 + i * sample_size for i in range(sample_count)))),
+        )
+        media = _box(b'mdia',
+            _full_box(b'mdhd', 0, struct.pack('>IIIIHH', 0, 0, timescale, duration, 0x55c4, 0)),
+            _full_box(b'hdlr', 0, struct.pack('>I4s12x', 0, handler.encode('ascii')), b'StubHandler\0'),
+            _box(b'minf', media_header, _box(b'dinf', _full_box(b'dref', 0, struct.pack('>I', 1), _full_box(b'url ', 1))), sample_table),
+        )
+        track = _box(b'trak',
+            _full_box(b'tkhd', 3, struct.pack('>IIIIIQhhH2x', 0, 0, 1, 0, duration * 1000 // timescale, 0, 0, 0, volume), matrix, struct.pack('>II', width << 16, height << 16)),
+            media,
+        )
+        movie_header = _full_box(b'mvhd', 0, struct.pack('>IIIIIH10x', 0, 0, 1000, duration * 1000 // timescale, 0x10000, 0x100), matrix, bytes(24), struct.pack('>I', 2))
+
+        return _box(b'moov', movie_header, track)
+
+    ftyp = _box(b'ftyp', b'isom', struct.pack('>I', 512), b'isomiso2mp41')
+    mdat_offset = len(ftyp) + len(moov(0))
+    samples = b''.join(bytes([i % 256]) * sample_size for i in range(sample_count))
+
+    return ftyp + moov(mdat_offset) + _box(b'mdat', samples)
+
+
+
+def make_opus(work_dir, duration=10):
+
+    """Generates the webm/opus audio file served for every video's opus stream.
+
+    Returns:
+        string of the file's path
+    """
+
+    opus_path = os.path.join(work_dir, f'audio_{duration}.webm')
+
+    if not os.path.isfile(opus_path):
+        subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}',
+                        '-c:a', 'libopus', '-b:a', '160k', opus_path], check=True)
+
+    return opus_path
+
+
+
+def video_ids(playlist_id):
+
+    """Returns the ids of the videos of a fake playlist, whose id ends with its number of videos, i.e. PLbench1000.
+    """
+
+    count = int(re.search(r'(\d+)$', playlist_id)[1])
+
+    return [f'v{index:010d}' for index in range(count)]
+
+
+
+class fake_youtube_handler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+
+
+    def do_GET(self):
+
+        time.sleep(self.server.latency)
+
+        self.server.count_request()
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+
+        if url.path == '/watch':
+            return self.send_text(self.watch_page(query['v'][0]))
+
+        if url.path == '/playlist':
+            return self.send_text(self.playlist_page(query['list'][0]))
+
+        if url.path == JS_PATH:
+            return self.send_text('var fake_player = {};', 'text/javascript')
+
+        match = re.fullmatch(r'/media/([\w-]+)/(\d+)', url.path)
+
+        if match:
+            return self.send_media({AUDIO_ITAG: self.server.audio, OPUS_ITAG: self.server.opus}.get(int(match[2]), self.server.video))
+
+        self.send_error(404)
+
+
+
+    def do_POST(self):
+
+        time.sleep(self.server.latency)
+
+        self.server.count_request()
+        url = urlsplit(self.path)
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+
+        if url.path == '/youtubei/v1/player':
+            return self.send_text(json.dumps(self.player_response(parse_qs(url.query)['videoId'][0])), 'application/json')
+
+        if url.path == '/youtubei/v1/browse':
+            playlist_id, page = body['continuation'].split(':')
+            return self.send_text(json.dumps(self.continuation_response(playlist_id, int(page))), 'application/json')
+
+        self.send_error(404)
+
+
+
+    def watch_page(self, video_id):
+
+        player_response = {'playabilityStatus': {'status': 'OK'}, 'videoDetails': {'videoId': video_id}}
+
+        return (f'<html><meta itemprop="datePublished" content="2024-01-31">'
+                f'<script>var ytInitialPlayerResponse = {json.dumps(player_response)};</script>'
+                f'<script src="{JS_PATH}"></script></html>')
+
+
+
+    def player_response(self, video_id):
+
+        formats = [
+            {'itag': itag, 'url': f'{self.server.base_url}/media/{video_id}/{itag}?signature=fake', 'mimeType': mime_type,
+             'contentLength': str(len(self.server.video)), 'qualityLabel': res, 'bitrate': 2000000}
+            for itag, (res, mime_type) in VIDEO_ITAGS.items()
+        ]
+        formats.append({'itag': AUDIO_ITAG, 'url': f'{self.server.base_url}/media/{video_id}/{AUDIO_ITAG}?signature=fake',
+                        'mimeType': 'audio/mp4; codecs="mp4a.40.2"', 'contentLength': str(len(self.server.audio)), 'bitrate': 128000})
+
+        if self.server.opus is not None:
+            formats.append({'itag': OPUS_ITAG, 'url': f'{self.server.base_url}/media/{video_id}/{OPUS_ITAG}?signature=fake',
+                            'mimeType': 'audio/webm; codecs="opus"', 'contentLength': str(len(self.server.opus)), 'bitrate': 160000})
+
+        return {
+            'playabilityStatus': {'status': 'OK'},
+            'videoDetails': {'videoId': video_id, 'title': f'Benchmark Video {video_id}', 'lengthSeconds': '10', 'author': 'benchmark'},
+            'streamingData': {'adaptiveFormats': formats},
+        }
+
+
+
+    def playlist_page(self, playlist_id):
+
+        initial_data = {'contents': {'twoColumnBrowseResultsRenderer': {'tabs': [{'tabRenderer': {'content': {'sectionListRenderer': {'contents': [
+            {'itemSectionRenderer': {'contents': [{'playlistVideoListRenderer': {'contents': self.playlist_items(playlist_id, 0)}}]}}
+        ]}}}}]}}}
+
+        return (f'<html><script>ytcfg.set({{"INNERTUBE_API_KEY": "fake"}});</script>'
+                f'<script>var ytInitialData = {json.dumps(initial_data)};</script></html>')
+
+
+
+    def continuation_response(self, playlist_id, page):
+
+        return {'onResponseReceivedActions': [{'appendContinuationItemsAction': {'continuationItems': self.playlist_items(playlist_id, page)}}]}
+
+
+
+    def playlist_items(self, playlist_id, page):
+
+        ids = video_ids(playlist_id)
+        items = [{'playlistVideoRenderer': {'videoId': video_id}} for video_id in ids[page * PLAYLIST_PAGE_SIZE:(page + 1) * PLAYLIST_PAGE_SIZE]]
+
+        if (page + 1) * PLAYLIST_PAGE_SIZE < len(ids):
+            items.append({'continuationItemRenderer': {'continuationEndpoint': {'continuationCommand': {'token': f'{playlist_id}:{page + 1}'}}}})
+
+        return items
+
+
+
+    def send_text(self, text, content_type='text/html'):
+
+        data = text.encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+
+    def send_media(self, data):
+
+        start, end = 0, len(data) - 1
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+
+        if match:
+            start, end = int(match[1]), min(int(match[2] or end), end)
+
+        self.send_response(206 if match else 200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+
+        if match:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+
+        self.end_headers()
+
+        # paced per connection to simulate the bandwidth limit
+        started = time.monotonic()
+        sent = 0
+
+        for offset in range(start, end + 1, CHUNK_SIZE):
+            chunk = data[offset:min(offset + CHUNK_SIZE, end + 1)]
+            self.wfile.write(chunk)
+            sent += len(chunk)
+
+            if self.server.bandwidth:
+                ahead = sent / self.server.bandwidth - (time.monotonic() - started)
+
+                if ahead > 0:
+                    time.sleep(ahead)
+
+
+
+class fake_youtube_server(http.server.ThreadingHTTPServer):
+    """Fake YouTube server.
+
+    Args:
+        video (bytes): media served for every video stream.
+        audio (bytes): media served for every audio stream.
+        opus (bytes): media served for every opus audio stream, None for no opus streams.
+        latency (float): seconds waited before answering each request.
+        bandwidth (int): bytes per second per connection, None for unlimited.
+    """
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, video, audio, latency=0, bandwidth=None, address=('127.0.0.1', 0), opus=None):
+
+        super().__init__(address, fake_youtube_handler)
+
+        self.video = video
+        self.audio = audio
+        self.opus = opus
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.base_url = f'http://{self.server_address[0]}:{self.server_port}'
+        self.requests = 0
+
+        self._lock = threading.Lock()
+
+
+
+    def count_request(self):
+
+        with self._lock:
+            self.requests += 1
+
+
+
+    def start(self):
+
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+        return self
+
+
+
+def serve(video_path, audio_path, latency, bandwidth, port_queue, opus_path=None):
+
+    """Runs a fake_youtube_server until terminated, i.e. in a multiprocessing.Process so that
+    the server does not compete with the benchmarked downloads for the GIL.
+    """
+
+    with open(video_path, 'rb') as fh:
+        video = fh.read()
+
+    with open(audio_path, 'rb') as fh:
+        audio = fh.read()
+
+    opus = None
+
+    if opus_path is not None:
+        with open(opus_path, 'rb') as fh:
+            opus = fh.read()
+
+    server = fake_youtube_server(video, audio, latency, bandwidth, opus=opus)
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+
+
+class _presigned_cipher():
+    """Stands in for pytube's Cipher, the fake stream urls are already signed."""
+
+    def __init__(self, js):
+        pass
+
+
+
+def use_fake_youtube(base_url):
+
+    """Points pytube at a fake YouTube server instead of youtube.com, for the current process.
+    """
+
+    import pytube.request, pytube.extract
+
+    execute_request = pytube.request._execute_request
+
+    def fake_execute_request(url, *args, **kwargs):
+        url = re.sub(r'^https://(www\.)?youtube\.com', base_url, url)
+        return execute_request(url, *args, **kwargs)
+
+    pytube.request._execute_request = fake_execute_request
+    pytube.extract.Cipher = _presigned_cipher
@@ -1,9 +1,14 @@
-from pathlib import Path
-import sys, os, re, ffmpeg, traceback
-from pytube import YouTube, Playlist
-from hurry.filesize import size
+import sys, os, re, json, sqlite3, time, traceback
 from PyQt5 import QtWidgets as qtw
-from PyQt5.QtCore import QRunnable, QThreadPool, pyqtSlot
+from PyQt5.QtCore import Qt, QRunnable, QThreadPool, QObject, QTimer, pyqtSignal, pyqtSlot
+from hurry.filesize import size
+from yt_downloader_core.metadata_cache import metadata_cache
+from yt_downloader_core.job_queue import job_queue
+from yt_downloader_core.download_index import download_index
+from yt_downloader_core.bandwidth import token_bucket, throttle, parse_rate
+from yt_downloader_core.progress import progress_aggregator
+from yt_downloader_core.metrics import stage_metrics
+from yt_downloader_core.retry import retry_policy, classify, THROTTLED, UNAVAILABLE, MISSING_FFMPEG
 
 
 try:
@@ -12,255 +17,158 @@ except ModuleNotFoundError:
     sys.exit('Please run gui builder first.')
 
 
-class yt_downloader():
-
-    def __init__(self, url, isplaylist=False, progress_callback=None, complete_callback=None):
-        
-        self.url = url
-        self.isplaylist = isplaylist
-        self.progress_callback = progress_callback
-        self.complete_callback = complete_callback
-
-        self.res_options = []
-        self.filesize_options = []
-        self.stream_dict = {}
+class Worker(QRunnable):
+    """Thread handler used to disable UI freezing during
+    downloads.
 
-        self.vid = None
+    Args:
+        QRunnable (QRunnable): PyQt5 class for handling thread.
+    """
 
+    def __init__(self, fn, *args, **kwargs):
+        super(Worker, self).__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
 
-            
-    def prepare_vid(self):
 
-        """Function that retrieves the YouTube stream/s for download.
-        """
 
-        if self.vid is not None:
+    @pyqtSlot()
+    def run(self):
+        try:
+            self.fn(*self.args, **self.kwargs)
+          
+        except Exception as e:
+            # the exception is passed along so that the callback can decide to retry (see retry.classify)
+            self.kwargs['finished_callback'](error_message(e), e)
             return
-
-        if self.isplaylist:
-            self.vid = []
-            playlist = Playlist(self.url)
-            playlist._video_regex = re.compile(r"\"url\":\"(/watch\?v=[\w-]*)")
-
-            playlist_len = len(playlist)
-
-            for i in range(playlist_len):
-                self.vid.append(yt_downloader(playlist[i], progress_callback=self.progress_callback, complete_callback=self.complete_callback))
-
-        else:
-            print(f'Initializing video for download: {self.url}')
-            self.vid = YouTube(self.url, on_progress_callback=self.progress_callback, on_complete_callback=self.complete_callback)
-
-
-
-    def get_res_options(self):
-
-        """Shows which resolutions are available to download.
-        If a playlist, shows resolutions which are common to all videos in the playlist.
-
-        Returns:
-            list of strings
-            i.e. ['144p', '240p', '360p']
-        """
-        self.prepare_vid()
-
-        if self.res_options:
-            return self.res_options
-
-        if not self.isplaylist:
-
-            for stream in self.vid.streams.filter(adaptive=True, file_extension='mp4', type='video'):
-                if stream.resolution is not None:
-                    self.stream_dict[stream.resolution] = stream
-
-            self.res_options = sorted(list(self.stream_dict.keys()), key=(lambda x: int(x[:-1])))
-            self.res_options.append('audio')
-
-            self.stream_dict['audio'] = self.vid.streams.filter(file_extension='mp4', type='audio')[-1]
-
-
-        else:
-
-            all_res_options = [vid.get_res_options() for vid in self.vid]
-            self.res_options = list(set(all_res_options[0]).intersection(*all_res_options))
-
-        return self.res_options
-
-
-
-    def get_filesize_options(self):
-
-        """Shows the filesizes are with respect to the order found in self.res_options.
-        If a playlist, shows total filesizes given all videos are downloaded with the same resolution.
-
-        Returns:
-            [type]: [description]
-        """
         
-        if self.filesize_options:
-            return self.filesize_options
-
-        if not self.isplaylist:
-            res_options = self.get_res_options()
-            audio_file_size = self.stream_dict['audio'].filesize
-            self.filesize_options = [size(self.stream_dict[res].filesize + audio_file_size) + 'B' if res != 'audio' else size(audio_file_size) + 'B' for res in res_options]
+        self.kwargs['finished_callback']()
 
 
-        else:
-            res_options = self.get_res_options()
-            self.filesize_options = [0] * len(res_options)
 
-            for index, res in enumerate(res_options):
-                for vid in self.vid:
-                    self.filesize_options[index] += vid.stream_dict[res].filesize + vid.stream_dict['audio'].filesize if res != 'audio' else vid.stream_dict['audio'].filesize
+def error_message(e):
 
-            self.filesize_options = [size(filesize) + 'B' for filesize in self.filesize_options]
+    """Prints a failed download's error to the console.
 
+    Returns:
+        string of the error shown in the window
+        i.e. 'No Internet'
+    """
 
-        return self.filesize_options
-
+    error_name = type(e).__name__
 
-    
-    def download(self, res, dirname=None, finished_callback=None):
+    print(f'=============================\n{error_name} OCCURED.\n=============================')
+    traceback.print_exception(type(e), e, e.__traceback__)
+    print(f'=============================\n{error_name} OCCURED.\n=============================')
 
-        """Function that downloads the video at the res specified and inside an optional directory.
-        If playlist, this function will recursively download all videos in the playlist, all with the same resolution.
-        """
+    # other common errors: pytube.exceptions.RegexMatchError, urllib.error.URLError
+    error_class = classify(e)
 
-        self.prepare_vid()
+    if error_name == 'ConnectionResetError':
+        return 'Connection Reset'
 
-        if dirname:
-            filepath = os.path.join(Path.home(), 'Downloads', dirname)
-            
-            if os.path.exists(filepath):
-                os.chdir(filepath)
+    elif error_name == 'ConnectionError':
+        return 'Connection Error'
 
-            else:
-                os.chdir(os.path.join(Path.home(), 'Downloads'))
-                os.mkdir(dirname)
-                os.chdir(filepath)
-            
-        elif dirname is None:
-            filepath = os.path.join(Path.home(), 'Downloads')
-            os.chdir(filepath)
+    elif error_class == MISSING_FFMPEG:
+        return 'ffmpeg Not Installed'
 
+    elif error_name == 'URLError':
+        return 'No Internet'
 
+    elif error_name == 'InsufficientDiskSpaceError':
+        return 'Not Enough Disk Space'
 
-        if not self.isplaylist:
-            filename = self.vid.title
+    elif error_name == 'NoSuitableStreamError':
+        return 'No Suitable Format'
 
-            filename = re.sub(r'[\\\/\:\*\?\<\>\|]', '_', filename)
-            filename = re.sub(r'[\"]', '\'', filename)
+    elif error_name == 'DownloadCancelledError':
+        return 'Download Cancelled'
 
+    elif error_name == 'PlaylistDownloadError':
+        return f'{len(e.failures)} Video(s) Failed'
 
-            if os.path.isfile('temp_video.mp4'):
-                os.remove('temp_video.mp4')
+    elif error_class == THROTTLED:
+        return 'Throttled by YouTube'
 
-            if os.path.isfile('temp_audio.mp4'):
-                os.remove('temp_audio.mp4')
+    elif error_class == UNAVAILABLE:
+        return 'Video Unavailable'
 
-            if os.path.isfile(f'{filename}.mp4'):
-                self.complete_callback(None, os.path.join(filepath, f'{filename}.mp4'))
-                return
+    return error_name
 
 
-            if not self.stream_dict:
-                if res != 'audio':
-                    self.stream_dict[res] = self.vid.streams.filter(resolution=res, adaptive=True, file_extension='mp4', type='video').first()
-                
-                    # download the highest available resolution if specified res is not available
-                    if self.stream_dict[res] is None:
-                        self.stream_dict[res] = self.vid.streams.filter(adaptive=True, file_extension='mp4', type='video').order_by('resolution').desc().first()
 
-                self.stream_dict['audio'] = self.vid.streams.filter(file_extension='mp4', type='audio')[-1]
-   
+def load_downloader():
 
-            if res != 'audio':
+    """Imports the download and mux modules (pytube, ffmpeg-python, the download engines), which take most of
+    the startup time, so that they are loaded on first use or in the background once the window is shown.
 
-                self.stream_dict[res].download(filename='temp_video')
-                self.stream_dict['audio'].download(filename='temp_audio')
+    Returns:
+        the yt_downloader class
+    """
 
-                video_stream = ffmpeg.input('temp_video.mp4')
-                audio_stream = ffmpeg.input('temp_audio.mp4')
+    from yt_downloader_core.downloader import yt_downloader
 
-                ffmpeg.output(audio_stream, video_stream, f'{filename}.mp4').run()
+    return yt_downloader
 
-                os.remove('temp_video.mp4')
-                os.remove('temp_audio.mp4')
 
 
-            else:
-                self.stream_dict['audio'].download(filename=f'{filename}')
+def load_event_loop():
 
+    """Returns the event loop thread of the asyncio download engine (see async_download.event_loop_thread.default),
+    imported on first use like load_downloader.
+    """
 
-        else:
-            for vid in self.vid:
-                vid.download(res, dirname)
+    from yt_downloader_core.async_download import event_loop_thread
 
+    return event_loop_thread.default()
 
 
 
-class Worker(QRunnable):
-    """Thread handler used to disable UI freezing during
-    downloads.
+def load_mux_pool():
 
-    Args:
-        QRunnable (QRunnable): PyQt5 class for handling thread.
+    """Returns the pool merging the videos of all playlists (see muxer.mux_queue.default), imported on first use like load_downloader.
     """
 
-    def __init__(self, fn, *args, **kwargs):
-        super(Worker, self).__init__()
-        self.fn = fn
-        self.args = args
-        self.kwargs = kwargs
-
-
-
-    @pyqtSlot()
-    def run(self):
-        try:
-            self.fn(*self.args, **self.kwargs)
-          
-        except Exception as e:
-            error_name = type(e).__name__
-
-            print(f'=============================\n{error_name} OCCURED.\n=============================')
-            traceback.print_exc()
-            print(f'=============================\n{error_name} OCCURED.\n=============================')
+    from yt_downloader_core.muxer import mux_queue
 
-            # other common errors: pytube.exceptions.RegexMatchError, urllib.error.URLError
+    return mux_queue.default()
 
-            if error_name == 'ConnectionResetError':
-                self.kwargs['finished_callback']('Connnection Reset')
 
-            elif error_name == 'ConnectionError':
-                self.kwargs['finished_callback']('Connnection Error')
 
-            elif error_name == 'FileNotFoundError':
-                self.kwargs['finished_callback']('ffmpeg Not Installed')
+class WindowSignals(QObject):
+    """Signals used by worker threads to run MainWindow callbacks on the GUI thread.
+    """
 
-            elif error_name == 'URLError':
-                self.kwargs['finished_callback']('No Internet')
+    complete = pyqtSignal(object, str)
+    mux_status = pyqtSignal(object)
+    job_finished = pyqtSignal(object, object, object)
+    size_estimate = pyqtSignal(int, object)
+    modules_loaded = pyqtSignal()
 
-            else:
-                self.kwargs['finished_callback'](error_name)
 
-            return
-        
-        self.kwargs['finished_callback']()
-
-            
 
 class MainWindow(qtw.QMainWindow):
     """The main window for the program.
 
     Args:
         qtw (QMainWindow): PyQt5 Main Window Widget
+        quiet (bool): don't print download progress to the console.
+        timings (bool): print the duration of every metadata fetch, stream download, mux, etc. to the console as JSON lines.
     """
-    def __init__(self, app, parent=None):
+
+    # progress updates per second
+    PROGRESS_INTERVAL = 10
+
+    def __init__(self, app, quiet=False, timings=False, parent=None):
         super().__init__(parent)
 
         self.app = app
+        self.quiet = quiet
+
+        # setup stage timings of all downloads, only printed if asked for
+        self.metrics = stage_metrics(self.show_stage if timings else None)
 
         # setup multithreading
         self.threadpool = QThreadPool()
@@ -269,17 +177,115 @@ class MainWindow(qtw.QMainWindow):
         self.ui = Ui_MainWindow()
         self.ui.setupUi(self)
 
+        # setup metadata cache, used to show the options of already seen videos without network access
+        # opened (and pruned) in the background with the download modules, see load_modules
+        self.metadata_cache = None
+        self.modules_loaded = False
+        self.default_res_options = [self.ui.download_setting_option.itemText(i) for i in range(self.ui.download_setting_option.count())]
+        self.default_res_index = self.ui.download_setting_option.currentIndex()
+
+        # setup index of completed downloads, videos downloaded before are hard linked instead of downloaded again
+        self.download_index = download_index()
+
+        # setup download queue, restored from the previous session
+        self.job_queue = job_queue.load()
+        self.max_concurrent_jobs = 2
+
+        # yt_downloader of each running job, job id -> yt_downloader, so that it can be cancelled
+        self.running_jobs = {}
+
+        # jobs failing with a retryable error are requeued after a backoff, job id -> retries so far
+        self.job_retry = retry_policy(max_retries=3, base_delay=5, max_delay=120)
+        self.job_tries = {}
+        # plus one thread for estimating the size of playlists
+        self.threadpool.setMaxThreadCount(max(self.threadpool.maxThreadCount(), self.max_concurrent_jobs + 1))
+
+        # bandwidth cap shared by all downloads (unlimited unless a rate is set), jobs may also have their own cap
+        self.bandwidth = token_bucket()
+
+        self.queue_status = ''
+        self.mux_status = ''
+
+        # widgets may only be updated on the GUI thread, so worker threads go through signals,
+        # and progress is only recorded by the workers then shown PROGRESS_INTERVAL times a second
+        self.signals = WindowSignals()
+        self.signals.complete.connect(self.show_complete)
+        self.signals.mux_status.connect(self.show_mux_status)
+        self.signals.job_finished.connect(self.show_finished)
+        self.signals.size_estimate.connect(self.show_size_estimate)
+        self.signals.modules_loaded.connect(self.modules_ready)
+
+        # incremented whenever the url changes, to stop the size estimate of the previous playlist
+        self.estimate_token = 0
+
+        self.progress = progress_aggregator()
+        self.last_progress_line = ''
+        self.progress_timer = QTimer(self)
+        self.progress_timer.timeout.connect(self.show_progress)
+        self.progress_timer.start(1000 // self.PROGRESS_INTERVAL)
+
+        # merge pool shared by all playlists, see load_mux_pool
+        self.mux_workers = None
+        self.mux_queue_depth = 2
+
+        # download engine of the streams: 'threads' or 'asyncio' (all downloads on one event loop thread, see load_event_loop)
+        self.engine = 'threads'
+
+        # speed limit shared by all downloads (see self.bandwidth), running downloads and the merge pool
+        self.ui.speed_limit_action.triggered.connect(self.set_speed_limit)
+        self.ui.concurrent_jobs_action.triggered.connect(self.set_concurrent_jobs)
+        self.ui.engine_action.triggered.connect(self.set_engine)
+        self.ui.mux_workers_action.triggered.connect(self.set_mux_workers)
+        self.ui.mux_queue_depth_action.triggered.connect(self.set_mux_queue_depth)
+
         self.setWindowTitle("Som's YT Downloader")
 
-        self.setFixedSize(394, 275)
+        # the Settings menu takes its height from the window
+        self.setFixedSize(394, 450 + self.ui.menubar.sizeHint().height())
 
         self.warninglist = ['Invalid URL']
         self.update_dl_ready()
 
         self.ui.custom_dir_name_check.toggled.connect(lambda state: self.custom_dir_name_enabled(state))
         self.ui.custom_dir_name_box.textChanged.connect(lambda: self.isValid_custom_dir_name(self.ui.custom_dir_name_box.text()))
+        self.ui.rate_limit_box.textChanged.connect(lambda: self.isValid_rate_limit(self.ui.rate_limit_box.text()))
         self.ui.url_box.editingFinished.connect(lambda: self.isValid_url(self.ui.url_box.text()))
+        self.ui.is_playlist_check.toggled.connect(lambda: self.show_cached_options(self.ui.url_box.text()))
         self.ui.download_button.clicked.connect(self.dl_start)
+        self.ui.queue_list.itemSelectionChanged.connect(self.update_job_buttons)
+        self.ui.remove_job_button.clicked.connect(self.remove_job)
+        self.ui.cancel_job_button.clicked.connect(self.cancel_job)
+
+        # the window is shown first, then the heavy modules load in the background and the restored downloads start
+        QTimer.singleShot(0, self.preload)
+
+
+
+    def preload(self):
+
+        # a failed import (i.e. while the app is closing and its window's signals are gone) was printed by the Worker
+        self.threadpool.start(Worker(self.load_modules, finished_callback=(lambda error_name=None, error=None: error is None and self.signals.modules_loaded.emit())))
+
+
+
+    def load_modules(self, finished_callback=None):
+
+        self.metadata_cache = metadata_cache()
+        load_downloader()
+
+
+
+    def modules_ready(self):
+
+        """Starts the downloads queued until the download modules and the metadata cache were loaded,
+        and shows the options of the url entered meanwhile.
+        """
+
+        self.modules_loaded = True
+        self.schedule_jobs()
+
+        if self.ui.url_box.text():
+            self.show_cached_options(self.ui.url_box.text())
 
 
 
@@ -331,6 +337,122 @@ class MainWindow(qtw.QMainWindow):
 
 
 
+    def isValid_rate_limit(self, rate):
+
+        """Function that determines if the user-inputted speed limit of a download is empty (no limit) or a rate like 500K or 2M.
+        """
+
+        try:
+            valid = not rate.strip() or parse_rate(rate) > 0
+        except ValueError:
+            valid = False
+
+        if valid and 'Invalid Speed Limit' in self.warninglist:
+            self.warninglist.remove('Invalid Speed Limit')
+
+        elif not valid and 'Invalid Speed Limit' not in self.warninglist:
+            self.warninglist.append('Invalid Speed Limit')
+
+        self.update_dl_ready()
+
+
+
+    def set_speed_limit(self):
+
+        """Asks for the speed limit shared by all downloads, applied right away to the running ones too.
+        An empty limit removes it.
+        """
+
+        current = self.bandwidth.rate
+        text, ok = qtw.QInputDialog.getText(self, 'Speed Limit', 'Bytes per second for all downloads, i.e. 500K or 2M (empty for none):',
+                                            text=str(current) if current else '')
+
+        if not ok:
+            return
+
+        try:
+            rate = parse_rate(text) if text.strip() else None
+        except ValueError:
+            qtw.QMessageBox.warning(self, 'Speed Limit', f'Invalid speed limit: {text}')
+            return
+
+        self.bandwidth.set_rate(rate or None)
+        self.ui.speed_limit_action.setText(f'Speed Limit: {size(rate)}B/s' if rate else 'Speed Limit: None')
+
+
+
+    def set_concurrent_jobs(self):
+
+        """Asks for the number of queued downloads running at the same time. More start right away if it grows,
+        running ones are never stopped if it shrinks.
+        """
+
+        jobs, ok = qtw.QInputDialog.getInt(self, 'Concurrent Downloads', 'Downloads running at the same time:', self.max_concurrent_jobs, 1, 16)
+
+        if not ok:
+            return
+
+        self.max_concurrent_jobs = jobs
+        # plus one thread for estimating the size of playlists
+        self.threadpool.setMaxThreadCount(max(self.threadpool.maxThreadCount(), jobs + 1))
+        self.ui.concurrent_jobs_action.setText(f'Concurrent Downloads: {jobs}')
+
+        self.schedule_jobs()
+
+
+
+    def set_engine(self):
+
+        """Asks for the download engine of the downloads started from now on.
+        """
+
+        engines = ['threads', 'asyncio']
+        engine, ok = qtw.QInputDialog.getItem(self, 'Download Engine', 'threads: a thread per connection, asyncio: all connections on one thread:',
+                                              engines, engines.index(self.engine), False)
+
+        if not ok:
+            return
+
+        self.engine = engine
+        self.ui.engine_action.setText(f'Download Engine: {engine}')
+
+
+
+    def set_mux_workers(self):
+
+        """Asks for the number of playlist videos merged at the same time, 0 for one per CPU core.
+        Merges already running finish first.
+        """
+
+        workers, ok = qtw.QInputDialog.getInt(self, 'Merge Workers', 'Videos merged at the same time (0 for one per CPU core):',
+                                              self.mux_workers or 0, 0, 64)
+
+        if not ok:
+            return
+
+        self.mux_workers = workers or None
+        load_mux_pool().configure(self.mux_workers, self.mux_queue_depth)
+        self.ui.mux_workers_action.setText(f'Merge Workers: {workers}' if workers else 'Merge Workers: Auto')
+
+
+
+    def set_mux_queue_depth(self):
+
+        """Asks for the number of downloaded videos waiting for a free merge worker before more downloads wait.
+        """
+
+        depth, ok = qtw.QInputDialog.getInt(self, 'Merge Queue Depth', 'Downloaded videos waiting to be merged before downloads wait:',
+                                            self.mux_queue_depth, 0, 64)
+
+        if not ok:
+            return
+
+        self.mux_queue_depth = depth
+        load_mux_pool().configure(self.mux_workers, self.mux_queue_depth)
+        self.ui.mux_queue_depth_action.setText(f'Merge Queue Depth: {depth}')
+
+
+
     def isValid_url(self, url):
 
         """Function that determines if user-inputted url is a valid YouTube video url.
@@ -345,66 +467,265 @@ class MainWindow(qtw.QMainWindow):
                 self.warninglist.append('Invalid URL')
 
             self.ui.url_box.setText('')
+            url = ''
 
+        self.show_cached_options(url)
         self.update_dl_ready()
 
 
 
-    def dl_start(self):
+    def show_cached_options(self, url):
 
-        """Disables UI and starts the download using multithreading.
+        """Fills the download settings with the resolutions (and filesizes as tooltips) of an already seen video or playlist.
+        Only the metadata cache is used, so this never blocks on the network. Otherwise, the default resolutions are shown,
+        and for playlists, their estimated filesizes are filled in the background.
         """
 
-        self.ui.curr_download_text.setText('Processing Download')
+        self.estimate_token += 1
+
+        # an empty url only resets the options, and so does any url until the download modules and the cache are loaded
+        # in the background (see modules_ready), so that the GUI thread never imports them
+        for_download = load_downloader()(url, isplaylist=self.ui.is_playlist_check.isChecked(), cache=self.metadata_cache, metrics=self.metrics) if url and self.modules_loaded else None
+
+        # cache lookups only, the GUI thread never waits on the network or a retry backoff
+        try:
+            cached = for_download.get_cached_options() if for_download else None
+        except sqlite3.Error:
+            cached = None
+
+        options = self.ui.download_setting_option
+        curr_res = options.currentText()
+        options.clear()
+
+        if cached:
+            for index, (res, filesize) in enumerate(cached):
+                options.addItem(res)
+                options.setItemData(index, filesize, Qt.ToolTipRole)
+
+        else:
+            options.addItems(self.default_res_options)
+            options.setCurrentIndex(self.default_res_index)
+
+            if for_download and for_download.isplaylist:
+                worker = Worker(self.estimate_playlist_size, for_download, self.estimate_token, finished_callback=(lambda *args: None))
+                self.threadpool.start(worker)
+
+        if options.findText(curr_res) != -1:
+            options.setCurrentIndex(options.findText(curr_res))
+
+
+
+    def estimate_playlist_size(self, for_download, token, finished_callback=None):
+
+        """Resolves the videos of a playlist in a worker thread, sending the refined filesize estimates
+        of the default resolutions to the GUI thread at most PROGRESS_INTERVAL times a second.
+        Stops once the url changes.
+        """
+
+        estimates = for_download.iter_size_estimates()
+        last_update = 0
+
+        try:
+            for estimate in estimates:
+                if token != self.estimate_token:
+                    return
+
+                now = time.monotonic()
+
+                if now - last_update < 1 / self.PROGRESS_INTERVAL and estimate.confidence() < 1:
+                    continue
+
+                last_update = now
+                tooltips = {}
+
+                for res in self.default_res_options:
+                    total, margin = estimate.estimate(res)
+
+                    if margin is None:
+                        continue
+
+                    if margin:
+                        tooltips[res] = f'~{size(total)}B +- {round(margin / total * 100) if total else 0}% ({estimate.resolved}/{estimate.video_count} videos)'
+                    else:
+                        tooltips[res] = f'{size(total)}B'
+
+                self.signals.size_estimate.emit(token, tooltips)
+
+        finally:
+            estimates.close()
+
+
+
+    def show_size_estimate(self, token, tooltips):
+
+        if token != self.estimate_token:
+            return
+
+        options = self.ui.download_setting_option
+
+        for res, tooltip in tooltips.items():
+            if options.findText(res) != -1:
+                options.setItemData(options.findText(res), tooltip, Qt.ToolTipRole)
+
+
+
+    def dl_start(self):
+
+        """Adds the download to the queue and starts it once there is a free slot.
+        Inputs stay enabled so that more downloads can be queued while others are running.
+        """
 
         url = self.ui.url_box.text()
-        isplaylist = self.ui.is_playlist_check.checkState()
+        isplaylist = self.ui.is_playlist_check.isChecked()
         res = self.ui.download_setting_option.currentText()
         dirname = self.ui.custom_dir_name_box.text()
+        priority = self.ui.priority_box.value()
+        rate_limit = parse_rate(self.ui.rate_limit_box.text()) if self.ui.rate_limit_box.text().strip() else None
 
-        self.ui.url_box.setEnabled(False)
-        self.ui.is_playlist_check.setEnabled(False)
-        self.ui.custom_dir_name_check.setEnabled(False)
-        self.ui.custom_dir_name_box.setEnabled(False)
-        self.ui.download_setting_option.setEnabled(False)
-        self.ui.download_button.setEnabled(False)
+        self.job_queue.add(url, isplaylist=isplaylist, res=res, dirname=dirname, priority=priority, rate_limit=rate_limit)
 
-        for_download = yt_downloader(url, isplaylist=isplaylist, progress_callback=self.show_progress, complete_callback=self.show_complete)
-        
-        if dirname:
-            worker = Worker(for_download.download, res, dirname=dirname, finished_callback=self.show_finished)
+        self.reset_inputs()
+        self.schedule_jobs()
+
+
+
+    def schedule_jobs(self):
+
+        """Starts queued downloads, highest priority first, while less than self.max_concurrent_jobs are running.
+        Downloads stay queued until the download modules are loaded, see modules_ready.
+        """
+
+        while self.modules_loaded:
+            job = self.job_queue.start_next(self.max_concurrent_jobs)
+
+            if job is None:
+                break
+
+            self.ui.curr_download_text.setText('Processing Download')
+
+            job_throttle = throttle(self.bandwidth, token_bucket(job.rate_limit) if job.rate_limit else None)
+
+            for_download = load_downloader()(job.url, isplaylist=job.isplaylist, progress_callback=self.progress.callback(job.job_id), complete_callback=self.signals.complete.emit,
+                                         cache=self.metadata_cache, mux_status_callback=self.signals.mux_status.emit, throttle=job_throttle, index=self.download_index,
+                                         metrics=self.metrics, engine=self.engine)
+            self.running_jobs[job.job_id] = for_download
+
+            # a single video on the asyncio engine is a coroutine on its event loop, which reports back through a signal
+            # instead of holding a worker thread while it downloads
+            if self.engine == 'asyncio' and not job.isplaylist:
+                future = load_event_loop().submit(for_download.download_async(job.res, job.dirname))
+                future.add_done_callback(lambda future, job=job: self.job_done(job, future))
+                continue
+
+            worker = Worker(for_download.download, job.res, dirname=job.dirname, finished_callback=(lambda error_name=None, error=None, job=job: self.signals.job_finished.emit(job, error_name, error)))
+
+            self.threadpool.start(worker)
+
+        self.show_queue_status()
+
+
+
+    def job_done(self, job, future):
+
+        """Done callback of a download running on the event loop, called on the loop's thread.
+        """
+
+        error = future.exception() if not future.cancelled() else None
+
+        if error is None:
+            self.signals.job_finished.emit(job, None, None)
         else:
-            worker = Worker(for_download.download, res, finished_callback=self.show_finished)
+            self.signals.job_finished.emit(job, error_message(error), error)
+
 
-        self.threadpool.start(worker)
 
+    def reset_inputs(self):
+
+        self.ui.url_box.setText('')
+        self.isValid_url('')
+
+        self.ui.custom_dir_name_check.setCheckState(False)
+        self.ui.is_playlist_check.setCheckState(False)
+        self.ui.priority_box.setValue(0)
+        self.ui.rate_limit_box.setText('')
+
+        self.update_dl_ready()
 
 
-    def show_progress(self, stream, chunk, bytes_remaining):
 
-        """Callback function to show download progress.
+    def show_progress(self):
+
+        """Shows the progress of the oldest running download, with its speed and time left.
+        Called by self.progress_timer on the GUI thread.
         """
 
-        progress = round((((stream.filesize - bytes_remaining) / stream.filesize) * 100), 2)
-        
-        if stream.type == 'video':
-            print(f'Downloading [video]: {stream.title} || {progress}')
-            title = f'[video] {stream.title}'
+        snapshots = self.progress.snapshot()
+
+        if not snapshots:
+            return
+
+        job = snapshots[0]
+        progress = job.percent
+
+        if job.type == 'playlist':
+            line = f'Downloading [playlist]: {job.completed}/{job.total} videos || {progress}'
+            title = f'[{job.completed}/{job.total}] {job.title}'
+
+        elif job.type == 'video+audio':
+            line = f'Downloading [video+audio]: {job.title} || {progress}'
+            if progress < 99:
+                title = f'[video+audio] {job.title}'
+            else:
+                title = f'[compiling] {job.title}'
+
+        elif job.type == 'video':
+            line = f'Downloading [video]: {job.title} || {progress}'
+            title = f'[video] {job.title}'
         else:
-            print(f'Downloading [audio]: {stream.title} || {progress}')
+            line = f'Downloading [audio]: {job.title} || {progress}'
             if progress < 99:
-                title = f'[audio] {stream.title}'
+                title = f'[audio] {job.title}'
             else:
-                title = f'[compiling] {stream.title}'
+                title = f'[compiling] {job.title}'
 
-            
-        self.ui.progress_text.setText(f'{progress} %')
+        details = [f'{size(int(job.speed))}B/s']
+
+        if job.eta is not None and progress < 100:
+            minutes, seconds = divmod(int(job.eta), 60)
+            details.append(f'{minutes}:{seconds:02} left')
+
+        self.ui.progress_text.setText(f'{progress} % ({", ".join(details)})')
 
         if len(title) > 30:
             title = title[:29] + '...'
 
         self.ui.curr_download_text.setText(title)
 
+        if not self.quiet and line != self.last_progress_line:
+            print(line)
+            self.last_progress_line = line
+
+
+
+    def show_mux_status(self, queue):
+
+        """Callback function to show the state of the merge queue shared by the playlists.
+        """
+
+        if queue.running or queue.pending:
+            self.mux_status = f'Merging: {queue.running}/{queue.workers} running, {queue.pending} queued'
+        else:
+            self.mux_status = ''
+
+        self.update_statusbar()
+
+
+
+    def show_stage(self, event):
+
+        # called from worker threads, only prints
+        print(json.dumps(event))
+
 
 
     def show_complete(self, stream, filepath):
@@ -415,45 +736,147 @@ class MainWindow(qtw.QMainWindow):
         if self.ui.progress_text.text() != '100.0 %':
             self.ui.progress_text.setText('100.0 %')
 
+        if self.quiet:
+            return
+
         print('=============================')
         print(f'Downloaded Path: {filepath}')
         print('=============================')
 
 
 
-    def show_finished(self, error_name=None):
+    def show_finished(self, job, error_name=None, error=None):
 
-        """Callback function to show that the full download of a single video or playlist is completed.
+        """Callback function to show that the full download of a single video or playlist is completed,
+        then starts the next queued downloads.
+        Jobs failing with a retryable error (i.e. a dropped connection) that was not already retried while downloading
+        are requeued after a backoff, up to self.job_retry.max_retries times.
         """
 
+        self.progress.remove(job.job_id)
+        self.running_jobs.pop(job.job_id, None)
+        tries = self.job_tries.pop(job.job_id, 0)
+
         if error_name is None:
             self.ui.curr_download_text.setText('Download Complete')
+            self.job_queue.finish(job)
 
-        elif error_name == 'Connection Reset':
-            self.ui.curr_download_text.setText('Connection Reset. Restarting...')
-            self.dl_start()
-            return
+        # a playlist's failed videos were already retried one by one, the download index skips the others anyway
+        elif error is not None and type(error).__name__ != 'PlaylistDownloadError' and self.job_retry.should_retry(error, tries):
+            delay = self.job_retry.delay(error, tries)
+            self.job_tries[job.job_id] = tries + 1
+
+            # the job keeps its slot until it is requeued
+            self.ui.curr_download_text.setText(f'{error_name}. Retrying in {delay:.0f} s...')
+            QTimer.singleShot(int(delay * 1000), lambda job=job: self.retry_job(job))
 
         else:
             if len(error_name) > 30:
                 error_name = error_name[:29] + '...'
             self.ui.curr_download_text.setText(error_name)
+            self.job_queue.finish(job)
 
-        self.ui.url_box.setText('')
-        self.isValid_url('')
+        self.schedule_jobs()
 
-        self.ui.custom_dir_name_check.setCheckState(False)
-        self.ui.is_playlist_check.setCheckState(False)
 
 
-        self.ui.url_box.setEnabled(True)
-        self.ui.is_playlist_check.setEnabled(True)
-        self.ui.custom_dir_name_check.setEnabled(True)
-        self.ui.download_setting_option.setEnabled(True)
-        self.ui.download_button.setEnabled(True)
+    def retry_job(self, job):
 
+        # cancelled while waiting
+        if self.job_queue.get(job.job_id) is None:
+            return
 
-        self.update_dl_ready()
+        self.job_queue.requeue(job)
+        self.schedule_jobs()
+
+
+
+    def show_queue_status(self):
+
+        running = self.job_queue.count('running')
+        queued = self.job_queue.count('queued')
+
+        self.queue_status = f'Queue: {running} running, {queued} waiting' if running or queued else ''
+        self.update_statusbar()
+        self.show_queue()
+
+
+
+    def show_queue(self):
+
+        """Lists the running downloads, then the queued ones in the order they will start, keeping the selection.
+        """
+
+        queue_list = self.ui.queue_list
+        selected = self.selected_job_id()
+        queue_list.clear()
+
+        for job in self.job_queue.ordered():
+            kind = 'playlist' if job.isplaylist else 'video'
+            item = qtw.QListWidgetItem(f'[{job.state}] {job.url} ({kind}, {job.res}, priority {job.priority})')
+            item.setData(Qt.UserRole, job.job_id)
+            item.setToolTip(job.url)
+            queue_list.addItem(item)
+
+            if job.job_id == selected:
+                item.setSelected(True)
+
+        self.update_job_buttons()
+
+
+
+    def selected_job_id(self):
+
+        items = self.ui.queue_list.selectedItems()
+
+        return items[0].data(Qt.UserRole) if items else None
+
+
+
+    def update_job_buttons(self):
+
+        job = self.job_queue.get(self.selected_job_id())
+
+        self.ui.remove_job_button.setEnabled(job is not None and job.state == 'queued')
+        self.ui.cancel_job_button.setEnabled(job is not None and job.state == 'running')
+
+
+
+    def remove_job(self):
+
+        self.job_queue.remove(self.selected_job_id())
+        self.show_queue_status()
+
+
+
+    def cancel_job(self):
+
+        """Stops the selected running download at its next chunk; show_finished removes it from the queue once it stops.
+        A download waiting to be retried is removed right away.
+        """
+
+        job = self.job_queue.get(self.selected_job_id())
+
+        if job is None or job.state != 'running':
+            return
+
+        for_download = self.running_jobs.get(job.job_id)
+
+        if for_download is not None:
+            for_download.cancel()
+            self.ui.curr_download_text.setText('Cancelling Download')
+
+        else:
+            self.job_tries.pop(job.job_id, None)
+            self.job_queue.finish(job)
+
+        self.show_queue_status()
+
+
+
+    def update_statusbar(self):
+
+        self.ui.statusbar.showMessage(' | '.join(status for status in (self.queue_status, self.mux_status) if status))
 
 
 
@@ -463,7 +886,7 @@ def main():
     os.chdir(os.path.dirname(sys.argv[0]))
 
     app = qtw.QApplication(sys.argv)
-    window = MainWindow(app)
+    window = MainWindow(app, quiet=('--quiet' in sys.argv or '-q' in sys.argv), timings=('--timings' in sys.argv))
 
     window.show()
     sys.exit(app.exec_())
@@ -0,0 +1,75 @@
+"""Fixtures shared by the tests: a local fake YouTube server (see benchmarks/fake_youtube.py) serving stub media,
+so that the tests need neither the network nor ffmpeg, and a per-test home directory.
+"""
+
+import os, sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+import fake_youtube
+from yt_downloader_core.retry import circuit_breaker, retry_policy
+
+
+
+@pytest.fixture(autouse=True)
+def home(tmp_path, monkeypatch):
+
+    """Points the home, data and cache directories at the test's temp dir, downloads land in its Downloads dir.
+    """
+
+    home = tmp_path / 'home'
+    home.mkdir()
+
+    for name in ('HOME', 'USERPROFILE'):
+        monkeypatch.setenv(name, str(home))
+
+    monkeypatch.setenv('XDG_DATA_HOME', str(home / 'data'))
+    monkeypatch.setenv('XDG_CACHE_HOME', str(home / 'cache'))
+
+    return home
+
+
+
+@pytest.fixture(scope='session')
+def media(tmp_path_factory):
+
+    """Returns the (video, audio) bytes served by the fake servers.
+    """
+
+    video_path, audio_path = fake_youtube.make_stub_media(str(tmp_path_factory.mktemp('media')), 2, '200k')
+
+    with open(video_path, 'rb') as fh:
+        video = fh.read()
+
+    with open(audio_path, 'rb') as fh:
+        audio = fh.read()
+
+    return video, audio
+
+
+
+@pytest.fixture(scope='session')
+def fake_server(media):
+
+    """Returns a fake YouTube server which pytube is pointed at for the whole session.
+    """
+
+    server = fake_youtube.fake_youtube_server(*media).start()
+    fake_youtube.use_fake_youtube(server.base_url)
+
+    yield server
+
+    server.shutdown()
+
+
+
+@pytest.fixture
+def retry():
+
+    """Returns a retry_policy with short delays and its own circuit breaker, so that tests don't trip each other's.
+    """
+
+    return retry_policy(max_retries=2, base_delay=0.01, max_delay=0.05, throttled_delay=0.01, breaker=circuit_breaker())
@@ -0,0 +1,365 @@
+import io, struct
+
+import pytest
+
+from yt_downloader_core.audio import UnsupportedAudioError, ogg_crc, ogg_opus_writer, tag_mp4, webm_to_opus
+
+
+TAGS = {'title': 'Benchmark Video', 'artist': 'benchmark'}
+
+# boxes holding the sample tables of the stub media
+CONTAINERS = (b'moov', b'trak', b'mdia', b'minf', b'stbl')
+
+
+
+def boxes(data, start=0, end=None):
+
+    """Yields the (type, payload start, end) of the boxes of data between start and end.
+    """
+
+    end = len(data) if end is None else end
+
+    while start < end:
+        size, kind = struct.unpack_from('>I4s', data, start)
+        yield kind, start + 8, start + size
+        start += size
+
+
+
+def rebuild(data, transform, start=0, end=None):
+
+    """Returns the boxes of data with the payloads of the sample table boxes replaced by transform(type, payload) -> (type, payload).
+    """
+
+    rebuilt = b''
+
+    for kind, payload, box_end in boxes(data, start, end):
+        if kind in CONTAINERS:
+            body = rebuild(data, transform, payload, box_end)
+        else:
+            kind, body = transform(kind, data[payload:box_end])
+
+        rebuilt += struct.pack('>I4s', 8 + len(body), kind) + body
+
+    return rebuilt
+
+
+
+def sample_table(data):
+
+    """Returns the (chunk offsets, sample size) of the single track of a stub mp4 file.
+    """
+
+    found = {}
+
+    def collect(kind, payload):
+        found[kind] = payload
+        return kind, payload
+
+    rebuild(data, collect)
+    count = struct.unpack_from('>I', found.get(b'stco', found.get(b'co64')), 4)[0]
+    offsets = struct.unpack_from(f'>{count}I', found[b'stco'], 8) if b'stco' in found else struct.unpack_from(f'>{count}Q', found[b'co64'], 8)
+
+    return list(offsets), struct.unpack_from('>I', found[b'stsz'], 4)[0]
+
+
+
+def shifted_offsets(data, delta, wide=False):
+
+    """Returns the boxes of data with delta added to the chunk offsets, stored in a co64 box if wide is set.
+    """
+
+    def shift(kind, payload):
+        if kind != b'stco':
+            return kind, payload
+
+        count = struct.unpack_from('>I', payload, 4)[0]
+        offsets = [offset + delta for offset in struct.unpack_from(f'>{count}I', payload, 8)]
+
+        if wide:
+            return b'co64', payload[:8] + struct.pack(f'>{count}Q', *offsets)
+
+        return kind, payload[:8] + struct.pack(f'>{count}I', *offsets)
+
+    return rebuild(data, shift)
+
+
+
+def top_boxes(data):
+
+    return {kind: data[payload - 8:end] for kind, payload, end in boxes(data)}
+
+
+
+def assert_samples(data):
+
+    """Checks that every chunk offset points at its sample, every byte of sample i being i % 256 (see make_stub_media).
+    """
+
+    offsets, sample_size = sample_table(data)
+
+    assert offsets
+
+    for i, offset in enumerate(offsets):
+        assert data[offset:offset + sample_size] == bytes([i % 256]) * sample_size
+
+
+
+@pytest.fixture
+def audio(media):
+
+    assert_samples(media[1])
+
+    return media[1]
+
+
+
+def tag(tmp_path, data, tags=TAGS):
+
+    input_path, output_path = tmp_path / 'input.mp4', tmp_path / 'output.mp4'
+    input_path.write_bytes(data)
+    tag_mp4(str(input_path), str(output_path), tags)
+
+    return output_path.read_bytes()
+
+
+
+def test_tag_shifts_chunk_offsets(tmp_path, audio):
+
+    tagged = tag(tmp_path, audio)
+    delta = len(tagged) - len(audio)
+    moov = top_boxes(tagged)[b'moov']
+
+    assert delta > 0
+    assert sample_table(tagged)[0] == [offset + delta for offset in sample_table(audio)[0]]
+    assert b'\xa9nam' in moov and b'Benchmark Video' in moov and b'\xa9ART' in moov
+    assert_samples(tagged)
+
+
+
+def test_tag_replaces_tags(tmp_path, audio):
+
+    tagged = tag(tmp_path, tag(tmp_path, audio), {'title': 'Other Title'})
+    moov = top_boxes(tagged)[b'moov']
+
+    assert moov.count(b'udta') == 1
+    assert b'Other Title' in moov and b'Benchmark Video' not in moov and b'\xa9ART' not in moov
+    assert_samples(tagged)
+
+
+
+def test_tag_keeps_offsets_before_moov(tmp_path, audio):
+
+    # moov after mdat, the samples don't move
+    parts = top_boxes(audio)
+    moov = shifted_offsets(parts[b'moov'], -len(parts[b'moov']))
+    moov_last = parts[b'ftyp'] + parts[b'mdat'] + moov
+    assert_samples(moov_last)
+
+    tagged = tag(tmp_path, moov_last)
+
+    assert sample_table(tagged)[0] == sample_table(moov_last)[0]
+    assert_samples(tagged)
+
+
+
+def test_tag_shifts_64_bit_chunk_offsets(tmp_path, audio):
+
+    # co64 entries are 4 bytes longer than stco's, the samples move with the moov
+    parts = top_boxes(audio)
+    count = len(sample_table(audio)[0])
+    wide = parts[b'ftyp'] + shifted_offsets(parts[b'moov'], 4 * count, wide=True) + parts[b'mdat']
+    assert_samples(wide)
+
+    tagged = tag(tmp_path, wide)
+
+    assert b'co64' in top_boxes(tagged)[b'moov']
+    assert_samples(tagged)
+
+
+
+def test_tag_without_moov(tmp_path, audio):
+
+    with pytest.raises(UnsupportedAudioError):
+        tag(tmp_path, top_boxes(audio)[b'ftyp'])
+
+
+
+# OpusHead of a stereo 48 kHz stream, as in a webm track's CodecPrivate
+OPUS_HEAD = b'OpusHead' + struct.pack('<BBHIhB', 1, 2, 312, 48000, 0, 0)
+
+# TOC byte of a single 20 ms frame, 960 samples at 48 kHz
+FRAME_TOC = 0x08
+
+
+
+def opus_packet(i, size=20):
+
+    return bytes([FRAME_TOC]) + bytes([i % 256]) * (size - 1)
+
+
+
+def ogg_pages(data):
+
+    """Yields the (header type, granule, packets) of the pages of an Ogg file, checking their CRC.
+    """
+
+    pos = 0
+
+    while pos < len(data):
+        magic, version, header_type, granule, serial, sequence, crc, count = struct.unpack_from('<4sBBqIIIB', data, pos)
+        lacing = data[pos + 27:pos + 27 + count]
+        page = bytearray(data[pos:pos + 27 + count + sum(lacing)])
+
+        assert magic == b'OggS'
+        struct.pack_into('<I', page, 22, 0)
+        assert ogg_crc(bytes(page)) == crc
+
+        packets = []
+        packet = b''
+        body = pos + 27 + count
+
+        for value in lacing:
+            packet += data[body:body + value]
+            body += value
+
+            if value < 255:
+                packets.append(packet)
+                packet = b''
+
+        yield header_type, granule, packets
+        pos += len(page)
+
+
+
+def test_ogg_crc():
+
+    # CRC-32 with polynomial 0x04C11DB7, no reflection, no initial or final xor
+    assert ogg_crc(b'123456789') == 0x89A1897F
+    assert ogg_crc(b'') == 0
+
+
+
+def test_ogg_opus_writer_pages():
+
+    fh = io.BytesIO()
+    writer = ogg_opus_writer(fh, OPUS_HEAD, {'title': 'Benchmark Video', 'artist': 'benchmark', 'comment': None})
+    packets = [opus_packet(i) for i in range(60)]
+
+    for packet in packets:
+        writer.write(packet)
+
+    writer.discard = 312
+    writer.close()
+
+    pages = list(ogg_pages(fh.getvalue()))
+
+    assert pages[0] == (0x02, 0, [OPUS_HEAD])
+    assert pages[1][2][0].startswith(b'OpusTags') and b'TITLE=Benchmark Video' in pages[1][2][0] and b'COMMENT' not in pages[1][2][0]
+
+    # a second of audio per page, the last one ends at the last sample kept
+    assert [(header_type, granule, len(page_packets)) for header_type, granule, page_packets in pages[2:]] == [(0, 50 * 960, 50), (0x04, 60 * 960 - 312, 10)]
+    assert [packet for page in pages[2:] for packet in page[2]] == packets
+
+
+
+def test_ogg_opus_writer_lacing():
+
+    fh = io.BytesIO()
+    writer = ogg_opus_writer(fh, OPUS_HEAD, {}, page_samples=float('inf'))
+
+    # packets of 255 bytes end with a 0 lacing value, a page holds at most 255 lacing values
+    packets = [opus_packet(i, 255) for i in range(150)] + [opus_packet(150, 600)]
+
+    for packet in packets:
+        writer.write(packet)
+
+    writer.close()
+
+    pages = list(ogg_pages(fh.getvalue()))[2:]
+
+    assert [len(page_packets) for header_type, granule, page_packets in pages] == [127, 24]
+    assert [packet for page in pages for packet in page[2]] == packets
+
+
+
+def ebml(element_id, payload=b'', unknown_size=False):
+
+    """Returns a Matroska element, its size an 8 byte EBML integer (or the unknown size).
+    """
+
+    size = b'\x01\xff\xff\xff\xff\xff\xff\xff' if unknown_size else b'\x01' + len(payload).to_bytes(7, 'big')
+
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big') + size + payload
+
+
+
+def block(track, packet, flags=0x80):
+
+    # track number, timecode, flags
+    return bytes([0x80 | track]) + b'\x00\x00' + bytes([flags]) + packet
+
+
+
+def make_webm(packets, discard_padding=0, codec=b'A_OPUS', laced=False):
+
+    """Returns a webm file with a video track 1 and an opus track 2 holding the packets, the last one in a BlockGroup
+    with its DiscardPadding (in nanoseconds).
+    """
+
+    tracks = ebml(0x1654AE6B, ebml(0xAE, ebml(0xD7, b'\x01') + ebml(0x86, b'V_VP9'))
+                  + ebml(0xAE, ebml(0xD7, b'\x02') + ebml(0x86, codec) + ebml(0x63A2, OPUS_HEAD)))
+
+    blocks = b''
+
+    for packet in packets[:-1]:
+        blocks += ebml(0xA3, block(1, b'video frame')) + ebml(0xA3, block(2, packet, 0x86 if laced else 0x80))
+
+    last = ebml(0xA1, block(2, packets[-1], 0))
+
+    if discard_padding:
+        last += ebml(0x75A2, discard_padding.to_bytes(4, 'big'))
+
+    # a Cluster with its Timecode, which is skipped
+    cluster = ebml(0x1F43B675, ebml(0xE7, b'\x00') + blocks + ebml(0xA0, last))
+
+    # EBML header, then a Segment of unknown size as written by live encoders
+    return ebml(0x1A45DFA3, ebml(0x4282, b'webm')) + ebml(0x18538067, ebml(0x1549A966, b'\x00' * 16) + tracks + cluster, unknown_size=True)
+
+
+
+def repack(tmp_path, webm, tags=TAGS):
+
+    input_path, output_path = tmp_path / 'input.webm', tmp_path / 'output.opus'
+    input_path.write_bytes(webm)
+    webm_to_opus(str(input_path), str(output_path), tags)
+
+    return output_path.read_bytes()
+
+
+
+def test_webm_to_opus(tmp_path):
+
+    packets = [opus_packet(i) for i in range(60)]
+
+    # 6.5 ms of padding, 312 samples at 48 kHz
+    pages = list(ogg_pages(repack(tmp_path, make_webm(packets, discard_padding=6500000))))
+
+    assert pages[0][2] == [OPUS_HEAD]
+    assert b'TITLE=Benchmark Video' in pages[1][2][0] and b'ARTIST=benchmark' in pages[1][2][0]
+
+    # only the opus track's packets
+    assert [packet for page in pages[2:] for packet in page[2]] == packets
+    assert pages[-1][0] == 0x04 and pages[-1][1] == 60 * 960 - 312
+
+
+
+@pytest.mark.parametrize('webm', [
+    make_webm([opus_packet(0)], codec=b'A_VORBIS'),
+    make_webm([opus_packet(0), opus_packet(1)], laced=True),
+    ebml(0x1A45DFA3, ebml(0x4282, b'webm')),
+])
+def test_webm_to_opus_unsupported(tmp_path, webm):
+
+    with pytest.raises(UnsupportedAudioError):
+        repack(tmp_path, webm)
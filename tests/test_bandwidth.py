@@ -0,0 +1,122 @@
+from datetime import datetime
+import threading, time
+
+import pytest
+
+import fake_youtube
+from yt_downloader_core.async_download import async_downloader
+from yt_downloader_core.bandwidth import bandwidth_schedule, parse_rate, throttle, token_bucket
+from yt_downloader_core.segmented_download import segmented_downloader
+
+
+ENGINES = {'threads': segmented_downloader, 'asyncio': async_downloader}
+RATE = 64 * 1024
+
+
+
+@pytest.fixture
+def media_server(media):
+
+    server = fake_youtube.fake_youtube_server(*media).start()
+
+    yield server
+
+    server.shutdown()
+
+
+
+def assert_rate(elapsed, size, rate, burst=0.1):
+
+    """Checks that size bytes took as long as the rate allows, once the burst of an idle bucket is used up.
+    """
+
+    expected = (size - rate * burst) / rate
+
+    assert expected * 0.9 <= elapsed <= expected * 1.3 + 0.2
+
+
+
+def test_parse_rate():
+
+    assert parse_rate('500K') == 500 * 1024
+    assert parse_rate('1.5MB') == 1536 * 1024
+    assert parse_rate(' 2m ') == 2 * 1024 ** 2
+    assert parse_rate('1000') == 1000
+
+    with pytest.raises(ValueError):
+        parse_rate('fast')
+
+
+
+def test_schedule():
+
+    schedule = bandwidth_schedule.parse('09:00-17:00=1M, 22:00-06:00=5M', default=100)
+
+    assert schedule.rate_at(datetime(2024, 1, 1, 12, 0)) == 1024 ** 2
+    assert schedule.rate_at(datetime(2024, 1, 1, 23, 30)) == 5 * 1024 ** 2
+    assert schedule.rate_at(datetime(2024, 1, 1, 5, 59)) == 5 * 1024 ** 2
+    assert schedule.rate_at(datetime(2024, 1, 1, 17, 0)) == 100
+
+
+
+def test_bucket_shared_by_threads():
+
+    bucket = token_bucket(RATE)
+    chunk, chunks, threads = 4096, 8, 4
+
+    def consume():
+        for i in range(chunks):
+            bucket.consume(chunk)
+
+    start = time.monotonic()
+    workers = [threading.Thread(target=consume) for i in range(threads)]
+
+    for worker in workers:
+        worker.start()
+
+    for worker in workers:
+        worker.join()
+
+    assert_rate(time.monotonic() - start, chunk * chunks * threads, RATE)
+
+
+
+def test_unlimited_bucket():
+
+    bucket = token_bucket()
+
+    assert bucket.reserve(10 ** 9) == 0
+
+    bucket.set_rate(RATE)
+
+    assert bucket.reserve(RATE) > 0.5
+
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_download_rate(engine, retry, media_server, tmp_path):
+
+    video = media_server.video
+    url = f'{media_server.base_url}/media/v0000000000/134'
+    downloader = ENGINES[engine](connections=4, segment_size=8 * 1024, throttle=throttle(token_bucket(RATE)), retry=retry)
+
+    start = time.monotonic()
+    downloader.download(url, str(tmp_path / 'video.mp4'), len(video))
+
+    assert_rate(time.monotonic() - start, len(video), RATE)
+    assert (tmp_path / 'video.mp4').read_bytes() == video
+
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_slowest_bucket_wins(engine, retry, media_server, tmp_path):
+
+    # a fast global cap and a slower per-job one
+    video = media_server.video
+    url = f'{media_server.base_url}/media/v0000000000/134'
+    downloader = ENGINES[engine](connections=4, segment_size=8 * 1024, throttle=throttle(token_bucket(4 * RATE), token_bucket(RATE)), retry=retry)
+
+    start = time.monotonic()
+    downloader.download(url, str(tmp_path / 'video.mp4'), len(video))
+
+    assert_rate(time.monotonic() - start, len(video), RATE)
@@ -0,0 +1,171 @@
+import os, threading, time
+from types import SimpleNamespace
+
+import pytest
+
+from yt_downloader_core import disk_space
+from yt_downloader_core.disk_space import InsufficientDiskSpaceError, allocated_bytes, disk_budget, preallocate
+
+
+
+@pytest.fixture
+def free_space(monkeypatch):
+
+    """Fakes the free space of every filesystem, set with free_space['bytes'].
+    """
+
+    free = {'bytes': 0}
+    monkeypatch.setattr(disk_space.shutil, 'disk_usage', lambda path: SimpleNamespace(free=free['bytes']))
+    monkeypatch.setattr(disk_space, 'WAIT_INTERVAL', 0.05)
+
+    return free
+
+
+
+@pytest.fixture
+def dirs(tmp_path):
+
+    # the temp directory doesn't exist yet, its parent's filesystem is checked
+    return str(tmp_path / 'temp_abc'), str(tmp_path)
+
+
+
+def reserve_in_background(budget, dirs, size):
+
+    """Starts reserving in a thread, returns the list the reservation is appended to once it fits, and the thread.
+    """
+
+    reserved = []
+    thread = threading.Thread(target=(lambda: reserved.append(budget.reserve(*dirs, size))), daemon=True)
+    thread.start()
+
+    return reserved, thread
+
+
+
+def test_reserve_and_release(free_space, dirs):
+
+    free_space['bytes'] = 1000
+    budget = disk_budget(min_free=0)
+
+    # the streams plus the merged file while muxing, the final file is moved on the same filesystem
+    with budget.reserve(*dirs, 400) as reservation:
+        assert reservation.total == 800
+        assert budget._reservations == [reservation]
+
+    assert budget._reservations == []
+
+    # muxed through pipes
+    assert budget.reserve(*dirs, 1000, mux_factor=1).total == 1000
+
+
+
+def test_reserve_fails_if_it_can_never_fit(free_space, dirs):
+
+    free_space['bytes'] = 1000
+    budget = disk_budget(min_free=100)
+
+    with pytest.raises(InsufficientDiskSpaceError) as error:
+        budget.reserve(*dirs, 500)
+
+    assert (error.value.needed, error.value.available) == (1000, 900)
+    assert budget._reservations == []
+
+
+
+def test_reserve_waits_for_running_downloads(free_space, dirs):
+
+    free_space['bytes'] = 1000
+    budget = disk_budget(min_free=0)
+    first = budget.reserve(*dirs, 400)
+
+    reserved, thread = reserve_in_background(budget, dirs, 300)
+    time.sleep(0.2)
+
+    assert reserved == []
+
+    # a smaller download that fits goes first
+    small = budget.reserve(*dirs, 100)
+    first.release()
+    thread.join(5)
+
+    assert len(reserved) == 1 and budget._reservations == [small, reserved[0]]
+
+
+
+def test_budget_caps_running_downloads(free_space, dirs):
+
+    free_space['bytes'] = 10 ** 9
+    budget = disk_budget(budget=1000, min_free=0)
+    first = budget.reserve(*dirs, 300)
+
+    reserved, thread = reserve_in_background(budget, dirs, 300)
+    time.sleep(0.2)
+
+    assert reserved == []
+
+    first.release()
+    thread.join(5)
+    reserved[0].release()
+
+    # larger than the whole budget, it runs alone
+    assert budget.reserve(*dirs, 1000).total == 2000
+
+
+
+def test_written_bytes_are_not_reserved_again(free_space, dirs):
+
+    work_dir, output_dir = dirs
+    free_space['bytes'] = 10 ** 9
+    budget = disk_budget(min_free=0)
+    reservation = budget.reserve(work_dir, output_dir, 100000)
+    device = os.stat(output_dir).st_dev
+
+    assert reservation.pending(device) == 200000
+
+    # i.e. a resumed download's temp files
+    os.makedirs(work_dir)
+
+    with open(os.path.join(work_dir, 'video.mp4'), 'wb') as fh:
+        fh.write(b'\0' * 65536)
+        fh.flush()
+        os.fsync(fh.fileno())
+
+    assert reservation.pending(device) == 200000 - allocated_bytes(work_dir)
+    assert allocated_bytes(work_dir) >= 65536
+
+
+
+def test_check(free_space, dirs):
+
+    budget = disk_budget(min_free=0)
+
+    # all final files plus the largest download's streams while it is muxed, on the same filesystem
+    free_space['bytes'] = 1000 + 300
+    budget.check(*dirs, 1000, 300)
+
+    free_space['bytes'] -= 1
+
+    with pytest.raises(InsufficientDiskSpaceError) as error:
+        budget.check(*dirs, 1000, 300)
+
+    assert error.value.needed == 1300
+
+    # next to the space still to be written by a running download
+    free_space['bytes'] = 2000
+    budget.reserve(*dirs, 400)
+
+    with pytest.raises(InsufficientDiskSpaceError):
+        budget.check(*dirs, 1000, 300)
+
+
+
+def test_preallocate(tmp_path):
+
+    path = tmp_path / 'video.mp4'
+
+    with open(path, 'wb') as fh:
+        preallocate(fh, 100000)
+
+    assert os.path.getsize(path) == 100000
+    assert allocated_bytes(str(tmp_path / 'missing')) == 0
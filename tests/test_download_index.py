@@ -0,0 +1,156 @@
+import os
+
+import pytest
+
+from yt_downloader_core.download_index import download_index
+from yt_downloader_core.downloader import yt_downloader
+
+
+VIDEO_URL = 'https://www.youtube.com/watch?v=v0000000000'
+
+
+
+@pytest.fixture
+def index(tmp_path):
+
+    index = download_index(str(tmp_path / 'downloads.sqlite3'))
+
+    yield index
+
+    index.close()
+
+
+
+def write(path, data):
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, 'wb') as fh:
+        fh.write(data)
+
+    return str(path)
+
+
+
+def test_find(index, tmp_path):
+
+    first = write(tmp_path / 'a' / 'video.mp4', b'video')
+    second = write(tmp_path / 'b' / 'video.mp4', b'video')
+    index.add('abc', '720p', first)
+    index.add('abc', '720p', second)
+
+    assert index.find('abc', '720p') == first
+    assert index.find_all('abc', '720p') == [first, second]
+    assert index.find('abc', '360p') is None
+    assert index.find('other', '720p') is None
+
+
+
+def test_changed_and_deleted_files_are_dropped(index, tmp_path):
+
+    resized = write(tmp_path / 'a' / 'video.mp4', b'video')
+    rewritten = write(tmp_path / 'b' / 'video.mp4', b'video')
+    deleted = write(tmp_path / 'c' / 'video.mp4', b'video')
+
+    for path in (resized, rewritten, deleted):
+        index.add('abc', '720p', path)
+
+    write(resized, b'longer video')
+    write(rewritten, b'VIDEO')
+    os.remove(deleted)
+
+    # same size, only told apart by its hash
+    assert index.find_all('abc', '720p') == [rewritten]
+    assert index.find_all('abc', '720p', verify=True) == []
+    assert index.find_all('abc', '720p') == []
+
+
+
+def test_remove(index, tmp_path):
+
+    path = write(tmp_path / 'video.mp4', b'video')
+    other = write(tmp_path / 'other.mp4', b'video')
+    index.add('abc', '720p', path)
+    index.add('abc', '720p', other)
+    index.add('abc', 'audio', path)
+
+    index.remove('abc', '720p', path)
+    assert index.find_all('abc', '720p') == [other]
+
+    index.remove('abc', '720p')
+    assert index.find('abc', '720p') is None
+    assert index.find('abc', 'audio') == path
+
+    index.remove('abc')
+    assert index.find('abc', 'audio') is None
+
+
+
+@pytest.mark.parametrize('mode, linked', [('hardlink', True), ('copy', False)])
+def test_place(index, tmp_path, mode, linked):
+
+    existing = write(tmp_path / 'a' / 'video.mp4', b'video')
+    index.add('abc', '720p', existing)
+    output = str(tmp_path / 'b' / 'video.mp4')
+
+    assert index.place('abc', '720p', existing, output, mode) == output
+    assert open(output, 'rb').read() == b'video'
+    assert os.path.samefile(existing, output) == linked
+    assert index.find_all('abc', '720p') == [existing, output]
+
+    with pytest.raises(ValueError):
+        index.place('abc', '720p', existing, str(tmp_path / 'c' / 'video.mp4'), 'move')
+
+
+
+def download(index, retry, dedupe, dirname):
+
+    """Downloads the audio of a fake video into dirname, returning the path reported as complete.
+    """
+
+    completed = []
+    vid = yt_downloader(VIDEO_URL, complete_callback=lambda stream, path: completed.append(path), index=index, dedupe=dedupe, retry=retry)
+    vid.download('audio', dirname)
+
+    return completed[0]
+
+
+
+@pytest.mark.parametrize('dedupe, linked', [('hardlink', True), ('copy', False)])
+def test_indexed_video_is_not_downloaded_again(fake_server, index, retry, home, dedupe, linked):
+
+    first = download(index, retry, dedupe, 'first')
+    requests = fake_server.requests
+    second = download(index, retry, dedupe, 'second')
+
+    assert os.path.dirname(second) == str(home / 'Downloads' / 'second')
+    assert open(second, 'rb').read() == open(first, 'rb').read()
+    assert os.path.samefile(first, second) == linked
+    assert index.find_all('v0000000000', 'audio') == [first, second]
+
+    # nothing was fetched, not even the video's metadata
+    assert fake_server.requests == requests
+
+
+
+def test_indexed_video_is_skipped(fake_server, index, retry, home):
+
+    first = download(index, retry, 'skip', 'first')
+    requests = fake_server.requests
+
+    assert download(index, retry, 'skip', 'second') == first
+    assert not os.path.exists(home / 'Downloads' / 'second')
+    assert fake_server.requests == requests
+
+
+
+def test_changed_download_is_downloaded_again(fake_server, index, retry):
+
+    first = download(index, retry, 'hardlink', 'first')
+    write(first, b'changed')
+    requests = fake_server.requests
+    second = download(index, retry, 'hardlink', 'second')
+
+    assert fake_server.requests > requests
+    assert not os.path.samefile(first, second)
+    assert index.find_all('v0000000000', 'audio') == [second]
@@ -0,0 +1,108 @@
+import pytest
+
+from yt_downloader_core.formats import NoSuitableStreamError, format_index, make_policy, selection_policy, stream_format
+
+
+# itag, res, container, codec, filesize, as YouTube lists them (AV1 in mp4 after H.264)
+VIDEO = [
+    (134, '360p', 'mp4', 'avc1.4d401e', 3000),
+    (243, '360p', 'webm', 'vp9', 2000),
+    (396, '360p', 'mp4', 'av01.0.01M.08', 1000),
+    (136, '720p', 'mp4', 'avc1.4d401f', 6000),
+    (247, '720p', 'webm', 'vp9', 5000),
+    (398, '720p', 'mp4', 'av01.0.05M.08', 4000),
+    (399, '1080p', 'mp4', 'av01.0.08M.08', 8000),
+]
+
+# itag, container, codec, bitrate, filesize
+AUDIO = [
+    (140, 'mp4', 'mp4a.40.2', 128000, 500),
+    (250, 'webm', 'opus', 64000, 300),
+    (251, 'webm', 'opus', 160000, 600),
+]
+
+
+
+def make_index(video=VIDEO, audio=AUDIO):
+
+    formats = [stream_format(itag, 'video', res, 30, container, codec, None, filesize) for itag, res, container, codec, filesize in video]
+    formats += [stream_format(itag, 'audio', None, None, container, codec, bitrate, filesize) for itag, container, codec, bitrate, filesize in audio]
+
+    return format_index(formats)
+
+
+
+def itags(formats):
+
+    return [fmt.itag for fmt in formats]
+
+
+
+@pytest.mark.parametrize('res, expected', [
+    ('360p', [134, 140]),
+    ('720p', [136, 140]),
+    # only AV1 at 1080p, the highest H.264 resolution instead
+    ('1080p', [136, 140]),
+    ('audio', [140]),
+])
+def test_mp4_policy_picks_h264_and_aac(res, expected):
+
+    assert itags(make_policy('mp4').select(make_index(), res)) == expected
+
+
+
+def test_mp4_policy_leaves_out_av1():
+
+    index = make_index()
+
+    assert selection_policy().resolutions(index) == ['360p', '720p']
+    assert selection_policy().filesizes(index) == {'360p': 3000, '720p': 6000, 'audio': 500}
+
+    with pytest.raises(NoSuitableStreamError):
+        selection_policy().select(make_index(video=[fmt for fmt in VIDEO if fmt[3].startswith('av01')]), '720p')
+
+
+
+@pytest.mark.parametrize('res, expected', [
+    ('360p', [243, 250]),
+    ('720p', [247, 250]),
+    ('1080p', [247, 250]),
+])
+def test_smallest_policy_picks_h264_or_vp9(res, expected):
+
+    # and the smallest audio, whatever its codec
+    assert itags(make_policy('smallest').select(make_index(), res)) == expected
+
+
+
+def test_opus_policy_picks_best_opus():
+
+    assert itags(make_policy('opus').select(make_index(), 'audio')) == [251]
+
+    # no opus, the smallest allowed audio
+    assert itags(make_policy('opus').select(make_index(audio=AUDIO[:1]), 'audio')) == [140]
+
+
+
+@pytest.mark.parametrize('max_bytes, expected', [
+    (6500, [247, 250]),
+    (4000, [243, 250]),
+    # nothing fits, the smallest download
+    (100, [243, 250]),
+])
+def test_size_capped_policy(max_bytes, expected):
+
+    assert itags(make_policy('smallest', max_bytes).select(make_index(), '1080p')) == expected
+
+
+
+def test_cached_formats_select_the_same():
+
+    index = make_index()
+    cached = format_index.from_dicts(index.to_dicts())
+
+    for name in ('mp4', 'smallest', 'opus'):
+        policy = make_policy(name)
+
+        assert policy.filesizes(cached) == policy.filesizes(index)
+        assert itags(policy.select(cached, '720p')) == itags(policy.select(index, '720p'))
@@ -0,0 +1,100 @@
+import json
+
+from yt_downloader_core.job_queue import job_queue
+
+
+
+def make_queue(tmp_path):
+
+    queue = job_queue(str(tmp_path / 'queue.json'))
+
+    # same priority, in the order added
+    queue.add('https://www.youtube.com/watch?v=first')
+    queue.add('https://www.youtube.com/watch?v=second')
+    queue.add('https://www.youtube.com/watch?v=urgent', priority=5)
+    queue.add('https://www.youtube.com/playlist?list=PLlow', isplaylist=True, priority=-1)
+
+    return queue
+
+
+
+def urls(jobs):
+
+    return [job.url.rsplit('=', 1)[1] for job in jobs]
+
+
+
+def test_higher_priority_starts_first(tmp_path):
+
+    queue = make_queue(tmp_path)
+
+    assert urls([queue.start_next(2), queue.start_next(2)]) == ['urgent', 'first']
+    assert queue.start_next(2) is None
+    assert queue.count('running') == 2 and queue.count('queued') == 2
+
+    assert urls(queue.ordered()) == ['urgent', 'first', 'second', 'PLlow']
+
+
+
+def test_finish_and_requeue(tmp_path):
+
+    queue = make_queue(tmp_path)
+    urgent, first = queue.start_next(2), queue.start_next(2)
+
+    queue.finish(first)
+    queue.requeue(urgent)
+
+    assert urls(queue.ordered()) == ['urgent', 'second', 'PLlow']
+    assert queue.start_next(1) is urgent
+
+
+
+def test_remove_only_queued_jobs(tmp_path):
+
+    queue = make_queue(tmp_path)
+    running = queue.start_next(1)
+    second = [job for job in queue.jobs if job.url.endswith('second')][0]
+
+    assert queue.remove(running.job_id) is None
+    assert queue.remove('unknown') is None
+    assert queue.remove(second.job_id) is second
+
+    assert urls(queue.ordered()) == ['urgent', 'first', 'PLlow']
+    assert queue.get(second.job_id) is None and queue.get(running.job_id) is running
+
+
+
+def test_saved_on_every_change(tmp_path):
+
+    queue = make_queue(tmp_path)
+    queue.add('https://www.youtube.com/watch?v=limited', res='audio', dirname='music', rate_limit=500000)
+    queue.start_next(1)
+
+    with open(queue.path) as fh:
+        saved = json.load(fh)
+
+    assert len(saved) == 5
+    assert saved[-1]['res'] == 'audio' and saved[-1]['dirname'] == 'music' and saved[-1]['rate_limit'] == 500000
+
+
+
+def test_running_jobs_are_queued_again_when_loaded(tmp_path):
+
+    queue = make_queue(tmp_path)
+    queue.start_next(2)
+
+    loaded = job_queue.load(queue.path)
+
+    assert [(job.job_id, job.priority) for job in loaded.jobs] == [(job.job_id, job.priority) for job in queue.jobs]
+    assert loaded.count('running') == 0
+    assert urls(loaded.ordered()) == ['urgent', 'first', 'second', 'PLlow']
+
+
+
+def test_load_missing_or_corrupt_file(tmp_path):
+
+    assert job_queue.load(str(tmp_path / 'missing.json')).jobs == []
+
+    (tmp_path / 'queue.json').write_text('[{"not": "a job"}]')
+
+    assert job_queue.load(str(tmp_path / 'queue.json')).jobs == []
@@ -0,0 +1,165 @@
+import sqlite3, time
+
+import pytest
+
+from yt_downloader_core import metadata_cache as cache_module
+from yt_downloader_core.downloader import yt_downloader
+from yt_downloader_core.formats import format_index
+from yt_downloader_core.metadata_cache import metadata_cache
+
+
+PLAYLIST_URL = 'https://www.youtube.com/playlist?list=PLbench5'
+
+
+
+@pytest.fixture
+def cache(tmp_path):
+
+    cache = metadata_cache(str(tmp_path / 'metadata.sqlite3'))
+
+    yield cache
+
+    cache.close()
+
+
+
+def accessed(cache, key):
+
+    """Returns the access time of an entry as written to the SQLite file, seen from another connection.
+    """
+
+    with sqlite3.connect(cache.path) as conn:
+        return conn.execute('SELECT accessed FROM entries WHERE key = ?', (key,)).fetchone()[0]
+
+
+
+def test_video_round_trip(cache):
+
+    formats = format_index([])
+    cache.put_video('abc', 'Some Title', formats, 'Some Channel', '2024-01-31')
+
+    assert cache.get_video('abc') == {'title': 'Some Title', 'author': 'Some Channel', 'date': '2024-01-31', 'formats': []}
+    assert cache.get_video('other') is None
+
+
+
+def test_get_videos(cache, monkeypatch):
+
+    for video_id in ('a', 'b', 'c'):
+        cache.put_video(video_id, video_id.upper(), format_index([]))
+
+    # several queries for more videos than MAX_PARAMS
+    monkeypatch.setattr(cache_module, 'MAX_PARAMS', 2)
+
+    assert {video_id: data['title'] for video_id, data in cache.get_videos(['a', 'c', 'missing', 'b']).items()} == {'a': 'A', 'b': 'B', 'c': 'C'}
+    assert cache.get_videos([]) == {}
+
+
+
+def test_entries_expire(tmp_path):
+
+    cache = metadata_cache(str(tmp_path / 'metadata.sqlite3'), ttl=0.2, playlist_ttl=0.1)
+    cache.put_video('abc', 'Some Title', format_index([]))
+    cache.put_playlist('PLabc', ['https://www.youtube.com/watch?v=abc'])
+    time.sleep(0.15)
+
+    assert cache.get_playlist('PLabc') is None
+    assert cache.get_video('abc') is not None
+
+    time.sleep(0.1)
+
+    assert cache.get_video('abc') is None
+    assert cache.get_videos(['abc']) == {}
+
+    # expired entries are evicted the next time the cache is opened
+    cache.close()
+    cache = metadata_cache(cache.path, ttl=0.2, playlist_ttl=0.1)
+
+    with sqlite3.connect(cache.path) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0] == 0
+
+    cache.close()
+
+
+
+def test_reads_are_written_in_batches(cache, monkeypatch):
+
+    cache.put_video('abc', 'Some Title', format_index([]))
+    written = accessed(cache, 'video:abc')
+    time.sleep(0.01)
+    cache.get_video('abc')
+
+    assert accessed(cache, 'video:abc') == written
+
+    # written with the next write
+    cache.put_playlist('PLabc', [])
+    assert accessed(cache, 'video:abc') > written
+
+    # or once enough reads are pending
+    monkeypatch.setattr(cache_module, 'ACCESS_FLUSH', 2)
+    written = accessed(cache, 'video:abc')
+    time.sleep(0.01)
+    cache.get_video('abc')
+    cache.get_playlist('PLabc')
+
+    assert accessed(cache, 'video:abc') > written
+
+
+
+def test_least_recently_used_are_evicted(tmp_path):
+
+    cache = metadata_cache(str(tmp_path / 'metadata.sqlite3'))
+
+    for video_id in ('a', 'b', 'c'):
+        cache.put_video(video_id, 'x' * 100, format_index([]))
+        time.sleep(0.01)
+
+    entry_size = cache._conn.execute("SELECT size FROM entries WHERE key = 'video:a'").fetchone()[0]
+    cache.max_bytes = 3 * entry_size
+
+    # a is used again, so b is the least recently used
+    cache.get_video('a')
+    time.sleep(0.01)
+    cache.put_video('d', 'x' * 100, format_index([]))
+
+    assert sorted(cache.get_videos(['a', 'b', 'c', 'd'])) == ['a', 'c', 'd']
+
+    cache.close()
+
+
+
+def test_cached_playlist_options(fake_server, retry, cache, monkeypatch):
+
+    playlist = yt_downloader(PLAYLIST_URL, isplaylist=True, cache=cache, retry=retry)
+    options = list(zip(playlist.get_res_options(), playlist.get_filesize_options()))
+
+    # no network access at all
+    monkeypatch.setattr(yt_downloader, 'get_playlist_urls', None)
+    monkeypatch.setattr(yt_downloader, 'prepare_vid', None)
+
+    assert yt_downloader(PLAYLIST_URL, isplaylist=True, cache=cache, retry=retry).get_cached_options() == options
+
+
+
+def test_downloads_fetch_the_current_playlist(fake_server, retry, cache, home):
+
+    # the cached video list misses the videos added since
+    urls = yt_downloader(PLAYLIST_URL, isplaylist=True, cache=cache, retry=retry).get_playlist_urls()
+    cache.put_playlist('PLbench5', urls[:3])
+
+    playlist = yt_downloader(PLAYLIST_URL, isplaylist=True, cache=cache, retry=retry)
+
+    assert len(playlist.get_res_options()) and len(playlist.vid) == 3
+
+    playlist.download('audio', 'playlist')
+
+    assert len(playlist.vid) == len(urls)
+    assert len(list((home / 'Downloads' / 'playlist').iterdir())) == len(urls)
+
+
+
+def test_cached_options_of_incomplete_urls(cache):
+
+    # urls being typed are just not cached
+    assert yt_downloader('https://www.youtube.com/watch?v=', cache=cache).get_cached_options() is None
+    assert yt_downloader('https://www.youtube.com/playlist?lis', isplaylist=True, cache=cache).get_cached_options() is None
@@ -0,0 +1,98 @@
+import threading
+
+from yt_downloader_core.muxer import mux_queue
+
+
+
+def blocked_queue(workers, max_pending):
+
+    """Returns a mux_queue whose merges wait for the returned event, and the list of (running, pending) it reported.
+    """
+
+    statuses = []
+    release = threading.Event()
+    queue = mux_queue(workers, max_pending)
+    queue.watch(lambda queue: statuses.append((queue.running, queue.pending)))
+
+    return queue, release, statuses
+
+
+
+def submit_in_background(queue, fn, count):
+
+    submitted = []
+
+    def submit():
+        for i in range(count):
+            submitted.append(queue.submit(fn))
+
+    thread = threading.Thread(target=submit, daemon=True)
+    thread.start()
+
+    return thread, submitted
+
+
+
+def test_submit_waits_for_room():
+
+    queue, release, statuses = blocked_queue(1, 1)
+    thread, submitted = submit_in_background(queue, release.wait, 3)
+
+    # one merge running and one waiting, the third waits for room
+    thread.join(0.2)
+    assert thread.is_alive() and len(submitted) == 2
+
+    release.set()
+    thread.join(5)
+
+    assert [future.result() for future in submitted] == [True] * 3
+    assert max(running + pending for running, pending in statuses) == 2
+    assert statuses[-1] == (0, 0)
+
+    queue.shutdown()
+
+
+
+def test_configure_makes_room():
+
+    queue, release, statuses = blocked_queue(1, 0)
+    thread, submitted = submit_in_background(queue, release.wait, 3)
+
+    thread.join(0.2)
+    assert len(submitted) == 1
+
+    queue.configure(3, 0)
+    thread.join(5)
+
+    assert len(submitted) == 3 and queue.workers == 3
+
+    release.set()
+    assert [future.result() for future in submitted] == [True] * 3
+
+    queue.shutdown()
+
+
+
+def test_unwatch():
+
+    queue, release, statuses = blocked_queue(1, 0)
+    release.set()
+    queue.submit(release.wait).result()
+    queue.unwatch(queue._watchers[0])
+    count = len(statuses)
+    queue.submit(release.wait).result()
+
+    assert len(statuses) == count
+
+    queue.shutdown()
+
+
+
+def test_default_is_shared(fake_server, retry):
+
+    from yt_downloader_core.downloader import yt_downloader
+
+    playlist = yt_downloader('https://www.youtube.com/playlist?list=PLbench2', isplaylist=True, retry=retry)
+
+    assert playlist.mux_pool is mux_queue.default()
+    assert playlist.make_child('https://www.youtube.com/watch?v=v0000000000').mux_pool is mux_queue.default()
@@ -0,0 +1,172 @@
+import os, threading, time
+
+import pytest
+
+from yt_downloader_core.downloader import DownloadCancelledError, PlaylistDownloadError, yt_downloader
+
+
+PLAYLIST_URL = 'https://www.youtube.com/playlist?list=PLbench6'
+VIDEO_COUNT = 6
+
+
+
+class progress_recorder():
+    """Records the (videos, videos done, videos remaining) of every playlist progress update."""
+
+    def __init__(self):
+
+        self.updates = []
+        self._lock = threading.Lock()
+
+
+
+    def callback(self, progress, chunk, remaining):
+
+        with self._lock:
+            self.updates.append((progress.filesize, progress.completed, remaining))
+
+
+
+@pytest.fixture
+def active_downloads(monkeypatch):
+
+    """Slows down every stream download and records the most videos downloading at the same time.
+    """
+
+    active = {'now': 0, 'most': 0}
+    lock = threading.Lock()
+    download_stream = yt_downloader.download_stream
+
+    def counted_download_stream(self, *args, **kwargs):
+        with lock:
+            active['now'] += 1
+            active['most'] = max(active['most'], active['now'])
+
+        try:
+            time.sleep(0.1)
+            return download_stream(self, *args, **kwargs)
+
+        finally:
+            with lock:
+                active['now'] -= 1
+
+    monkeypatch.setattr(yt_downloader, 'download_stream', counted_download_stream)
+
+    return active
+
+
+
+def test_playlist_downloads_every_video(fake_server, retry, home):
+
+    progress = progress_recorder()
+    completed = []
+
+    yt_downloader(PLAYLIST_URL, isplaylist=True, progress_callback=progress.callback, complete_callback=lambda stream, path: completed.append(path),
+                  retry=retry).download('audio', 'playlist')
+
+    assert sorted(os.listdir(home / 'Downloads' / 'playlist')) == sorted(os.path.basename(path) for path in completed)
+    assert len(completed) == VIDEO_COUNT
+    assert progress.updates[-1] == (VIDEO_COUNT, VIDEO_COUNT, 0)
+
+
+
+@pytest.mark.parametrize('max_workers', [1, 3])
+def test_worker_pool_is_bounded(fake_server, retry, active_downloads, max_workers):
+
+    yt_downloader(PLAYLIST_URL, isplaylist=True, max_workers=max_workers, retry=retry).download('audio', 'playlist')
+
+    assert active_downloads['most'] == max_workers
+
+
+
+def test_failed_video_does_not_stop_the_others(fake_server, retry, home, monkeypatch):
+
+    failing_url = 'https://www.youtube.com/watch?v=v0000000002'
+    download_stream = yt_downloader.download_stream
+
+    def failing_download_stream(self, *args, **kwargs):
+        if self.url == failing_url:
+            raise ValueError('broken stream')
+
+        return download_stream(self, *args, **kwargs)
+
+    monkeypatch.setattr(yt_downloader, 'download_stream', failing_download_stream)
+    progress = progress_recorder()
+
+    with pytest.raises(PlaylistDownloadError) as error:
+        yt_downloader(PLAYLIST_URL, isplaylist=True, progress_callback=progress.callback, retry=retry).download('audio', 'playlist')
+
+    assert [(url, type(e)) for url, e in error.value.failures] == [(failing_url, ValueError)]
+    assert len([name for name in os.listdir(home / 'Downloads' / 'playlist') if name.endswith('.mp4')]) == VIDEO_COUNT - 1
+
+    # the failed video counts as done
+    assert progress.updates[-1] == (VIDEO_COUNT, VIDEO_COUNT, 0)
+
+
+
+def test_cancelled_playlist_skips_the_remaining_videos(fake_server, retry, home, monkeypatch):
+
+    playlist = yt_downloader(PLAYLIST_URL, isplaylist=True, max_workers=1, retry=retry)
+    download_stream = yt_downloader.download_stream
+    started = []
+
+    def cancelling_download_stream(self, *args, **kwargs):
+        started.append(self.url)
+
+        # cancelled while the second video downloads
+        if len(started) == 2:
+            playlist.cancel()
+
+        return download_stream(self, *args, **kwargs)
+
+    monkeypatch.setattr(yt_downloader, 'download_stream', cancelling_download_stream)
+
+    with pytest.raises(DownloadCancelledError):
+        playlist.download('audio', 'playlist')
+
+    assert len(started) == 2 and playlist.failed == []
+    assert len([name for name in os.listdir(home / 'Downloads' / 'playlist') if name.endswith('.mp4')]) == 1
+
+
+
+@pytest.mark.parametrize('engine', ['threads', 'asyncio'])
+def test_playlist_engines(fake_server, retry, home, engine):
+
+    completed = []
+
+    yt_downloader(PLAYLIST_URL, isplaylist=True, complete_callback=lambda stream, path: completed.append(path), retry=retry,
+                  engine=engine).download('audio', 'playlist')
+
+    assert sorted(os.listdir(home / 'Downloads' / 'playlist')) == sorted(os.path.basename(path) for path in completed)
+    assert len(completed) == VIDEO_COUNT
+
+
+
+def test_asyncio_engine_runs_videos_on_the_loop(fake_server, retry, home, monkeypatch):
+
+    # no thread of its own per video or stream: every stream is downloaded on the event loop's thread
+    threads = set()
+    download_stream_async = yt_downloader.download_stream_async
+
+    async def recorded_download_stream_async(self, *args, **kwargs):
+        threads.add(threading.current_thread().name)
+        return await download_stream_async(self, *args, **kwargs)
+
+    monkeypatch.setattr(yt_downloader, 'download_stream_async', recorded_download_stream_async)
+
+    yt_downloader(PLAYLIST_URL, isplaylist=True, max_workers=3, retry=retry, engine='asyncio').download('audio', 'playlist')
+
+    assert len(threads) == 1
+    assert len([name for name in os.listdir(home / 'Downloads' / 'playlist') if name.endswith('.mp4')]) == VIDEO_COUNT
+
+
+
+def test_download_async(fake_server, retry, home):
+
+    completed = []
+    vid = yt_downloader('https://www.youtube.com/watch?v=v0000000001', complete_callback=lambda stream, path: completed.append(path), retry=retry,
+                        engine='asyncio')
+    vid.make_engine().loop_thread.run(vid.download_async('audio', 'single'))
+
+    assert os.listdir(home / 'Downloads' / 'single') == [os.path.basename(path) for path in completed]
+    assert len(completed) == 1
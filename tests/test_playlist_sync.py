@@ -0,0 +1,150 @@
+import os
+
+import pytest
+
+from yt_downloader_core.disk_space import InsufficientDiskSpaceError
+from yt_downloader_core.download_index import download_index
+from yt_downloader_core.downloader import PlaylistDownloadError, yt_downloader
+from yt_downloader_core.playlist_sync import sync_state
+
+
+PLAYLIST_URL = 'https://www.youtube.com/playlist?list=PLbench5'
+VIDEO_IDS = [f'v{index:010d}' for index in range(5)]
+
+
+
+def watch_url(video_id):
+
+    return f'https://www.youtube.com/watch?v={video_id}'
+
+
+
+@pytest.fixture
+def state(tmp_path):
+
+    state = sync_state(str(tmp_path / 'sync.sqlite3'))
+
+    yield state
+
+    state.close()
+
+
+
+@pytest.fixture
+def index(tmp_path):
+
+    index = download_index(str(tmp_path / 'downloads.sqlite3'))
+
+    yield index
+
+    index.close()
+
+
+
+def playlist(retry, **kwargs):
+
+    return yt_downloader(PLAYLIST_URL, isplaylist=True, retry=retry, **kwargs)
+
+
+
+def test_sync_downloads_only_new_videos(fake_server, retry, state, home):
+
+    result = playlist(retry).sync('audio', state, 'synced')
+
+    assert result == {'new': [watch_url(video_id) for video_id in VIDEO_IDS], 'removed': [], 'pruned': []}
+    assert len(os.listdir(home / 'Downloads' / 'synced')) == len(VIDEO_IDS)
+
+    requests = fake_server.requests
+    result = playlist(retry).sync('audio', state, 'synced')
+
+    assert result == {'new': [], 'removed': [], 'pruned': []}
+
+    # only the playlist page was fetched
+    assert fake_server.requests == requests + 1
+
+
+
+def test_sync_targets_are_separate(fake_server, retry, state):
+
+    playlist(retry).sync('audio', state, 'synced')
+
+    assert len(playlist(retry).sync('audio', state, 'elsewhere')['new']) == len(VIDEO_IDS)
+
+
+
+def test_failed_sync_keeps_videos_unsynced(fake_server, retry, state, monkeypatch):
+
+    def no_space(self, res, dirname=None):
+        raise InsufficientDiskSpaceError('synced', 1, 0)
+
+    # fails before any video is downloaded
+    with monkeypatch.context() as patch:
+        patch.setattr(yt_downloader, 'check_disk_space', no_space)
+
+        with pytest.raises(InsufficientDiskSpaceError):
+            playlist(retry).sync('audio', state, 'synced')
+
+    assert len(playlist(retry).sync('audio', state, 'synced')['new']) == len(VIDEO_IDS)
+
+
+
+def test_failed_videos_are_synced_again(fake_server, retry, state, monkeypatch):
+
+    download = yt_downloader.download
+    failing_url = watch_url(VIDEO_IDS[1])
+
+    def download_failing(self, res, dirname=None, finished_callback=None):
+        if self.url == failing_url:
+            raise ValueError('broken video')
+
+        return download(self, res, dirname, finished_callback)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(yt_downloader, 'download', download_failing)
+
+        with pytest.raises(PlaylistDownloadError) as error:
+            playlist(retry).sync('audio', state, 'synced')
+
+    assert [url for url, e in error.value.failures] == [failing_url]
+    assert playlist(retry).sync('audio', state, 'synced')['new'] == [failing_url]
+    assert playlist(retry).sync('audio', state, 'synced')['new'] == []
+
+
+
+def test_removed_videos_are_pruned(fake_server, retry, state, index, home, monkeypatch):
+
+    playlist(retry, index=index).sync('audio', state, 'synced')
+    removed = VIDEO_IDS[3:]
+    removed_paths = [path for video_id in removed for path in index.find_all(video_id, 'audio')]
+
+    assert len(removed_paths) == len(removed)
+
+    get_playlist_urls = yt_downloader.get_playlist_urls
+
+    with monkeypatch.context() as patch:
+        patch.setattr(yt_downloader, 'get_playlist_urls', lambda self, refresh=False: get_playlist_urls(self, refresh)[:3])
+
+        result = playlist(retry, index=index).sync('audio', state, 'synced', prune=True)
+
+        assert result == {'new': [], 'removed': removed, 'pruned': removed_paths}
+        assert sorted(os.listdir(home / 'Downloads' / 'synced')) == sorted(os.path.basename(index.find(video_id, 'audio')) for video_id in VIDEO_IDS[:3])
+        assert all(index.find(video_id, 'audio') is None for video_id in removed)
+
+        # the removed videos are forgotten, and are new again if they come back
+        assert playlist(retry, index=index).sync('audio', state, 'synced')['removed'] == []
+
+    assert playlist(retry, index=index).sync('audio', state, 'synced')['new'] == [watch_url(video_id) for video_id in removed]
+
+
+
+def test_removed_videos_are_kept_without_prune(fake_server, retry, state, index, home, monkeypatch):
+
+    playlist(retry, index=index).sync('audio', state, 'synced')
+
+    get_playlist_urls = yt_downloader.get_playlist_urls
+    monkeypatch.setattr(yt_downloader, 'get_playlist_urls', lambda self, refresh=False: get_playlist_urls(self, refresh)[:3])
+
+    result = playlist(retry, index=index).sync('audio', state, 'synced')
+
+    assert result == {'new': [], 'removed': VIDEO_IDS[3:], 'pruned': []}
+    assert len(os.listdir(home / 'Downloads' / 'synced')) == len(VIDEO_IDS)
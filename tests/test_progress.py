@@ -0,0 +1,129 @@
+from types import SimpleNamespace
+
+import pytest
+
+from yt_downloader_core import progress as progress_module
+from yt_downloader_core.progress import progress_aggregator
+
+
+class fake_clock():
+    """Stands in for the progress module's time module, moving only when told to."""
+
+    def __init__(self):
+
+        self.now = 100.0
+
+
+
+    def monotonic(self):
+
+        return self.now
+
+
+
+@pytest.fixture
+def clock(monkeypatch):
+
+    clock = fake_clock()
+    monkeypatch.setattr(progress_module, 'time', clock)
+
+    return clock
+
+
+
+def stream(filesize=1000, title='Some Title', type='video+audio', **fields):
+
+    return SimpleNamespace(filesize=filesize, title=title, type=type, **fields)
+
+
+
+def test_jobs_show_up_once_they_report(clock):
+
+    aggregator = progress_aggregator()
+    first, second = aggregator.callback('first'), aggregator.callback('second')
+
+    assert aggregator.snapshot() == []
+
+    second(stream(title='Second'), b'x' * 100, 900)
+    first(stream(title='First'), b'x' * 500, 500)
+
+    snapshots = aggregator.snapshot()
+
+    # in the order the jobs were added, not the order they reported
+    assert [(job.job_key, job.title, job.percent) for job in snapshots] == [('first', 'First', 50.0), ('second', 'Second', 10.0)]
+
+
+
+def test_speed_and_eta(clock):
+
+    aggregator = progress_aggregator(smoothing=0.5)
+    callback = aggregator.callback('job')
+    video = stream(filesize=1000)
+
+    callback(video, b'', 1000)
+    aggregator.snapshot()
+
+    # 100 bytes in a second, the first measurement is taken as is
+    clock.now += 1
+    callback(video, b'x' * 100, 900)
+    job = aggregator.snapshot()[0]
+
+    assert job.speed == pytest.approx(100)
+    assert job.eta == pytest.approx(9)
+
+    # 300 bytes in the next second, smoothed with the previous measurement
+    clock.now += 1
+    callback(video, b'x' * 300, 600)
+    job = aggregator.snapshot()[0]
+
+    assert job.speed == pytest.approx(200)
+    assert job.eta == pytest.approx(0.6 / 0.2)
+
+
+
+def test_short_intervals_are_not_measured(clock):
+
+    aggregator = progress_aggregator()
+    callback = aggregator.callback('job')
+    video = stream()
+
+    callback(video, b'', 1000)
+    aggregator.snapshot()
+    clock.now += 1
+    callback(video, b'x' * 100, 900)
+    aggregator.snapshot()
+
+    # too soon after the last one, the speed is kept while the percentage moves on
+    clock.now += progress_module.MIN_SAMPLE_INTERVAL / 2
+    callback(video, b'x' * 800, 100)
+    job = aggregator.snapshot()[0]
+
+    assert job.speed == pytest.approx(100)
+    assert job.percent == 90.0
+
+
+
+def test_removed_jobs_are_dropped(clock):
+
+    aggregator = progress_aggregator()
+    callback = aggregator.callback('job')
+    callback(stream(), b'x', 999)
+    aggregator.remove('job')
+
+    # late callbacks of worker threads are ignored
+    callback(stream(), b'x', 998)
+
+    assert aggregator.snapshot() == []
+
+
+
+def test_playlist_progress(clock):
+
+    aggregator = progress_aggregator()
+    callback = aggregator.callback('playlist')
+
+    callback(stream(filesize=6, type='playlist', completed=2), b'', 3.5)
+    job = aggregator.snapshot()[0]
+
+    assert (job.type, job.completed, job.total) == ('playlist', 2, 6)
+    assert job.percent == pytest.approx(41.67)
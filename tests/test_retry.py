@@ -0,0 +1,237 @@
+from email.message import Message
+from urllib.error import HTTPError, URLError
+import asyncio, socket, time
+
+import pytest
+from pytube.exceptions import VideoUnavailable
+
+from yt_downloader_core.downloader import PlaylistDownloadError
+from yt_downloader_core.formats import NoSuitableStreamError
+from yt_downloader_core.retry import (CircuitOpenError, FATAL, MAX_RETRY_AFTER, MISSING_FFMPEG, THROTTLED, TRANSIENT, UNAVAILABLE,
+                                      circuit_breaker, classify, given_up, retry_after, retry_policy)
+
+
+
+def http_error(code, retry_after=None):
+
+    headers = Message()
+
+    if retry_after is not None:
+        headers['Retry-After'] = retry_after
+
+    return HTTPError('https://www.youtube.com/watch?v=abc', code, 'error', headers, None)
+
+
+
+@pytest.mark.parametrize('error, failure_class', [
+    (http_error(429), THROTTLED),
+    (http_error(404), UNAVAILABLE),
+    (http_error(410), UNAVAILABLE),
+    (http_error(500), TRANSIENT),
+    (http_error(503), TRANSIENT),
+    (http_error(408), TRANSIENT),
+    (http_error(403), FATAL),
+    (CircuitOpenError('www.youtube.com', 5), THROTTLED),
+    (VideoUnavailable('abc'), UNAVAILABLE),
+    (NoSuitableStreamError('video', ('mp4',)), UNAVAILABLE),
+    (FileNotFoundError(2, 'No such file or directory', 'ffmpeg'), MISSING_FFMPEG),
+    (FileNotFoundError(2, 'No such file or directory', 'video.mp4'), FATAL),
+    (ConnectionResetError(), TRANSIENT),
+    (socket.timeout(), TRANSIENT),
+    (URLError('unreachable'), TRANSIENT),
+    (ValueError(), FATAL),
+])
+def test_classify(error, failure_class):
+
+    assert classify(error) == failure_class
+
+
+
+def test_classify_playlist_failures():
+
+    url = 'https://www.youtube.com/watch?v=abc'
+
+    # a playlist is retried if any of its failed videos is worth retrying
+    assert classify(PlaylistDownloadError([(url, ValueError()), (url, http_error(503))])) == TRANSIENT
+    assert classify(PlaylistDownloadError([(url, http_error(404)), (url, http_error(429))])) == THROTTLED
+    assert classify(PlaylistDownloadError([(url, http_error(404)), (url, ValueError())])) == UNAVAILABLE
+    assert classify(PlaylistDownloadError([(url, ValueError())])) == FATAL
+
+
+
+def test_retry_after():
+
+    assert retry_after(http_error(429, '7')) == 7
+    assert retry_after(http_error(429, '-3')) == 0
+    assert retry_after(http_error(429, str(MAX_RETRY_AFTER * 10))) == MAX_RETRY_AFTER
+    assert retry_after(http_error(429)) is None
+    assert retry_after(ValueError()) is None
+
+
+
+def test_throttled_delay_honors_retry_after():
+
+    policy = retry_policy(base_delay=0, throttled_delay=0, breaker=circuit_breaker())
+
+    assert policy.delay(http_error(429, '3'), 0) == 3
+
+
+
+def test_circuit_opens_at_threshold():
+
+    breaker = circuit_breaker(failure_threshold=2, reset_timeout=0.1)
+
+    breaker.failure('host')
+    breaker.before('host')
+    breaker.failure('host')
+
+    assert breaker.is_open('host')
+
+    with pytest.raises(CircuitOpenError):
+        breaker.before('host')
+
+    # other hosts are not affected
+    breaker.before('other host')
+
+
+
+def test_circuit_half_open_probe():
+
+    breaker = circuit_breaker(failure_threshold=1, reset_timeout=0.1)
+    breaker.failure('host')
+    time.sleep(0.15)
+
+    # a single request probes the host, the others wait for its outcome
+    breaker.before('host')
+
+    with pytest.raises(CircuitOpenError):
+        breaker.before('host')
+
+    breaker.success('host')
+
+    assert not breaker.is_open('host')
+    breaker.before('host')
+    breaker.before('host')
+
+
+
+def test_circuit_backs_off_after_failed_probe():
+
+    breaker = circuit_breaker(failure_threshold=1, reset_timeout=0.1)
+    breaker.failure('host')
+    time.sleep(0.15)
+    breaker.before('host')
+    breaker.failure('host')
+
+    # opened for twice as long the second time in a row
+    time.sleep(0.15)
+
+    with pytest.raises(CircuitOpenError):
+        breaker.before('host')
+
+    time.sleep(0.1)
+    breaker.before('host')
+
+
+
+def test_non_retryable_failures_close_the_circuit():
+
+    policy = retry_policy(breaker=circuit_breaker(failure_threshold=2))
+
+    policy.failed(http_error(503), host='host')
+    policy.failed(http_error(404), host='host')
+    policy.failed(http_error(503), host='host')
+
+    assert not policy.breaker.is_open('host')
+
+
+
+def failing(errors):
+
+    """Returns a function raising errors in turn, then returning 'done'. Its calls are counted in fn.calls.
+    """
+
+    def fn():
+        fn.calls += 1
+
+        if fn.calls <= len(errors):
+            raise errors[fn.calls - 1]
+
+        return 'done'
+
+    fn.calls = 0
+
+    return fn
+
+
+
+def test_call_retries_transient_failures(retry):
+
+    fn = failing([ConnectionResetError(), http_error(503)])
+
+    assert retry.call(fn, host='host') == 'done'
+    assert fn.calls == 3
+    assert not retry.breaker.is_open('host')
+
+
+
+def test_call_does_not_retry_fatal_failures(retry):
+
+    fn = failing([http_error(403), ConnectionResetError()])
+
+    with pytest.raises(HTTPError):
+        retry.call(fn, host='host')
+
+    assert fn.calls == 1
+
+
+
+def test_call_gives_up_after_max_retries(retry):
+
+    fn = failing([ConnectionResetError()] * (retry.max_retries + 1))
+
+    with pytest.raises(ConnectionResetError):
+        retry.call(fn)
+
+    assert fn.calls == retry.max_retries + 1
+
+
+
+def test_given_up_failures_are_not_retried_again(retry):
+
+    # the inner level (i.e. a segment) gives up, the outer one (i.e. the video) doesn't retry the same failure
+    inner = failing([ConnectionResetError()] * (retry.max_retries + 1))
+    outer_calls = []
+
+    def outer():
+        outer_calls.append(1)
+        return retry.call(inner)
+
+    with pytest.raises(ConnectionResetError) as error:
+        retry.call(outer)
+
+    assert given_up(error.value)
+    assert len(outer_calls) == 1 and inner.calls == retry.max_retries + 1
+    assert not retry.should_retry(error.value, 0)
+
+    # failures of the outer level itself are still retried
+    assert retry.call(failing([ConnectionResetError()])) == 'done'
+
+
+
+def test_call_async(retry):
+
+    fn = failing([ConnectionResetError(), http_error(503)])
+
+    async def coro_fn():
+        return fn()
+
+    assert asyncio.run(retry.call_async(coro_fn, host='host')) == 'done'
+    assert fn.calls == 3
+
+    fn = failing([http_error(403)])
+
+    with pytest.raises(HTTPError):
+        asyncio.run(retry.call_async(coro_fn))
+
+    assert fn.calls == 1
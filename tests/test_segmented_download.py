@@ -0,0 +1,233 @@
+import asyncio, json, os, threading
+
+import pytest
+
+import fake_youtube
+from yt_downloader_core.async_download import async_downloader
+from yt_downloader_core.segmented_download import download_checkpoint, segmented_downloader
+
+
+ENGINES = {'threads': segmented_downloader, 'asyncio': async_downloader}
+SEGMENT_SIZE = 8 * 1024
+
+
+
+class flaky_handler(fake_youtube.fake_youtube_handler):
+    """Drops the connection halfway through the first media response, and records the Range of every media request."""
+
+    def send_media(self, data):
+
+        with self.server._lock:
+            self.server.ranges.append(self.headers.get('Range'))
+            drop = not self.server.dropped
+            self.server.dropped = True
+
+        if not drop:
+            return super().send_media(data)
+
+        start, end = map(int, self.headers['Range'][len('bytes='):].split('-'))
+        half = (end - start + 1) // 2
+
+        self.send_response(206)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+        self.end_headers()
+        self.wfile.write(data[start:start + half])
+        self.wfile.flush()
+        self.close_connection = True
+
+        self.server.dropped_at = start + half
+
+
+
+@pytest.fixture
+def media_server(media):
+
+    server = fake_youtube.fake_youtube_server(*media).start()
+
+    yield server
+
+    server.shutdown()
+
+
+
+def audio_url(server):
+
+    return f'{server.base_url}/media/v0000000000/{fake_youtube.AUDIO_ITAG}'
+
+
+
+def make_downloader(engine, retry):
+
+    return ENGINES[engine](connections=2, segment_size=SEGMENT_SIZE, retry=retry)
+
+
+
+def write_partial(file_path, data, segments):
+
+    """Writes the bytes before each segment's pos, as an interrupted download would have left them, and its checkpoint.
+    """
+
+    partial = bytearray(len(data))
+
+    for start, end, pos in segments:
+        partial[start:pos] = data[start:pos]
+
+    with open(file_path, 'wb') as fh:
+        fh.write(partial)
+
+    download_checkpoint(file_path, 'audio', len(data), segments).save()
+
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_download(engine, retry, media_server, tmp_path):
+
+    audio = media_server.audio
+    file_path = str(tmp_path / 'audio.mp4')
+    received = []
+
+    make_downloader(engine, retry).download(audio_url(media_server), file_path, len(audio), lambda chunk, remaining: received.append(len(chunk)))
+
+    assert open(file_path, 'rb').read() == audio
+    assert sum(received) == len(audio)
+    assert not os.path.exists(file_path + '.checkpoint.json')
+
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_resume_from_checkpoint(engine, retry, media_server, tmp_path):
+
+    audio = media_server.audio
+    file_path = str(tmp_path / 'audio.mp4')
+    downloader = make_downloader(engine, retry)
+
+    # the first segment is complete, the others got a third of the way
+    segments = [[start, end, end + 1 if index == 0 else start + (end - start + 1) // 3] for index, (start, end) in enumerate(downloader.split(len(audio)))]
+    write_partial(file_path, audio, segments)
+    remaining = sum(end - pos + 1 for start, end, pos in segments)
+    received = []
+
+    downloader.download(audio_url(media_server), file_path, len(audio), lambda chunk, remaining: received.append(len(chunk)), identity='audio')
+
+    assert open(file_path, 'rb').read() == audio
+    assert sum(received) == remaining
+    assert not os.path.exists(file_path + '.checkpoint.json')
+
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_mismatched_checkpoint_starts_over(engine, retry, media_server, tmp_path):
+
+    audio = media_server.audio
+    file_path = str(tmp_path / 'audio.mp4')
+    downloader = make_downloader(engine, retry)
+
+    write_partial(file_path, audio, [[start, end, end + 1] for start, end in downloader.split(len(audio))])
+    received = []
+
+    downloader.download(audio_url(media_server), file_path, len(audio), lambda chunk, remaining: received.append(len(chunk)), identity='other audio')
+
+    assert open(file_path, 'rb').read() == audio
+    assert sum(received) == len(audio)
+
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_dropped_connection_resumes_from_last_byte(engine, retry, media_server, tmp_path):
+
+    media_server.RequestHandlerClass = flaky_handler
+    media_server.ranges = []
+    media_server.dropped = False
+
+    audio = media_server.audio
+    file_path = str(tmp_path / 'audio.mp4')
+
+    make_downloader(engine, retry).download(audio_url(media_server), file_path, len(audio))
+
+    assert open(file_path, 'rb').read() == audio
+    assert any(byte_range.startswith(f'bytes={media_server.dropped_at}-') for byte_range in media_server.ranges)
+
+
+
+def test_cancelled_async_download_saves_checkpoint(retry, media, tmp_path, monkeypatch):
+
+    # paced in small chunks, slow enough for the download to be cancelled halfway
+    monkeypatch.setattr(fake_youtube, 'CHUNK_SIZE', 1024)
+    server = fake_youtube.fake_youtube_server(*media, bandwidth=16 * 1024).start()
+
+    try:
+        audio = server.audio
+        url = audio_url(server)
+        file_path = str(tmp_path / 'audio.mp4')
+        downloader = make_downloader('asyncio', retry)
+
+        async def cancel_halfway():
+            task = asyncio.ensure_future(downloader.download_async(url, file_path, len(audio), identity='audio'))
+            await asyncio.sleep(0.5)
+            task.cancel()
+
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        downloader.loop_thread.run(cancel_halfway())
+
+        with open(file_path + '.checkpoint.json') as fh:
+            segments = json.load(fh)['segments']
+
+        remaining = sum(end - pos + 1 for start, end, pos in segments)
+        assert 0 < remaining < len(audio)
+
+        server.bandwidth = None
+        received = []
+        downloader.download(url, file_path, len(audio), lambda chunk, remaining: received.append(len(chunk)), identity='audio')
+
+        assert open(file_path, 'rb').read() == audio
+        assert sum(received) == remaining
+
+    finally:
+        server.shutdown()
+
+
+
+class download_stopped(Exception):
+    pass
+
+
+
+def test_interrupted_download_saves_checkpoint(retry, media, tmp_path, monkeypatch):
+
+    monkeypatch.setattr(fake_youtube, 'CHUNK_SIZE', 1024)
+    server = fake_youtube.fake_youtube_server(*media, bandwidth=16 * 1024).start()
+
+    try:
+        audio = server.audio
+        url = audio_url(server)
+        file_path = str(tmp_path / 'audio.mp4')
+        downloader = make_downloader('threads', retry)
+        received = []
+        lock = threading.Lock()
+
+        def stop_halfway(chunk, remaining):
+            with lock:
+                received.append(len(chunk))
+
+                if sum(received) > len(audio) // 2:
+                    raise download_stopped
+
+        with pytest.raises(download_stopped):
+            downloader.download(url, file_path, len(audio), stop_halfway, identity='audio')
+
+        checkpoint = download_checkpoint.load(file_path, 'audio', len(audio))
+        partial = open(file_path, 'rb').read()
+
+        for start, end, pos in checkpoint.segments:
+            assert partial[start:pos] == audio[start:pos]
+
+        server.bandwidth = None
+        downloader.download(url, file_path, len(audio), identity='audio')
+
+        assert open(file_path, 'rb').read() == audio
+
+    finally:
+        server.shutdown()
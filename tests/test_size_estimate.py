@@ -0,0 +1,95 @@
+import random
+
+from yt_downloader_core.downloader import yt_downloader
+from yt_downloader_core.size_estimate import download_size, playlist_size_estimate
+
+
+PLAYLIST_URL = 'https://www.youtube.com/playlist?list=PLbench5'
+
+
+
+def test_download_size():
+
+    filesizes = {'360p': 300, '720p': 700, 'audio': 50}
+
+    assert download_size(filesizes, '360p') == 350
+    assert download_size(filesizes, 'audio') == 50
+
+    # like select_streams, a missing res falls back to the highest available
+    assert download_size(filesizes, '1080p') == 750
+    assert download_size({'audio': 50}, '720p') == 50
+
+
+
+def test_estimate_is_exact_once_resolved():
+
+    videos = [{'360p': 100 * i, 'audio': 10} for i in range(1, 6)]
+    estimate = playlist_size_estimate(len(videos))
+
+    assert estimate.estimate('360p') == (0, None)
+
+    for filesizes in videos:
+        estimate.add(filesizes)
+
+    assert estimate.estimate('360p') == (1550, 0)
+    assert estimate.estimate('audio') == (50, 0)
+    assert estimate.confidence() == 1
+
+
+
+def test_margin_narrows_and_covers_the_total():
+
+    rng = random.Random(1)
+    videos = [{'720p': rng.randint(10 ** 6, 10 ** 8), 'audio': rng.randint(10 ** 5, 10 ** 6)} for i in range(200)]
+    total = sum(download_size(filesizes, '720p') for filesizes in videos)
+    estimate = playlist_size_estimate(len(videos))
+    margins = []
+
+    for filesizes in videos[:100]:
+        estimate.add(filesizes)
+
+        if estimate.resolved in (10, 50, 100):
+            guess, margin = estimate.estimate('720p')
+            margins.append(margin)
+
+            assert abs(guess - total) <= margin
+
+    assert margins == sorted(margins, reverse=True)
+    assert estimate.confidence() == 0.5
+
+
+
+def test_failed_videos_are_left_out():
+
+    estimate = playlist_size_estimate(3)
+    estimate.add({'360p': 100, 'audio': 10})
+    estimate.add({'360p': 200, 'audio': 10})
+    estimate.add_failed()
+
+    assert estimate.estimate('360p') == (320, 0)
+    assert estimate.confidence() == 1
+
+
+
+def test_res_first_seen_later():
+
+    # the first video has no 720p, so it counts at its highest res
+    estimate = playlist_size_estimate(2)
+    estimate.add({'360p': 100, 'audio': 10})
+    estimate.add({'360p': 150, '720p': 400, 'audio': 10})
+
+    assert estimate.estimate('720p') == (520, 0)
+    assert estimate.estimate('1080p') == (520, 0)
+
+
+
+def test_playlist_estimates(fake_server, retry):
+
+    playlist = yt_downloader(PLAYLIST_URL, isplaylist=True, retry=retry)
+    estimates = [(estimate.resolved, estimate.estimate('360p')) for estimate in playlist.iter_size_estimates(seed=1)]
+
+    assert [resolved for resolved, result in estimates] == [1, 2, 3, 4, 5]
+
+    # the filesizes of the videos are kept once they are released
+    assert estimates[-1][1] == (sum(download_size(vid.filesizes, '360p') for vid in playlist.vid), 0)
+    assert estimates[0][1][1] > 0
@@ -0,0 +1 @@
+"""Non-GUI helpers of the YouTube downloader (caching, download engines, etc.)."""
@@ -0,0 +1,4 @@
+from yt_downloader_core.cli import main
+
+
+main()
@@ -0,0 +1,688 @@
+from urllib.parse import urlsplit, urljoin
+from urllib.error import HTTPError
+from email.message import Message
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import asyncio, os, ssl, stat, threading
+
+from yt_downloader_core.segmented_download import segmented_downloader, download_checkpoint, _progress, RangeNotSupportedError, CHUNK_SIZE, HEADERS
+from yt_downloader_core.disk_space import preallocate
+
+
+MAX_REDIRECTS = 5
+
+# idle keep-alive connections kept per host
+MAX_IDLE_PER_HOST = 32
+
+# threads writing the downloaded chunks and checkpoints, so that the event loop never waits on the disk
+IO_WORKERS = 4
+
+
+
+class connection_pool():
+    """Keep-alive HTTP/1.1 connections of an event loop, reused across requests to the same host,
+    i.e. across the segments and streams of all videos of a playlist.
+    """
+
+    def __init__(self, max_idle_per_host=MAX_IDLE_PER_HOST):
+
+        self.max_idle_per_host = max_idle_per_host
+        self.opened = 0
+        self.reused = 0
+
+        self._idle = {}
+        self._ssl_context = None
+
+
+
+    async def acquire(self, scheme, host, port, timeout):
+
+        """Returns an idle connection to the host, or a new one.
+
+        Returns:
+            (reader, writer, reused) tuple
+        """
+
+        idle = self._idle.get((scheme, host, port))
+
+        while idle:
+            reader, writer = idle.pop()
+
+            if not writer.is_closing() and not reader.at_eof():
+                self.reused += 1
+                return reader, writer, True
+
+            writer.close()
+
+        if scheme == 'https' and self._ssl_context is None:
+            self._ssl_context = ssl.create_default_context()
+
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=self._ssl_context if scheme == 'https' else None, limit=CHUNK_SIZE * 4),
+            timeout,
+        )
+        self.opened += 1
+
+        return reader, writer, False
+
+
+
+    def release(self, scheme, host, port, reader, writer):
+
+        """Returns a connection whose response was fully read to the pool.
+        """
+
+        idle = self._idle.setdefault((scheme, host, port), [])
+
+        if len(idle) < self.max_idle_per_host and not writer.is_closing():
+            idle.append((reader, writer))
+        else:
+            writer.close()
+
+
+
+    def close(self):
+
+        for idle in self._idle.values():
+            for reader, writer in idle:
+                writer.close()
+
+        self._idle.clear()
+
+
+
+async def gather_or_cancel(*coros):
+
+    """Runs coroutines at the same time like asyncio.gather, except that the others are cancelled (and awaited)
+    as soon as one fails, i.e. the audio stream of a video whose video stream failed.
+
+    Returns:
+        list of their results
+    """
+
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+
+    try:
+        return await asyncio.gather(*tasks)
+
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+
+class pipe_writer():
+    """Writes into a pipe (i.e. one read by ffmpeg) from the event loop without blocking it:
+    writes wait on the loop for the reader to keep up instead of holding a thread.
+    Other files are written in the loop's I/O threads.
+
+    Args:
+        loop_thread (event_loop_thread): the loop the writes are made from.
+        fh (file object): the file written into, i.e. from pipe_muxer.open. Pipes are closed with the writer.
+    """
+
+    def __init__(self, loop_thread, fh):
+
+        self.loop_thread = loop_thread
+        self.fh = fh
+        self.writer = None
+
+
+
+    async def open(self):
+
+        if stat.S_ISFIFO(os.fstat(self.fh.fileno()).st_mode):
+            loop = asyncio.get_running_loop()
+            transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, self.fh)
+            self.writer = asyncio.StreamWriter(transport, protocol, None, loop)
+
+        return self
+
+
+
+    async def write(self, chunk):
+
+        if self.writer is None:
+            return await self.loop_thread.run_io(self.fh.write, chunk)
+
+        self.writer.write(chunk)
+        await self.writer.drain()
+
+
+
+    async def flush(self):
+
+        """Waits until every byte written is in the pipe, so that it can be closed without losing any.
+        """
+
+        if self.writer is not None:
+            self.writer.transport.set_write_buffer_limits(0)
+            await self.writer.drain()
+
+
+
+    def close(self):
+
+        # the transport closes the pipe once its buffer is written, abort() drops it
+        if self.writer is not None:
+            self.writer.transport.close()
+
+
+
+    def abort(self):
+
+        if self.writer is not None:
+            self.writer.transport.abort()
+
+
+
+class event_loop_thread():
+    """Runs an asyncio event loop in a daemon thread, so that blocking code (i.e. Qt or download workers)
+    can run coroutines on it and wait for them, or get a concurrent.futures.Future to add callbacks to.
+    The loop owns a connection_pool shared by everything running on it, and a few threads for its disk I/O.
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self):
+
+        self.loop = asyncio.new_event_loop()
+        self.pool = connection_pool()
+        self.io = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix='yt_downloader-io')
+
+        self._thread = threading.Thread(target=self._run, name='yt_downloader-asyncio', daemon=True)
+        self._thread.start()
+
+
+
+    @classmethod
+    def default(cls):
+
+        """Returns the event loop thread shared by the whole process, starting it if needed.
+        """
+
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+
+            return cls._default
+
+
+
+    def submit(self, coro):
+
+        """Schedules a coroutine on the loop from any thread.
+
+        Returns:
+            concurrent.futures.Future of the coroutine's result
+        """
+
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+
+
+    def run(self, coro):
+
+        """Runs a coroutine on the loop and waits for its result. Must not be called from the loop's thread.
+        If the waiting thread is interrupted, the coroutine is cancelled.
+        """
+
+        future = self.submit(coro)
+
+        try:
+            return future.result()
+
+        except BaseException:
+            future.cancel()
+            raise
+
+
+
+    async def run_io(self, fn, *args):
+
+        """Runs a blocking file operation (i.e. a write or a checkpoint save) in an I/O thread from a coroutine on the loop.
+        """
+
+        return await self.loop.run_in_executor(self.io, fn, *args)
+
+
+
+    def _run(self):
+
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+
+
+class async_downloader(segmented_downloader):
+    """Same as segmented_downloader, except that the segments are fetched by coroutines on a shared
+    asyncio event loop over pooled keep-alive connections instead of by a thread (and connection) per segment.
+    Any number of downloads can run at the same time with one network thread; their file writes and checkpoint saves
+    run in the loop's few I/O threads, so a slow disk never stalls the connections.
+
+    The blocking methods (download_stream, download, download_to) can be called from any thread other than the loop's,
+    their coroutines (download_stream_async, download_async, download_to_async) can be awaited by coroutines running on the loop.
+
+    Args:
+        loop_thread (event_loop_thread): defaults to the one shared by the process.
+    """
+
+    def __init__(self, *args, loop_thread=None, **kwargs):
+
+        super().__init__(*args, **kwargs)
+
+        self.loop_thread = loop_thread or event_loop_thread.default()
+
+
+
+    def download(self, url, file_path, filesize, progress_callback=None, identity=None):
+
+        """Downloads url into file_path on the event loop, blocking until done. See segmented_downloader.download.
+        """
+
+        return self.loop_thread.run(self.download_async(url, file_path, filesize, progress_callback, identity))
+
+
+
+    def download_to(self, url, fh, filesize, progress_callback=None):
+
+        """Downloads url in order into a writable file-like object (i.e. a pipe) on the event loop, blocking until done.
+        See segmented_downloader.download_to.
+        """
+
+        return self.loop_thread.run(self.download_to_async(url, fh, filesize, progress_callback))
+
+
+
+    async def download_to_async(self, url, fh, filesize, progress_callback=None):
+
+        """Downloads url in order into a writable file-like object, i.e. a pipe read by ffmpeg.
+        Up to self.connections segments are fetched ahead at once by coroutines and written as soon as their turn comes,
+        through a pipe_writer so that a slow reader never blocks the loop or its I/O threads.
+        """
+
+        progress = _progress(filesize, progress_callback)
+        writer = await pipe_writer(self.loop_thread, fh).open()
+        pending = deque()
+
+        async def fetch(start, end):
+            data = bytearray()
+
+            async def collect(chunk, pos):
+                data.extend(chunk)
+
+            await self.read_range_async(url, start, end, collect)
+
+            return bytes(data)
+
+        async def write_next():
+            chunk = await pending.popleft()
+            await writer.write(chunk)
+            progress.update(chunk)
+
+        try:
+            for start, end in self.split(filesize):
+                pending.append(asyncio.ensure_future(fetch(start, end)))
+
+                if len(pending) >= max(1, self.connections):
+                    await write_next()
+
+            while pending:
+                await write_next()
+
+            await writer.flush()
+
+        except BaseException:
+            for task in pending:
+                task.cancel()
+
+            await asyncio.gather(*pending, return_exceptions=True)
+            writer.abort()
+            raise
+
+        writer.close()
+
+
+
+    async def download_stream_async(self, stream, file_path, progress_callback=None, identity=None):
+
+        """Same as download_stream, as a coroutine on the loop. Streams without a known filesize or Range support
+        are downloaded by pytube in one of the loop's executor threads.
+        """
+
+        loop = asyncio.get_running_loop()
+        filesize = await loop.run_in_executor(None, self.stream_filesize, stream)
+
+        if not filesize:
+            return await loop.run_in_executor(None, self.fallback_download, stream, file_path)
+
+        if identity is None:
+            identity = str(stream.itag)
+
+        try:
+            await self.download_async(stream.url, file_path, filesize, self.stream_callback(stream, progress_callback), identity)
+
+        except RangeNotSupportedError:
+            return await loop.run_in_executor(None, self.fallback_download, stream, file_path)
+
+        return file_path
+
+
+
+    async def download_async(self, url, file_path, filesize, progress_callback=None, identity=None):
+
+        if identity is None:
+            identity = url
+
+        # files are only opened, written and saved in I/O threads, the loop keeps serving every other connection
+        checkpoint = await self.loop_thread.run_io(download_checkpoint.load, file_path, identity, filesize)
+
+        if checkpoint is None:
+            await self.loop_thread.run_io(self.create_file, file_path, filesize)
+
+            checkpoint = download_checkpoint(file_path, identity, filesize, self.split(filesize))
+
+        progress = _progress(checkpoint.bytes_remaining(), progress_callback)
+        connections = asyncio.Semaphore(max(1, self.connections))
+
+        async def download_segment(index):
+            async with connections:
+                await self.download_segment_async(url, file_path, checkpoint, index, progress)
+
+        tasks = [asyncio.ensure_future(download_segment(index)) for index in checkpoint.pending()]
+
+        try:
+            if tasks:
+                done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+
+                for task in pending:
+                    task.cancel()
+
+                await asyncio.gather(*pending, return_exceptions=True)
+
+                for task in done:
+                    task.result()
+
+        except RangeNotSupportedError:
+            await self.loop_thread.run_io(checkpoint.remove)
+            raise
+
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+
+            await self.loop_thread.run_io(checkpoint.save)
+            raise
+
+        await self.loop_thread.run_io(checkpoint.remove)
+
+
+
+    def create_file(self, file_path, filesize):
+
+        with open(file_path, 'wb') as fh:
+            preallocate(fh, filesize)
+
+
+
+    async def download_segment_async(self, url, file_path, checkpoint, index, progress):
+
+        """Downloads a segment into its place in file_path. Each chunk is written (and the checkpoint saved) in an I/O thread
+        while the next one is read from the network, with at most one write per segment in flight so they stay in order.
+        """
+
+        start, end, pos = checkpoint.segments[index]
+        fh = await self.loop_thread.run_io(open, file_path, 'r+b', 0)
+        writing = None
+
+        def write_chunk(chunk, pos):
+            fh.write(chunk)
+            checkpoint.update(index, pos)
+            progress.update(chunk)
+
+        async def write(chunk, pos):
+            nonlocal writing
+
+            if writing is not None:
+                await writing
+
+            writing = asyncio.ensure_future(self.loop_thread.run_io(write_chunk, chunk, pos))
+
+        try:
+            await self.loop_thread.run_io(fh.seek, pos)
+            await self.read_range_async(url, pos, end, write)
+
+        finally:
+            # the last write has to land before the file is closed, even if the download was cancelled
+            if writing is not None:
+                await asyncio.wait([writing])
+
+            await self.loop_thread.run_io(fh.close)
+
+        if writing is not None:
+            writing.result()
+
+
+
+    async def read_range_async(self, url, start, end, on_chunk):
+
+        """Reads bytes start to end (inclusive) of url, passing them in order to the coroutine on_chunk(chunk, next_pos).
+        Retries like segmented_downloader.read_range. A reused keep-alive connection closed by the server
+        is replaced right away without counting as a retry.
+        """
+
+        pos = start
+        tries = 0
+
+        async def read(chunk, next_pos):
+            nonlocal pos
+            pos = next_pos
+            await on_chunk(chunk, next_pos)
+
+        while pos <= end:
+            try:
+                self.retry.before(url)
+                await self.request_range(url, pos, end, read)
+
+                if pos <= end:
+                    raise asyncio.IncompleteReadError(b'', end - pos + 1)
+
+                self.retry.succeeded(url)
+
+            except _StaleConnection:
+                continue
+
+            except RangeNotSupportedError:
+                raise
+
+            except Exception as e:
+                self.retry.failed(e, url)
+
+                if not self.retry.should_retry(e, tries):
+                    raise
+
+                await asyncio.sleep(self.retry.delay(e, tries))
+                tries += 1
+
+        return pos
+
+
+
+    async def request_range(self, url, start, end, on_chunk):
+
+        """Sends one Range request for bytes start to end of url (following redirects),
+        passing its body to the coroutine on_chunk(chunk, next_pos) as it arrives.
+        The body may be sized by Content-Length, chunked, or delimited by the server closing the connection.
+        """
+
+        async def discard(chunk):
+            return 0
+
+        for redirect in range(MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            scheme = parts.scheme
+            port = parts.port or (443 if scheme == 'https' else 80)
+            target = parts.path + (f'?{parts.query}' if parts.query else '') or '/'
+
+            reader, writer, reused = await self.loop_thread.pool.acquire(scheme, parts.hostname, port, self.timeout)
+
+            # only set once the response was read to its end, so that the connection can be reused
+            reusable = False
+
+            try:
+                headers = {**HEADERS, 'Host': parts.netloc, 'Range': f'bytes={start}-{end}', 'Accept-Encoding': 'identity', 'Connection': 'keep-alive'}
+                writer.write((f'GET {target} HTTP/1.1\r\n' + ''.join(f'{key}: {value}\r\n' for key, value in headers.items()) + '\r\n').encode('latin-1'))
+
+                try:
+                    await writer.drain()
+                    status, response_headers = await self.read_head(reader)
+
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    if reused:
+                        raise _StaleConnection()
+                    raise
+
+                length = response_headers.get('Content-Length')
+                chunked = 'chunked' in response_headers.get('Transfer-Encoding', '').lower()
+                keep_alive = (length is not None or chunked) and response_headers.get('Connection', '').lower() != 'close'
+
+                if status in (301, 302, 303, 307, 308) and 'Location' in response_headers:
+                    if chunked:
+                        reusable = keep_alive and await self.read_chunked(reader, float('inf'), discard)
+                    else:
+                        await self.read_body(reader, int(length or 0), discard)
+                        reusable = keep_alive
+
+                    url = urljoin(url, response_headers['Location'])
+                    continue
+
+                if status >= 400:
+                    raise HTTPError(url, status, f'HTTP Error {status}', response_headers, None)
+
+                # the whole file is only acceptable if it is what was asked for
+                if status != 206 and start != 0:
+                    raise RangeNotSupportedError(url)
+
+                pos = start
+                wanted = end - start + 1
+
+                async def read(chunk):
+                    nonlocal pos
+                    pos += len(chunk)
+                    await on_chunk(chunk, pos)
+
+                    return self.throttle.reserve(len(chunk)) if self.throttle is not None else 0
+
+                if chunked:
+                    reusable = keep_alive and await self.read_chunked(reader, wanted, read)
+
+                elif length is None:
+                    # a short body (the server closed early) is retried by read_range_async from where it stopped
+                    await self.read_body(reader, wanted, read, until_eof=True)
+
+                else:
+                    await self.read_body(reader, min(int(length), wanted), read)
+
+                    # a 200 response to a range starting at 0 may be longer than the range
+                    reusable = keep_alive and int(length) <= wanted
+
+                return
+
+            finally:
+                if reusable:
+                    self.loop_thread.pool.release(scheme, parts.hostname, port, reader, writer)
+                else:
+                    writer.close()
+
+        raise HTTPError(url, 310, 'Too many redirects', Message(), None)
+
+
+
+    async def read_head(self, reader):
+
+        """Reads the status line and headers of a response.
+
+        Returns:
+            (status, headers) tuple, headers being an email.message.Message (case-insensitive like http.client's)
+        """
+
+        line = await asyncio.wait_for(reader.readuntil(b'\r\n'), self.timeout)
+        status = int(line.split()[1])
+        headers = Message()
+
+        while True:
+            line = await asyncio.wait_for(reader.readuntil(b'\r\n'), self.timeout)
+
+            if line == b'\r\n':
+                return status, headers
+
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip()] = value.strip()
+
+
+
+    async def read_body(self, reader, length, on_chunk, until_eof=False):
+
+        """Reads length bytes of a response body, passing each chunk to the coroutine on_chunk,
+        which may return seconds to wait before reading on (i.e. to stay under a bandwidth limit).
+        If until_eof is set, the body may also end early with the connection.
+        """
+
+        remaining = length
+
+        while remaining > 0:
+            chunk = await asyncio.wait_for(reader.read(min(CHUNK_SIZE, remaining)), self.timeout)
+
+            if not chunk:
+                if until_eof:
+                    return
+
+                raise asyncio.IncompleteReadError(b'', remaining)
+
+            remaining -= len(chunk)
+            wait = await on_chunk(chunk)
+
+            if wait:
+                await asyncio.sleep(wait)
+
+
+
+    async def read_chunked(self, reader, length, on_chunk):
+
+        """Reads up to length bytes of a chunked (Transfer-Encoding: chunked) response body, see read_body.
+
+        Returns:
+            True if the whole body was read, so that the connection can be reused
+        """
+
+        remaining = length
+
+        while True:
+            line = await asyncio.wait_for(reader.readuntil(b'\r\n'), self.timeout)
+            size = int(line.split(b';')[0], 16)
+
+            if size == 0:
+                # skip the trailer headers
+                while await asyncio.wait_for(reader.readuntil(b'\r\n'), self.timeout) != b'\r\n':
+                    pass
+
+                return True
+
+            # the rest of the body is not needed, i.e. a 200 response longer than the range
+            if size > remaining:
+                await self.read_body(reader, remaining, on_chunk)
+                return False
+
+            await self.read_body(reader, size, on_chunk)
+            await asyncio.wait_for(reader.readexactly(2), self.timeout)
+
+            remaining -= size
+
+
+
+class _StaleConnection(Exception):
+    """Raised when a reused keep-alive connection turns out to be closed by the server."""
@@ -0,0 +1,434 @@
+"""Audio-only files written in-process, without an ffmpeg process per track.
+
+YouTube's audio streams are AAC in fragmented mp4 and opus in webm. The mp4 ones are saved as they are,
+with their tags added to the moov box (tag_mp4), the webm ones are repacked into an Ogg Opus file (webm_to_opus).
+Both only copy bytes, the audio is never decoded. Inputs they can't handle raise UnsupportedAudioError,
+the caller then falls back to ffmpeg.
+"""
+
+import os, random, struct, zlib
+
+
+# output format of audio-only downloads -> codec of the streams it holds without converting (stream_format.codec prefix)
+AUDIO_FORMATS = {'mp4': 'mp4a', 'm4a': 'mp4a', 'opus': 'opus'}
+
+# iTunes atoms and Vorbis comment names of the tags written
+MP4_TAGS = {'title': b'\xa9nam', 'artist': b'\xa9ART', 'date': b'\xa9day', 'comment': b'\xa9cmt'}
+VORBIS_TAGS = {'title': 'TITLE', 'artist': 'ARTIST', 'date': 'DATE', 'comment': 'COMMENT'}
+
+COPY_SIZE = 1024 * 1024
+
+
+
+class UnsupportedAudioError(ValueError):
+    """Raised for an audio file which can't be remuxed or tagged in-process, i.e. laced webm blocks."""
+
+
+
+# boxes whose children may hold absolute file offsets (stco/co64 chunk offsets, tfhd base offsets, tfra fragment offsets)
+_MP4_CONTAINERS = (b'trak', b'mdia', b'minf', b'stbl', b'moof', b'traf', b'mfra')
+
+
+
+def _box(box_type, payload):
+
+    return struct.pack('>I', len(payload) + 8) + box_type + payload
+
+
+
+def _iter_boxes(data, start=0, end=None):
+
+    """Yields the (type, offset of the payload, end) of the boxes in data[start:end].
+    """
+
+    end = len(data) if end is None else end
+
+    while start + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, start)
+        header = 8
+
+        if size == 1:
+            size = struct.unpack_from('>Q', data, start + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - start
+
+        if size < header or start + size > end:
+            raise UnsupportedAudioError(f'Invalid mp4 box {box_type!r}')
+
+        yield box_type, start + header, start + size
+        start += size
+
+
+
+def _read_top_boxes(fh):
+
+    """Returns the (type, offset, size) of the top-level boxes of an mp4 file, seeking past their payloads.
+    """
+
+    boxes = []
+    file_size = os.fstat(fh.fileno()).st_size
+    offset = 0
+
+    while offset < file_size:
+        fh.seek(offset)
+        header = fh.read(16)
+
+        if len(header) < 8:
+            raise UnsupportedAudioError('Truncated mp4 file')
+
+        size, box_type = struct.unpack_from('>I4s', header)
+
+        if size == 1:
+            size = struct.unpack_from('>Q', header, 8)[0]
+        elif size == 0:
+            size = file_size - offset
+
+        if size < 8 or offset + size > file_size:
+            raise UnsupportedAudioError(f'Invalid mp4 box {box_type!r}')
+
+        boxes.append((box_type, offset, size))
+        offset += size
+
+    return boxes
+
+
+
+def _shift_offset(data, position, fmt, delta, after):
+
+    offset = struct.unpack_from(fmt, data, position)[0]
+
+    if offset < after:
+        return
+
+    if offset + delta >= 2 ** (struct.calcsize(fmt) * 8):
+        raise UnsupportedAudioError('File offsets overflow')
+
+    struct.pack_into(fmt, data, position, offset + delta)
+
+
+
+def _shift_offsets(data, delta, after, start=0, end=None):
+
+    """Adds delta to the absolute file offsets past after (the moov box) in the boxes of data, in place.
+    """
+
+    for box_type, payload, box_end in _iter_boxes(data, start, end):
+        if box_type in _MP4_CONTAINERS:
+            _shift_offsets(data, delta, after, payload, box_end)
+
+        elif box_type in (b'stco', b'co64'):
+            count = struct.unpack_from('>I', data, payload + 4)[0]
+            entry, fmt = (4, '>I') if box_type == b'stco' else (8, '>Q')
+
+            for position in range(payload + 8, payload + 8 + count * entry, entry):
+                _shift_offset(data, position, fmt, delta, after)
+
+        # base-data-offset-present flag
+        elif box_type == b'tfhd' and data[payload + 3] & 0x01:
+            _shift_offset(data, payload + 8, '>Q', delta, after)
+
+        elif box_type == b'tfra':
+            version = data[payload]
+            sizes = struct.unpack_from('>I', data, payload + 8)[0]
+            count = struct.unpack_from('>I', data, payload + 12)[0]
+            time_size = 8 if version else 4
+            entry = 2 * time_size + sum(((sizes >> shift) & 0x03) + 1 for shift in (4, 2, 0))
+
+            for position in range(payload + 16 + time_size, payload + 16 + count * entry, entry):
+                _shift_offset(data, position, '>Q' if version else '>I', delta, after)
+
+
+
+def mp4_tags(tags):
+
+    """Returns the udta box holding the tags as iTunes metadata, i.e. {'title': 'Some Title', 'artist': 'Some Channel'}.
+    """
+
+    items = b''.join(
+        _box(MP4_TAGS[name], _box(b'data', struct.pack('>II', 1, 0) + str(value).encode('utf-8')))
+        for name, value in tags.items() if name in MP4_TAGS and value
+    )
+    handler = _box(b'hdlr', bytes(8) + b'mdirappl' + bytes(9))
+
+    return _box(b'udta', _box(b'meta', bytes(4) + handler + _box(b'ilst', items)))
+
+
+
+def tag_mp4(input_path, output_path, tags):
+
+    """Copies an mp4 audio file to output_path with the tags in its moov box, replacing its udta box.
+    The absolute offsets after the moov box (i.e. the chunk offsets of a non-fragmented file) are shifted accordingly.
+    """
+
+    with open(input_path, 'rb') as src:
+        boxes = _read_top_boxes(src)
+        moov = next(((offset, size) for box_type, offset, size in boxes if box_type == b'moov'), None)
+
+        if moov is None:
+            raise UnsupportedAudioError('No moov box')
+
+        moov_offset, moov_size = moov
+        src.seek(moov_offset)
+        data = src.read(moov_size)
+        header = 16 if struct.unpack_from('>I', data)[0] == 1 else 8
+
+        children = [data[start - 8:end] for box_type, start, end in _iter_boxes(data, header) if box_type != b'udta']
+        new_moov = bytearray(_box(b'moov', b''.join(children) + mp4_tags(tags)))
+        delta = len(new_moov) - moov_size
+
+        if delta:
+            _shift_offsets(new_moov, delta, moov_offset, 8)
+
+        with open(output_path, 'wb') as dst:
+            for box_type, offset, size in boxes:
+                if box_type == b'moov':
+                    dst.write(new_moov)
+                    continue
+
+                src.seek(offset)
+
+                # fragments and their index may hold absolute offsets too, they are small
+                if box_type in (b'moof', b'mfra') and delta:
+                    fragment = bytearray(src.read(size))
+                    _shift_offsets(fragment, delta, moov_offset)
+                    dst.write(fragment)
+                    continue
+
+                remaining = size
+
+                while remaining:
+                    chunk = src.read(min(COPY_SIZE, remaining))
+                    dst.write(chunk)
+                    remaining -= len(chunk)
+
+
+
+# Matroska element ids
+_SEGMENT, _CLUSTER, _TRACKS, _TRACK_ENTRY, _BLOCK_GROUP = 0x18538067, 0x1F43B675, 0x1654AE6B, 0xAE, 0xA0
+_TRACK_NUMBER, _CODEC_ID, _CODEC_PRIVATE = 0xD7, 0x86, 0x63A2
+_SIMPLE_BLOCK, _BLOCK, _DISCARD_PADDING = 0xA3, 0xA1, 0x75A2
+
+# elements whose children are read, every other element is skipped
+_MASTERS = (_SEGMENT, _CLUSTER, _TRACKS, _TRACK_ENTRY, _BLOCK_GROUP)
+
+# bit-reversed bytes, Ogg's CRC is zlib's CRC-32 with the bits of each byte and of the result reversed
+_REVERSED = bytes(int(f'{byte:08b}'[::-1], 2) for byte in range(256))
+
+# Ogg page header types
+_FIRST_PAGE, _LAST_PAGE = 0x02, 0x04
+
+# samples (at 48 kHz) per opus frame, by TOC config
+_OPUS_FRAME_SAMPLES = [480, 960, 1920, 2880] * 3 + [480, 960] * 2 + [120, 240, 480, 960] * 4
+
+
+
+def _read_vint(fh, marker=False):
+
+    """Reads an EBML variable size integer, with its length marker kept for element ids.
+
+    Returns:
+        int, -1 for an unknown size, None at the end of the file
+    """
+
+    first = fh.read(1)
+
+    if not first:
+        return None
+
+    length = 9 - first[0].bit_length()
+
+    if length > 8:
+        raise UnsupportedAudioError('Invalid EBML integer')
+
+    value = first[0] if marker else first[0] & (0xFF >> length)
+    rest = fh.read(length - 1)
+
+    if len(rest) < length - 1:
+        return None
+
+    for byte in rest:
+        value = value << 8 | byte
+
+    if not marker and value == 2 ** (7 * length) - 1:
+        return -1
+
+    return value
+
+
+
+def opus_samples(packet):
+
+    """Returns the samples at 48 kHz of an opus packet, from its TOC byte.
+    """
+
+    frames = packet[0] & 0x03
+
+    if frames == 3:
+        frames = packet[1] & 0x3F if len(packet) > 1 else 0
+    elif frames:
+        frames = 2
+    else:
+        frames = 1
+
+    return _OPUS_FRAME_SAMPLES[packet[0] >> 3] * frames
+
+
+
+def ogg_crc(data):
+
+    value = zlib.crc32(data.translate(_REVERSED), 0xFFFFFFFF) ^ 0xFFFFFFFF
+
+    return int(f'{value:032b}'[::-1], 2)
+
+
+
+def opus_tags(tags):
+
+    """Returns the OpusTags header packet holding the tags as Vorbis comments.
+    """
+
+    comments = [f'{VORBIS_TAGS[name]}={value}'.encode('utf-8') for name, value in tags.items() if name in VORBIS_TAGS and value]
+    vendor = b'yt_downloader'
+
+    return b''.join([b'OpusTags', struct.pack('<I', len(vendor)), vendor, struct.pack('<I', len(comments))]
+                    + [struct.pack('<I', len(comment)) + comment for comment in comments])
+
+
+
+class ogg_opus_writer():
+    """Writes opus packets into an Ogg Opus file, about a second of audio per page like ffmpeg and libopusenc.
+
+    Args:
+        fh (file): binary file to write to.
+        opus_head (bytes): the OpusHead header packet (a webm track's CodecPrivate).
+        tags (dict): i.e. {'title': 'Some Title', 'artist': 'Some Channel'}
+    """
+
+    def __init__(self, fh, opus_head, tags, page_samples=48000):
+
+        self.fh = fh
+        self.page_samples = page_samples
+        self.serial = random.getrandbits(32)
+        self.sequence = 0
+        self.granule = 0
+
+        # samples to drop from the end of the last packet (its DiscardPadding)
+        self.discard = 0
+
+        # packets of the next page, with their samples and lacing values
+        self.packets = []
+        self.samples = 0
+        self.segments = 0
+
+        # the headers have pages of their own, the tags (a title and a few names) always fit in one
+        self.write_page([opus_head], _FIRST_PAGE)
+        self.write_page([opus_tags(tags)])
+
+
+
+    def write_page(self, packets, header_type=0):
+
+        lacing = bytearray()
+
+        for packet in packets:
+            lacing += b'\xff' * (len(packet) // 255)
+            lacing.append(len(packet) % 255)
+
+        page = bytearray(struct.pack('<4sBBqIIIB', b'OggS', 0, header_type, self.granule - self.discard, self.serial, self.sequence, 0, len(lacing)))
+        page += lacing
+        page += b''.join(packets)
+        struct.pack_into('<I', page, 22, ogg_crc(page))
+
+        self.fh.write(page)
+        self.sequence += 1
+
+
+
+    def write(self, packet):
+
+        segments = len(packet) // 255 + 1
+        self.discard = 0
+
+        if self.packets and (self.samples >= self.page_samples or self.segments + segments > 255):
+            self.write_page(self.packets)
+            self.packets = []
+            self.samples = 0
+            self.segments = 0
+
+        samples = opus_samples(packet)
+
+        self.packets.append(packet)
+        self.samples += samples
+        self.segments += segments
+        self.granule += samples
+
+
+
+    def close(self):
+
+        self.write_page(self.packets, _LAST_PAGE)
+        self.packets = []
+
+
+
+def webm_to_opus(input_path, output_path, tags):
+
+    """Repacks the opus track of a webm file into an Ogg Opus file at output_path, with the tags.
+    """
+
+    tracks = []
+    writer = None
+    track = None
+
+    with open(input_path, 'rb') as src, open(output_path, 'wb') as dst:
+        while True:
+            element_id = _read_vint(src, marker=True)
+            size = _read_vint(src)
+
+            if element_id is None or size is None:
+                break
+
+            if element_id in _MASTERS:
+                if element_id == _TRACK_ENTRY:
+                    tracks.append({})
+                continue
+
+            if size < 0:
+                raise UnsupportedAudioError(f'Unknown size of webm element {element_id:x}')
+
+            if element_id in (_TRACK_NUMBER, _CODEC_ID, _CODEC_PRIVATE) and tracks:
+                tracks[-1][element_id] = src.read(size)
+
+            elif element_id in (_SIMPLE_BLOCK, _BLOCK):
+                data = src.read(size)
+
+                if writer is None:
+                    opus = [entry for entry in tracks if entry.get(_CODEC_ID) == b'A_OPUS']
+
+                    if not opus or not opus[0].get(_CODEC_PRIVATE, b'').startswith(b'OpusHead'):
+                        raise UnsupportedAudioError('No opus track')
+
+                    track = int.from_bytes(opus[0].get(_TRACK_NUMBER, b'\x01'), 'big')
+                    writer = ogg_opus_writer(dst, opus[0][_CODEC_PRIVATE], tags)
+
+                # track number (a 1 byte vint in practice), timecode, flags
+                if data[0] & 0x7F != track or data[0] < 0x80:
+                    continue
+
+                if data[3] & 0x06:
+                    raise UnsupportedAudioError('Laced webm blocks')
+
+                writer.write(data[4:])
+
+            elif element_id == _DISCARD_PADDING and writer is not None:
+                nanoseconds = int.from_bytes(src.read(size), 'big', signed=True)
+                writer.discard = max(nanoseconds * 48000 // 10 ** 9, 0)
+
+            else:
+                src.seek(size, os.SEEK_CUR)
+
+        if writer is None:
+            raise UnsupportedAudioError('No opus audio')
+
+        writer.close()
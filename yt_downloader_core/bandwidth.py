@@ -0,0 +1,185 @@
+from datetime import datetime
+import re, threading, time
+
+
+UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+
+def parse_rate(rate):
+
+    """Parses a rate like '500K', '2M' or '1.5MB' (bytes per second) into an int.
+    """
+
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMG]?)B?\s*', str(rate), re.IGNORECASE)
+
+    if match is None:
+        raise ValueError(f'Invalid rate: {rate}')
+
+    return int(float(match[1]) * UNITS[match[2].upper()])
+
+
+
+class bandwidth_schedule():
+    """Bytes per second limits depending on the time of day.
+
+    Args:
+        rules (list): (start, end, rate) tuples with start and end as 'HH:MM', i.e. [('09:00', '17:00', 1024 ** 2)].
+            A rule may wrap around midnight (i.e. '22:00' to '06:00'). The first matching rule wins.
+        default (int): rate outside of all rules, None for unlimited.
+    """
+
+    def __init__(self, rules, default=None):
+
+        self.rules = [(self._minutes(start), self._minutes(end), rate) for start, end, rate in rules]
+        self.default = default
+
+
+
+    @classmethod
+    def parse(cls, text, default=None):
+
+        """Parses rules like '09:00-17:00=1M,22:00-06:00=5M'.
+        """
+
+        rules = []
+
+        for rule in filter(None, (rule.strip() for rule in text.split(','))):
+            times, rate = rule.split('=')
+            start, end = times.split('-')
+            rules.append((start.strip(), end.strip(), parse_rate(rate)))
+
+        return cls(rules, default)
+
+
+
+    def rate_at(self, when=None):
+
+        when = when or datetime.now()
+        minutes = when.hour * 60 + when.minute
+
+        for start, end, rate in self.rules:
+            if start <= end and start <= minutes < end:
+                return rate
+
+            if start > end and (minutes >= start or minutes < end):
+                return rate
+
+        return self.default
+
+
+
+    @staticmethod
+    def _minutes(text):
+
+        hours, minutes = text.split(':')
+        return int(hours) * 60 + int(minutes)
+
+
+
+class token_bucket():
+    """Thread-safe token bucket limiting how many bytes per second may be downloaded.
+
+    Callers reserve their bytes and then sleep off any debt, so the long-run rate stays accurate
+    even with many threads sharing the bucket.
+
+    Args:
+        rate (int): bytes per second, None for unlimited.
+        burst (float): seconds worth of bytes that can be downloaded at once after being idle.
+        schedule (bandwidth_schedule): time-of-day rates, used instead of rate.
+    """
+
+    def __init__(self, rate=None, burst=0.1, schedule=None):
+
+        self.rate = rate
+        self.burst = burst
+        self.schedule = schedule
+
+        self._tokens = 0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+
+
+    def set_rate(self, rate):
+
+        with self._lock:
+            self.rate = rate
+
+
+
+    def current_rate(self):
+
+        if self.schedule is not None:
+            return self.schedule.rate_at()
+
+        return self.rate
+
+
+
+    def consume(self, amount):
+
+        """Takes amount bytes from the bucket, sleeping as long as needed to stay under the rate.
+        """
+
+        wait = self.reserve(amount)
+
+        if wait:
+            time.sleep(wait)
+
+
+
+    def reserve(self, amount):
+
+        """Takes amount bytes from the bucket without sleeping, i.e. for asyncio callers.
+
+        Returns:
+            float of the seconds the caller has to wait before using the bytes
+        """
+
+        rate = self.current_rate()
+
+        with self._lock:
+            now = time.monotonic()
+
+            if not rate:
+                self._tokens = 0
+                self._last = now
+                return 0
+
+            self._tokens = min(rate * self.burst, self._tokens + (now - self._last) * rate)
+            self._last = now
+            self._tokens -= amount
+
+            return -self._tokens / rate if self._tokens < 0 else 0
+
+
+
+class throttle():
+    """Applies several token buckets at once, i.e. a global one shared by all downloads and one per job.
+    """
+
+    def __init__(self, *buckets):
+
+        self.buckets = [bucket for bucket in buckets if bucket is not None]
+
+
+
+    def consume(self, amount):
+
+        wait = self.reserve(amount)
+
+        if wait:
+            time.sleep(wait)
+
+
+
+    def reserve(self, amount):
+
+        """Takes amount bytes from every bucket without sleeping.
+
+        Returns:
+            float of the seconds to wait, the longest wait of all buckets
+        """
+
+        return max((bucket.reserve(amount) for bucket in self.buckets), default=0)
@@ -0,0 +1,261 @@
+"""Headless command line interface, i.e.
+
+    python -m yt_downloader_core urls.txt --res 720p --jobs 8
+
+Inputs are batch files with one video or playlist url per line (blank lines and lines starting with # are skipped),
+urls given directly, or - for stdin. Progress is printed to stdout as JSON lines, diagnostics go to stderr.
+PyQt5 is never imported.
+"""
+
+from urllib.parse import urlparse
+import argparse, json, sys, time, threading
+
+from yt_downloader_core.downloader import yt_downloader, PlaylistDownloadError
+from yt_downloader_core.metadata_cache import metadata_cache
+from yt_downloader_core.bandwidth import token_bucket, throttle, bandwidth_schedule, parse_rate
+from yt_downloader_core.progress import progress_aggregator
+from yt_downloader_core.download_index import download_index, DEDUPE_MODES
+from yt_downloader_core.playlist_sync import sync_state
+from yt_downloader_core.metrics import stage_metrics
+from yt_downloader_core.formats import POLICIES, make_policy
+from yt_downloader_core.audio import AUDIO_FORMATS
+from yt_downloader_core.disk_space import disk_budget, InsufficientDiskSpaceError, MIN_FREE
+from yt_downloader_core.muxer import mux_queue
+
+
+
+def read_urls(inputs):
+
+    """Returns the urls found in the inputs, which are urls, batch file paths or - for stdin.
+    """
+
+    urls = []
+
+    for item in inputs:
+        if item.startswith(('http://', 'https://')):
+            urls.append(item)
+            continue
+
+        fh = sys.stdin if item == '-' else open(item, encoding='utf-8')
+
+        with fh:
+            for line in fh:
+                line = line.strip()
+
+                if line and not line.startswith('#'):
+                    urls.append(line)
+
+    return urls
+
+
+
+def is_playlist_url(url):
+
+    return urlparse(url).path.rstrip('/') == '/playlist'
+
+
+
+class json_reporter():
+    """Prints download events to stdout as JSON lines, at most one progress event every interval seconds.
+    Progress events include the smoothed speed (bytes per second) and eta (seconds), unless quiet drops them.
+    """
+
+    def __init__(self, interval=0.5, out=sys.stdout, quiet=False):
+
+        self.interval = interval
+        self.out = out
+        self.quiet = quiet
+
+        self.aggregator = progress_aggregator()
+        self._record = self.aggregator.callback('batch')
+
+        self._last_progress = 0
+        self._last_completed = 0
+        self._lock = threading.Lock()
+
+
+
+    def emit(self, event, **fields):
+
+        with self._lock:
+            self.out.write(json.dumps({'event': event, 'time': round(time.time(), 3), **fields}) + '\n')
+            self.out.flush()
+
+
+
+    def progress(self, stream, chunk, bytes_remaining):
+
+        self._record(stream, chunk, bytes_remaining)
+
+        if self.quiet:
+            return
+
+        now = time.monotonic()
+
+        # videos finishing are always reported, chunk updates are throttled
+        if stream.completed == self._last_completed and now - self._last_progress < self.interval:
+            return
+
+        self._last_progress = now
+        self._last_completed = stream.completed
+
+        snapshot = self.aggregator.snapshot()[0]
+
+        self.emit(
+            'progress',
+            completed=snapshot.completed,
+            total=snapshot.total,
+            percent=snapshot.percent,
+            title=snapshot.title,
+            speed=int(snapshot.speed),
+            eta=None if snapshot.eta is None else round(snapshot.eta, 1),
+        )
+
+
+
+    def complete(self, stream, filepath):
+
+        self.emit('complete', path=filepath)
+
+
+
+def parse_args(argv=None):
+
+    parser = argparse.ArgumentParser(prog='python -m yt_downloader_core', description='Downloads YouTube videos and playlists without the GUI.')
+
+    parser.add_argument('inputs', nargs='+', help='batch files of urls (one per line), urls, or - for stdin')
+    parser.add_argument('--res', default='720p', help="resolution (i.e. 360p, 720p, 1080p) or 'audio', falls back to the highest available (default: 720p)")
+    parser.add_argument('--dir', dest='dirname', default=None, help='folder inside ~/Downloads to download into')
+    parser.add_argument('--jobs', type=int, default=4, help='videos downloaded at the same time (default: 4)')
+    parser.add_argument('--connections', type=int, default=4, help='connections per stream (default: 4)')
+    parser.add_argument('--engine', choices=('threads', 'asyncio'), default='threads',
+                        help='threads: a thread per connection, asyncio: all connections on one thread, reused across videos (default: threads)')
+    parser.add_argument('--formats', choices=tuple(POLICIES), default='mp4',
+                        help='mp4: H.264/AAC only, smallest: the smallest of mp4 and webm (VP9) at the res, opus: like smallest with the best opus audio (default: mp4)')
+    parser.add_argument('--max-size', type=parse_rate, default=None,
+                        help='highest resolution up to --res whose video and audio fit in this many bytes per video, i.e. 500M')
+    parser.add_argument('--audio-format', choices=tuple(AUDIO_FORMATS), default='mp4',
+                        help='file format of --res audio downloads, tagged with the title, channel and date: mp4, m4a (AAC) or opus (default: mp4)')
+    parser.add_argument('--scratch-dir', default=None, help='directory for temp files, i.e. a tmpfs (default: the download directory)')
+    parser.add_argument('--disk-budget', type=parse_rate, default=None,
+                        help='most disk space used by the running downloads and their temp files at once, i.e. 4G for a tmpfs --scratch-dir (default: the free space)')
+    parser.add_argument('--min-free', type=parse_rate, default=MIN_FREE, help=f'disk space always left free, i.e. 1G (default: {MIN_FREE // 1024 ** 2}M)')
+    parser.add_argument('--pipe-mux', action='store_true', help='merge through pipes while downloading instead of temp files (POSIX only, not resumable)')
+    parser.add_argument('--mux-workers', type=int, default=None, help='videos merged at the same time, separately from the downloads (default: the number of CPU cores)')
+    parser.add_argument('--mux-queue-depth', type=int, default=2, help='downloaded videos waiting for a free merge worker before more downloads wait (default: 2)')
+    parser.add_argument('--limit-rate', type=parse_rate, default=None, help='bandwidth cap of all downloads in bytes per second, i.e. 500K or 2M')
+    parser.add_argument('--job-limit-rate', type=parse_rate, default=None, help='bandwidth cap of each url/playlist given, i.e. 500K or 2M')
+    parser.add_argument('--schedule', default=None, help="time-of-day bandwidth caps replacing --limit-rate, i.e. '09:00-17:00=1M,22:00-06:00=10M'")
+    parser.add_argument('--no-cache', action='store_true', help="don't use the metadata cache")
+    parser.add_argument('--dedupe', choices=DEDUPE_MODES + ('off',), default='hardlink',
+                        help='what to do with videos downloaded before at the same res, in any directory (default: hardlink, copying if not possible)')
+    parser.add_argument('--sync', action='store_true', help='only download the videos added to each playlist since its last sync into the same --dir at the same --res')
+    parser.add_argument('--prune', action='store_true', help='with --sync, delete the downloads of videos removed from the playlists')
+    parser.add_argument('--progress-interval', type=float, default=0.5, help='minimum seconds between progress events (default: 0.5)')
+    parser.add_argument('-q', '--quiet', action='store_true', help="don't print progress events")
+    parser.add_argument('--timings', action='store_true', help='print a stage event with the duration of every metadata fetch, stream download, mux, etc.')
+    parser.add_argument('--metrics-file', default=None, help='write histograms of the stage durations to this file in the Prometheus text format when done')
+    parser.add_argument('--metrics-port', type=int, default=None, help='serve histograms of the stage durations at http://127.0.0.1:PORT/metrics while running')
+
+    return parser.parse_args(argv)
+
+
+
+def main(argv=None):
+
+    args = parse_args(argv)
+    reporter = json_reporter(args.progress_interval, quiet=args.quiet)
+    cache = None if args.no_cache else metadata_cache()
+
+    schedule = bandwidth_schedule.parse(args.schedule, default=args.limit_rate) if args.schedule else None
+    bandwidth = token_bucket(args.limit_rate, schedule=schedule)
+
+    metrics = stage_metrics((lambda event: reporter.emit('stage', **event)) if args.timings else None)
+
+    if args.metrics_port is not None:
+        metrics.serve(args.metrics_port)
+
+    options = {
+        'progress_callback': reporter.progress,
+        'complete_callback': reporter.complete,
+        'max_workers': args.jobs,
+        'cache': cache,
+        'connections': args.connections,
+        'engine': args.engine,
+        'pipe_mux': args.pipe_mux,
+        'scratch_dir': args.scratch_dir,
+        'index': download_index(),
+        'dedupe': args.dedupe,
+        'metrics': metrics,
+        'policy': make_policy(args.formats, args.max_size),
+        'audio_format': args.audio_format,
+        'disk': disk_budget(args.disk_budget, args.min_free),
+        'mux_pool': mux_queue(args.mux_workers, args.mux_queue_depth),
+    }
+
+    # every video, including the ones of the playlists, goes through a single batch so that --jobs is a global limit
+    batch = yt_downloader(None, isplaylist=True, **options)
+    batch.vid = []
+    state = sync_state() if args.sync else None
+    synced = []
+    failures = []
+    failed = 0
+
+    for url in read_urls(args.inputs):
+        options['throttle'] = throttle(bandwidth, token_bucket(args.job_limit_rate) if args.job_limit_rate else None)
+
+        if is_playlist_url(url):
+            playlist = yt_downloader(url, isplaylist=True, **options)
+
+            try:
+                if state is not None:
+                    result = playlist.prepare_sync(args.res, state, args.dirname)
+                    synced.append(playlist)
+                else:
+                    playlist.prepare_vid(refresh=True)
+
+            except Exception as e:
+                reporter.emit('failed', url=url, error=type(e).__name__, message=str(e))
+                failed += 1
+                continue
+
+            if state is not None:
+                reporter.emit('playlist', url=url, videos=len(playlist.vid), removed=result['removed'])
+            else:
+                reporter.emit('playlist', url=url, videos=len(playlist.vid))
+
+            batch.vid.extend(playlist.vid)
+
+        else:
+            batch.vid.append(yt_downloader(url, **options))
+
+    reporter.emit('start', videos=len(batch.vid), res=args.res)
+
+    try:
+        batch.download(args.res, args.dirname)
+
+    except PlaylistDownloadError as e:
+        for url, error in e.failures:
+            reporter.emit('failed', url=url, error=type(error).__name__, message=str(error))
+
+        failures = e.failures
+        failed += len(e.failures)
+
+    # the projected size of the videos doesn't fit on the disk, none was started
+    except InsufficientDiskSpaceError as e:
+        reporter.emit('failed', url=None, error=type(e).__name__, message=str(e))
+
+        failures = [(vid.url, e) for vid in batch.vid]
+        failed += len(failures)
+
+    for playlist in synced:
+        for path in playlist.finish_sync(args.res, state, args.dirname, failed=failures, prune=args.prune):
+            reporter.emit('pruned', url=playlist.url, path=path)
+
+    reporter.emit('finished', videos=len(batch.vid), failed=failed)
+
+    if args.metrics_file:
+        metrics.write_prometheus(args.metrics_file)
+
+    if failed:
+        sys.exit(1)
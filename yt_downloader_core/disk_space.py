@@ -0,0 +1,301 @@
+import errno, os, shutil, sys, threading
+
+
+# bytes always left free on a filesystem, for the rest of the system
+MIN_FREE = 256 * 1024 ** 2
+
+# seconds between checks of a download waiting for disk space, other programs may free some meanwhile
+WAIT_INTERVAL = 5
+
+
+
+class InsufficientDiskSpaceError(OSError):
+    """Raised when a download can't fit on the disk, even once the other downloads are done.
+
+    Args:
+        path (str): directory written to.
+        needed (int): bytes needed.
+        available (int): bytes available.
+    """
+
+    def __init__(self, path, needed, available):
+        super().__init__(errno.ENOSPC, f'Not enough disk space in {path}: {needed} bytes needed, {max(available, 0)} available')
+        self.path = path
+        self.needed = needed
+        self.available = available
+
+
+
+def preallocate(fh, size):
+
+    """Allocates size bytes on the disk for a file about to be written at random offsets (i.e. by download segments),
+    so that its blocks are contiguous (less fragmentation on spinning disks) and a full disk fails right away
+    instead of halfway through. Leaves a sparse file where allocating is not supported (i.e. Windows, some filesystems).
+    """
+
+    fh.truncate(size)
+
+    if size and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fh.fileno(), 0, size)
+
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                raise
+
+
+
+def allocated_bytes(directory):
+
+    """Returns the bytes the files of a directory take on the disk (0 if it doesn't exist).
+    """
+
+    total = 0
+
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return 0
+
+    for entry in entries:
+        try:
+            stat = entry.stat(follow_symlinks=False)
+        except FileNotFoundError:
+            continue
+
+        # st_blocks counts preallocated and sparse files right, it is not available on Windows
+        total += stat.st_blocks * 512 if hasattr(stat, 'st_blocks') else stat.st_size
+
+    return total
+
+
+
+def _existing(path):
+
+    """Returns path or its closest existing parent, whose filesystem path will be on.
+    """
+
+    path = os.path.abspath(path)
+
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+
+    return path
+
+
+
+class disk_reservation():
+    """Disk space reserved by a download until released, see disk_budget.reserve.
+
+    Args:
+        needs (dict): filesystem device -> [directory, bytes].
+        work_dir (str): directory of the download's temp files, whose bytes are already written.
+    """
+
+    __slots__ = ('budget', 'needs', 'work_dir', 'total', '_work_device')
+
+    def __init__(self, budget, needs, work_dir):
+
+        self.budget = budget
+        self.needs = needs
+        self.work_dir = work_dir
+        self.total = sum(nbytes for directory, nbytes in needs.values())
+        self._work_device = os.stat(_existing(work_dir)).st_dev
+
+
+
+    def pending(self, device):
+
+        """Returns the bytes of the reservation still to be written on a filesystem.
+        """
+
+        if device not in self.needs:
+            return 0
+
+        written = allocated_bytes(self.work_dir) if device == self._work_device else 0
+
+        return max(self.needs[device][1] - written, 0)
+
+
+
+    def release(self):
+
+        self.budget.release(self)
+
+
+
+    def __enter__(self):
+
+        return self
+
+
+
+    def __exit__(self, *args):
+
+        self.release()
+
+
+
+class disk_budget():
+    """Admission control of downloads by disk space, shared by all downloads of the process.
+
+    Before a video starts downloading, it reserves the most space it will take: twice its streams in its temp
+    directory while muxing (the streams plus the merged file), plus the merged file again where it is moved
+    if that is on another filesystem (i.e. a scratch_dir). A download waits while its reservation doesn't fit
+    next to the space still to be written by the running ones, so other videos that fit can go first,
+    and fails right away if it can never fit. Space already written counts, so resumed downloads need less.
+
+    Args:
+        budget (int): maximum bytes reserved by all running downloads at the same time (i.e. the size of a tmpfs
+            scratch_dir), None for only the free space. A download larger than the whole budget runs alone.
+        min_free (int): bytes always left free on each filesystem.
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, budget=None, min_free=MIN_FREE):
+
+        self.budget = budget
+        self.min_free = min_free
+
+        self._reservations = []
+        self._condition = threading.Condition()
+
+
+
+    @classmethod
+    def default(cls):
+
+        """Returns the disk budget shared by the whole process.
+        """
+
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+
+            return cls._default
+
+
+
+    def reserve(self, work_dir, output_dir, size, mux_factor=2):
+
+        """Reserves the space of a download of size bytes, waiting until it fits.
+
+        Args:
+            work_dir (str): directory of the temp files.
+            output_dir (str): directory of the final file.
+            size (int): bytes of the streams downloaded.
+            mux_factor (int): peak bytes in work_dir per byte downloaded, 1 if muxed through pipes.
+
+        Returns:
+            disk_reservation, to release once the final file is in place (a context manager)
+        """
+
+        needs = {}
+
+        for directory, nbytes in ((work_dir, size * mux_factor), (output_dir, size)):
+            device = os.stat(_existing(directory)).st_dev
+
+            # the final file is moved from work_dir, so it takes no more space on the same filesystem
+            if device not in needs:
+                needs[device] = [directory, nbytes]
+
+        reservation = disk_reservation(self, needs, work_dir)
+        waiting = False
+
+        with self._condition:
+            while True:
+                shortfall = self._shortfall(reservation)
+
+                if shortfall is None:
+                    break
+
+                directory, needed, available = shortfall
+
+                # nothing running could free space
+                if not self._reservations:
+                    raise InsufficientDiskSpaceError(directory, needed, available)
+
+                if not waiting:
+                    print(f'Waiting for disk space in {directory}: {needed} bytes needed, {max(available, 0)} available', file=sys.stderr)
+                    waiting = True
+
+                self._condition.wait(WAIT_INTERVAL)
+
+            self._reservations.append(reservation)
+
+        return reservation
+
+
+
+    def release(self, reservation):
+
+        with self._condition:
+            if reservation in self._reservations:
+                self._reservations.remove(reservation)
+                self._condition.notify_all()
+
+
+
+    def check(self, work_dir, output_dir, total, largest, mux_factor=2):
+
+        """Checks that a batch of downloads (i.e. the videos of a playlist) fits next to the running downloads before
+        any is started: all their final files in output_dir, plus the temp files of the largest one in work_dir while
+        it is muxed. Both filesystems are checked, i.e. a tmpfs scratch dir and the download directory.
+        Raises InsufficientDiskSpaceError if they don't fit.
+
+        Args:
+            total (int): bytes of the streams of all the downloads.
+            largest (int): bytes of the streams of the largest download.
+            mux_factor (int): peak bytes in work_dir per byte downloaded, 1 if muxed through pipes.
+        """
+
+        needs = {}
+
+        for directory, nbytes in ((output_dir, total), (work_dir, largest * mux_factor)):
+            device = os.stat(_existing(directory)).st_dev
+
+            if device in needs:
+                # the largest download's final file is moved from work_dir, so it is already counted in total
+                needs[device][1] += nbytes - largest
+            else:
+                needs[device] = [directory, nbytes]
+
+        with self._condition:
+            shortfalls = [(directory, nbytes, self._available(directory, device)) for device, (directory, nbytes) in needs.items()]
+
+        for directory, nbytes, available in shortfalls:
+            if nbytes > available:
+                raise InsufficientDiskSpaceError(directory, nbytes, available)
+
+
+
+    def _available(self, directory, device):
+
+        pending = sum(reservation.pending(device) for reservation in self._reservations)
+
+        return shutil.disk_usage(_existing(directory)).free - pending - self.min_free
+
+
+
+    def _shortfall(self, reservation):
+
+        """Returns the (directory, bytes needed, bytes available) of the first filesystem the reservation doesn't fit in,
+        or None if it fits.
+        """
+
+        if self.budget is not None and self._reservations:
+            reserved = sum(other.total for other in self._reservations)
+
+            if reserved + reservation.total > self.budget:
+                return reservation.work_dir, reservation.total, self.budget - reserved
+
+        for device, (directory, nbytes) in reservation.needs.items():
+            needed = reservation.pending(device)
+            available = self._available(directory, device)
+
+            if needed > available:
+                return directory, needed, available
+
+        return None
@@ -0,0 +1,158 @@
+import sqlite3, hashlib, os, shutil, time, threading
+
+from yt_downloader_core.paths import user_data_dir
+
+
+# bytes hashed at the start, middle and end of a file, hashing whole videos would take longer than relinking them
+HASH_SAMPLE_SIZE = 1024 * 1024
+
+DEDUPE_MODES = ('skip', 'hardlink', 'copy')
+
+
+
+def file_hash(path):
+
+    """Returns a quick fingerprint of a file, the hash of its size and of samples from its start, middle and end.
+    """
+
+    filesize = os.path.getsize(path)
+    digest = hashlib.blake2b(str(filesize).encode(), digest_size=16)
+
+    with open(path, 'rb') as fh:
+        for offset in sorted({0, max(0, filesize // 2 - HASH_SAMPLE_SIZE // 2), max(0, filesize - HASH_SAMPLE_SIZE)}):
+            fh.seek(offset)
+            digest.update(fh.read(HASH_SAMPLE_SIZE))
+
+    return digest.hexdigest()
+
+
+
+class download_index():
+    """Persistent SQLite index of completed downloads, keyed by video id and resolution.
+
+    Lets a video be recognized as downloaded (under any directory or title) from its url alone,
+    before any network access. Entries whose file was deleted or changed are dropped when looked up.
+
+    Args:
+        path (str): path of the SQLite file. Defaults to downloads.sqlite3 in the user data dir.
+    """
+
+    def __init__(self, path=None):
+
+        if path is None:
+            path = os.path.join(user_data_dir(), 'downloads.sqlite3')
+
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS downloads ('
+            'video_id TEXT NOT NULL, res TEXT NOT NULL, path TEXT NOT NULL, size INTEGER NOT NULL, '
+            'hash TEXT NOT NULL, added REAL NOT NULL, PRIMARY KEY (video_id, res, path))'
+        )
+        self._conn.commit()
+
+
+
+    def add(self, video_id, res, path):
+
+        """Records that the video was downloaded at res into path.
+        """
+
+        path = os.path.abspath(path)
+        row = (video_id, res, path, os.path.getsize(path), file_hash(path), time.time())
+
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO downloads (video_id, res, path, size, hash, added) VALUES (?, ?, ?, ?, ?, ?)', row)
+            self._conn.commit()
+
+
+
+    def find(self, video_id, res, verify=False):
+
+        """Returns the path of a completed download of the video at res, or None if there is none.
+        Files are checked by size, and also by hash if verify is set.
+        """
+
+        paths = self.find_all(video_id, res, verify)
+
+        return paths[0] if paths else None
+
+
+
+    def find_all(self, video_id, res, verify=False):
+
+        """Returns the paths of all completed downloads of the video at res, oldest first.
+        """
+
+        with self._lock:
+            rows = self._conn.execute('SELECT path, size, hash FROM downloads WHERE video_id = ? AND res = ? ORDER BY added', (video_id, res)).fetchall()
+
+        paths = []
+
+        for path, filesize, digest in rows:
+            try:
+                if os.path.getsize(path) == filesize and (not verify or file_hash(path) == digest):
+                    paths.append(path)
+                    continue
+
+            except OSError:
+                pass
+
+            self.remove(video_id, res, path)
+
+        return paths
+
+
+
+    def place(self, video_id, res, existing_path, output_path, mode='hardlink'):
+
+        """Makes an indexed download available at output_path, either as a hard link or a copy.
+        Hard links fall back to copies if not supported, i.e. across drives.
+
+        Returns:
+            string of output_path
+        """
+
+        if mode not in ('hardlink', 'copy'):
+            raise ValueError(f'Invalid mode: {mode}')
+
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+        if mode == 'hardlink':
+            try:
+                os.link(existing_path, output_path)
+
+            except OSError:
+                shutil.copy2(existing_path, output_path)
+
+        else:
+            shutil.copy2(existing_path, output_path)
+
+        self.add(video_id, res, output_path)
+
+        return output_path
+
+
+
+    def remove(self, video_id, res=None, path=None):
+
+        with self._lock:
+            if res is None:
+                self._conn.execute('DELETE FROM downloads WHERE video_id = ?', (video_id,))
+
+            elif path is None:
+                self._conn.execute('DELETE FROM downloads WHERE video_id = ? AND res = ?', (video_id, res))
+
+            else:
+                self._conn.execute('DELETE FROM downloads WHERE video_id = ? AND res = ? AND path = ?', (video_id, res, path))
+
+            self._conn.commit()
+
+
+
+    def close(self):
+
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,1538 @@
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED, FIRST_EXCEPTION
+from contextlib import nullcontext
+import asyncio, sys, os, re, random, traceback, threading, shutil, weakref
+from pytube import YouTube, Playlist, extract
+from pytube.exceptions import RegexMatchError
+from hurry.filesize import size
+
+from yt_downloader_core.segmented_download import segmented_downloader
+from yt_downloader_core.async_download import async_downloader, gather_or_cancel
+from yt_downloader_core.download_index import DEDUPE_MODES
+from yt_downloader_core.size_estimate import playlist_size_estimate, download_size
+from yt_downloader_core.disk_space import disk_budget
+from yt_downloader_core.muxer import mux, remux, convert_audio, pipe_muxer, mux_queue
+from yt_downloader_core.formats import format_index, selection_policy
+from yt_downloader_core.audio import AUDIO_FORMATS, UnsupportedAudioError, tag_mp4, webm_to_opus
+from yt_downloader_core.retry import retry_policy
+
+
+# host of pytube's metadata requests, for circuit breaking
+YOUTUBE_HOST = 'www.youtube.com'
+
+
+
+class PlaylistDownloadError(Exception):
+    """Raised after a playlist download if some of its videos failed.
+    The other videos in the playlist are still downloaded.
+
+    Args:
+        failures (list): (url, exception) pairs of the videos that failed.
+    """
+
+    def __init__(self, failures):
+        super().__init__(f'{len(failures)} video(s) failed to download')
+        self.failures = failures
+
+
+
+class DownloadCancelledError(Exception):
+    """Raised by a download stopped with yt_downloader.cancel(). Its partial streams are kept and resumed by the next download.
+    """
+
+
+
+class playlist_progress():
+    """Stream-like object that combines the progress of all videos in a playlist,
+    so that it can be reported through the usual progress callback.
+    Progress is counted in videos instead of bytes, i.e. filesize is the number of videos.
+    Only the videos downloading are tracked, so its memory does not grow with the playlist.
+    """
+
+    type = 'playlist'
+
+    def __init__(self, video_count, progress_callback=None):
+
+        self.filesize = video_count
+        self.title = ''
+        self.completed = 0
+        self.progress_callback = progress_callback
+
+        # fraction and bytes per stream of the videos downloading
+        self._fractions = {}
+        self._bytes_done = {}
+        self._lock = threading.Lock()
+
+
+
+    def video_callback(self, vid, res):
+
+        """Returns a progress callback for a single video of the playlist.
+        """
+
+        def callback(stream, chunk, bytes_remaining):
+            with self._lock:
+                bytes_done = self._bytes_done.setdefault(vid, {})
+                bytes_done[stream.itag] = stream.filesize - bytes_remaining
+
+                total = vid.get_download_size(res)
+                self._fractions[vid] = min(sum(bytes_done.values()) / total, 1) if total else 0
+                self.title = stream.title
+                remaining = self.filesize - self.completed - sum(self._fractions.values())
+
+            if self.progress_callback:
+                self.progress_callback(self, chunk, remaining)
+
+        return callback
+
+
+
+    def video_done(self, vid):
+
+        """Marks a single video of the playlist as done, whether it succeeded or not.
+        """
+
+        with self._lock:
+            self._fractions.pop(vid, None)
+            self._bytes_done.pop(vid, None)
+            self.completed += 1
+            remaining = self.filesize - self.completed - sum(self._fractions.values())
+
+        if self.progress_callback:
+            self.progress_callback(self, b'', remaining)
+
+
+
+# weak, so that the lock of a video is dropped once no download holds it, however many videos a playlist has
+_work_dir_locks = weakref.WeakValueDictionary()
+_work_dir_locks_lock = threading.Lock()
+
+
+
+def work_dir_lock(work_dir):
+
+    """Returns the lock of a video's temp files directory, shared by all downloads in the process.
+    """
+
+    work_dir = os.path.abspath(work_dir)
+
+    with _work_dir_locks_lock:
+        lock = _work_dir_locks.get(work_dir)
+
+        if lock is None:
+            lock = _work_dir_locks[work_dir] = threading.Lock()
+
+        return lock
+
+
+
+class stream_pair_progress():
+    """Stream-like object that combines the progress of the video and audio streams of a video
+    downloading at the same time, so that it can be reported as a single percentage.
+    """
+
+    type = 'video+audio'
+
+    def __init__(self, streams, progress_callback=None):
+
+        self.itag = '+'.join(str(stream.itag) for stream in streams)
+        self.title = streams[0].title
+        self.filesize = sum(stream.filesize for stream in streams)
+        self.progress_callback = progress_callback
+
+        self._bytes_done = {}
+        self._lock = threading.Lock()
+
+
+
+    def callback(self, stream, chunk, bytes_remaining):
+
+        with self._lock:
+            self._bytes_done[stream.itag] = stream.filesize - bytes_remaining
+            remaining = self.filesize - sum(self._bytes_done.values())
+
+        if self.progress_callback:
+            self.progress_callback(self, chunk, remaining)
+
+
+
+class download_state():
+    """A single video's download between yt_downloader.start_download and finish_download: its paths and streams,
+    and the lock of its temp files and the disk space it holds until released.
+    """
+
+    def __init__(self, res, work_dir, output_path, lock):
+
+        self.res = res
+        self.work_dir = work_dir
+        self.output_path = output_path
+
+        self.temp_video = os.path.join(work_dir, 'video.mp4')
+        self.temp_audio = os.path.join(work_dir, 'audio.mp4')
+        self.temp_merged = os.path.join(work_dir, 'merged.mp4')
+
+        self.streams = []
+        self.piped = False
+        self.reservation = None
+
+        lock.acquire()
+        self.lock = lock
+
+
+
+    def release(self):
+
+        """Releases the disk space and the lock, unless they were handed over.
+        """
+
+        if self.reservation is not None:
+            self.reservation.release()
+            self.reservation = None
+
+        if self.lock is not None:
+            self.lock.release()
+            self.lock = None
+
+
+
+    def hand_over(self):
+
+        """Returns a callback releasing the disk space and the lock later, i.e. once a queued merge is done.
+        release() no longer releases them.
+        """
+
+        reservation, lock = self.reservation, self.lock
+        self.reservation = self.lock = None
+
+        def release(*args):
+            if reservation is not None:
+                reservation.release()
+
+            lock.release()
+
+        return release
+
+
+
+class yt_downloader():
+
+    def __init__(self, url, isplaylist=False, progress_callback=None, complete_callback=None, max_workers=4, max_metadata_workers=8, cache=None, connections=4, pipe_mux=False,
+                 mux_pool=None, mux_status_callback=None, scratch_dir=None, throttle=None, index=None, dedupe='hardlink',
+                 engine='threads', metrics=None, retry=None, policy=None, audio_format='mp4', disk=None, cancelled=None):
+        
+        self.url = url
+        self.isplaylist = isplaylist
+        self.progress_callback = progress_callback
+        self.complete_callback = complete_callback
+
+        # number of playlist videos downloaded and resolved at the same time
+        self.max_workers = max_workers
+        self.max_metadata_workers = max_metadata_workers
+
+        # optional metadata_cache shared with the videos of a playlist
+        self.cache = cache
+
+        # number of connections used per stream
+        self.connections = connections
+
+        # merge video and audio through pipes while downloading instead of through temp files (POSIX only).
+        # piped downloads can't be resumed
+        self.pipe_mux = pipe_mux
+
+        # playlist videos are merged by a separate muxer.mux_queue, by default the one shared by all playlists of the process,
+        # with mux_status_callback(mux_queue) called whenever its running or queued merges change
+        self.mux_pool = mux_pool or mux_queue.default()
+        self.mux_status_callback = mux_status_callback
+        self.mux_queue = None
+
+        # directory for the temp files of each video (i.e. a tmpfs), defaults to the download directory
+        self.scratch_dir = scratch_dir
+
+        # optional bandwidth.throttle (i.e. a global and a per-job token bucket) shared with the videos of a playlist
+        self.throttle = throttle
+
+        # optional download_index shared with the videos of a playlist. A video already downloaded at the same res
+        # (in any directory) is, depending on dedupe, skipped ('skip') or hard linked/copied into the download directory ('hardlink', 'copy')
+        self.index = index
+        self.dedupe = dedupe
+
+        # download engine of the streams: 'threads' (a thread and connection per segment) or 'asyncio'
+        # (all segments of all videos on one event loop thread, reusing keep-alive connections)
+        self.engine = engine
+
+        # optional metrics.stage_metrics shared with the videos of a playlist, timing each stage of the downloads
+        self.metrics = metrics
+
+        # retry_policy shared with the videos of a playlist: retryable failures (see retry.classify) of segments,
+        # metadata fetches and playlist videos are retried on their own with backoff, with per-host circuit breaking
+        self.retry = retry or retry_policy()
+
+        # formats.selection_policy picking the streams to download (and the filesizes shown) from each video's format index,
+        # defaults to mp4 streams only
+        self.policy = policy or selection_policy()
+
+        # file format of audio-only downloads: 'mp4' (as before), 'm4a' (AAC) or 'opus' (Ogg Opus), tagged with the video's metadata.
+        # the audio is remuxed in-process, ffmpeg is only run for audio the policy could only find in another codec
+        if audio_format not in AUDIO_FORMATS:
+            raise ValueError(f'Invalid audio format: {audio_format}')
+
+        self.audio_format = audio_format
+
+        # disk_space.disk_budget shared with the videos of a playlist (by default, with all downloads of the process):
+        # each video waits until its download and mux fit on the disk, a playlist checks its projected size before starting
+        self.disk = disk or disk_budget.default()
+
+        # threading.Event shared with the videos of a playlist, set by cancel()
+        self.cancelled = cancelled or threading.Event()
+
+        self.res_options = []
+        self.filesize_options = []
+
+        # formats.format_index of a single video, built once from its streams
+        self.formats = None
+
+        # res -> streams picked by self.policy
+        self.selected = {}
+        self.filesizes = {}
+        self.failed = []
+
+        # ids of the videos removed from the playlist since its last sync
+        self.removed = []
+
+        self.vid = None
+
+        # whether the videos of the playlist in self.vid are from the cache, which only fills the GUI's options:
+        # downloads fetch the current video list
+        self.playlist_cached = False
+
+
+            
+    def prepare_vid(self, refresh=False):
+
+        """Function that retrieves the YouTube stream/s for download.
+        If refresh is set, the video list of a playlist is never taken from the cache.
+        """
+
+        if self.vid is not None and not (refresh and self.playlist_cached):
+            return
+
+        if self.isplaylist:
+            urls = self.retry.call(self.get_playlist_urls, refresh=refresh, host=YOUTUBE_HOST)
+
+            # videos already known keep their options and filesizes
+            known = {vid.url: vid for vid in self.vid or []}
+            self.vid = [known.get(url) or self.make_child(url) for url in urls]
+
+        else:
+            print(f'Initializing video for download: {self.url}', file=sys.stderr)
+            # self.complete_callback is called with the final file once it is in place, not with pytube's temp streams
+            self.vid = YouTube(self.url, on_progress_callback=self.progress_callback)
+
+
+
+    def get_playlist_urls(self, refresh=False):
+
+        """Returns the video urls of the playlist, from the cache unless refresh is set.
+        """
+
+        urls = self.cache.get_playlist(extract.playlist_id(self.url)) if self.cache and not refresh else None
+        self.playlist_cached = urls is not None
+
+        if urls is None:
+            playlist = Playlist(self.url)
+            playlist._video_regex = re.compile(r"\"url\":\"(/watch\?v=[\w-]*)")
+
+            with self.timed('playlist', playlist_id=extract.playlist_id(self.url)):
+                playlist_len = len(playlist)
+                urls = [playlist[i] for i in range(playlist_len)]
+
+            if self.cache:
+                self.cache.put_playlist(extract.playlist_id(self.url), urls)
+
+        return urls
+
+
+
+    def make_child(self, url):
+
+        """Returns the yt_downloader of a playlist video, sharing the playlist's settings.
+        """
+
+        return yt_downloader(url, progress_callback=self.progress_callback, complete_callback=self.complete_callback, cache=self.cache, connections=self.connections, pipe_mux=self.pipe_mux,
+                             scratch_dir=self.scratch_dir, throttle=self.throttle, index=self.index, dedupe=self.dedupe, engine=self.engine, metrics=self.metrics,
+                             retry=self.retry, policy=self.policy, audio_format=self.audio_format, disk=self.disk, mux_pool=self.mux_pool,
+                             cancelled=self.cancelled)
+
+
+
+    def cancel(self):
+
+        """Stops the download (from any thread) at its next chunk, raising a DownloadCancelledError.
+        The videos of a playlist not started yet are skipped.
+        """
+
+        self.cancelled.set()
+
+
+
+    def check_cancelled(self):
+
+        if self.cancelled.is_set():
+            raise DownloadCancelledError(f'Download of {self.url} cancelled')
+
+
+
+    def cancellable(self, progress_callback=None):
+
+        """Returns progress_callback checking for cancel() before each chunk is reported.
+        """
+
+        def callback(*args):
+            self.check_cancelled()
+
+            if progress_callback:
+                progress_callback(*args)
+
+        return callback
+
+
+
+    def timed(self, stage, **fields):
+
+        """Returns a context manager timing its block as stage in self.metrics, or doing nothing without metrics.
+        """
+
+        if self.metrics is None:
+            return nullcontext()
+
+        return self.metrics.time(stage, **fields)
+
+
+
+    def get_res_options(self):
+
+        """Shows which resolutions are available to download.
+        If a playlist, shows resolutions which are common to all videos in the playlist.
+
+        Returns:
+            list of strings
+            i.e. ['144p', '240p', '360p']
+        """
+
+        if self.res_options:
+            return self.res_options
+
+        if not self.isplaylist:
+
+            if not self.load_cached():
+                self.resolve_streams()
+
+            self.res_options = self.options_from_filesizes([self.filesizes])
+
+
+        else:
+
+            all_res_options = []
+
+            for vid, error in self.iter_resolved():
+                if error is not None:
+                    raise error
+
+                all_res_options.append(vid.res_options)
+                # only the res options and filesizes of the videos are needed until the playlist downloads
+                vid.release()
+
+            self.res_options = self.options_from_filesizes(all_res_options)
+
+        return self.res_options
+
+
+
+    def get_filesizes(self, formats):
+
+        """Returns the bytes downloaded for each resolution and for audio from a format index, as picked by self.policy
+        and self.audio_format.
+
+        Returns:
+            dict
+            i.e. {'360p': 1234567, '720p': 2345678, 'audio': 345678}
+        """
+
+        filesizes = self.policy.filesizes(formats)
+        filesizes['audio'] = self.policy.select_audio_as(formats, AUDIO_FORMATS[self.audio_format]).filesize
+
+        return filesizes
+
+
+
+    def resolve_streams(self):
+
+        """Fetches the streams of a single video into its format index, fills the filesizes of the formats
+        self.policy picks for each resolution and stores the video's metadata in the cache.
+        """
+
+        if self.formats is not None:
+            return
+
+        self.prepare_vid()
+        video_id = extract.video_id(self.url)
+
+        # pytube fetches lazily, so the watch page, player response and player js are fetched first to time the network apart from the parsing
+        with self.timed('metadata', video_id=video_id):
+            self.vid.check_availability()
+            self.vid.js
+
+        # a single pass over the streams, every selection is then made from the index
+        with self.timed('parse', video_id=video_id):
+            formats = format_index.from_streams(self.vid.fmt_streams)
+
+        self.filesizes = self.get_filesizes(formats)
+        self.formats = formats
+
+        if self.cache:
+            publish_date = self.vid.publish_date
+            self.cache.put_video(self.vid.video_id, self.vid.title, formats, self.vid.author, publish_date.strftime('%Y-%m-%d') if publish_date else None)
+
+
+
+    def load_cached(self, cached=None):
+
+        """Fills the filesizes of a single video from the metadata cache.
+
+        Args:
+            cached (dict): the video's cache entry if already looked up, i.e. by metadata_cache.get_videos.
+
+        Returns:
+            True if the video was found in the cache
+        """
+
+        if cached is None and self.cache:
+            cached = self.cache.get_video(extract.video_id(self.url))
+
+        if cached is None:
+            return False
+
+        self.filesizes = self.get_filesizes(format_index.from_dicts(cached['formats']))
+
+        return True
+
+
+
+    def get_cached_options(self):
+
+        """Fills the res and filesize options of the video or all videos of the playlist from the metadata cache only,
+        without any network access or retry backoff, i.e. from the GUI thread.
+
+        Returns:
+            list of (res, filesize) pairs, None if the video or any video of the playlist is not cached
+            i.e. [('360p', '5.2MB'), ('720p', '9.8MB'), ('audio', '1.1MB')]
+        """
+
+        if not self.cache:
+            return None
+
+        # not a video or playlist url (yet), i.e. while it is being typed
+        try:
+            extract.playlist_id(self.url) if self.isplaylist else extract.video_id(self.url)
+        except (RegexMatchError, KeyError):
+            return None
+
+        if not self.isplaylist:
+            if not self.res_options:
+                if not self.load_cached():
+                    return None
+
+                self.res_options = self.options_from_filesizes([self.filesizes])
+
+        elif not self.res_options:
+            urls = self.cache.get_playlist(extract.playlist_id(self.url))
+
+            if urls is None:
+                return None
+
+            # a single query for the whole playlist
+            cached = self.cache.get_videos([extract.video_id(url) for url in urls])
+
+            if len(cached) < len(set(urls)):
+                return None
+
+            vids = [self.make_child(url) for url in urls]
+
+            for vid in vids:
+                vid.load_cached(cached[extract.video_id(vid.url)])
+                vid.res_options = self.options_from_filesizes([vid.filesizes])
+
+            self.vid = vids
+            self.playlist_cached = True
+            self.res_options = self.options_from_filesizes([vid.filesizes for vid in vids])
+
+        return list(zip(self.res_options, self.get_filesize_options()))
+
+
+
+    def options_from_filesizes(self, all_filesizes):
+
+        """Returns the resolutions common to one or more videos, given their filesizes dicts (or res options), lowest first.
+
+        Returns:
+            list of strings
+            i.e. ['144p', '240p', '360p', 'audio']
+        """
+
+        common = set(all_filesizes[0]).intersection(*all_filesizes)
+        res_options = sorted([res for res in common if res != 'audio'], key=(lambda x: int(x[:-1])))
+        res_options.append('audio')
+
+        return res_options
+
+
+
+    def resolve(self, res=None, dirname=None):
+
+        """Fetches the stream metadata of a single video.
+        If res is None, all resolution options are resolved, otherwise only the streams needed for res.
+        If the video was already downloaded into dirname, no streams are fetched.
+        """
+
+        if res is None:
+            self.get_res_options()
+
+        elif self.find_indexed(res) is None and not self.is_downloaded(dirname, res):
+            self.select_streams(res)
+
+
+
+    def iter_resolved(self, res=None, dirname=None, vids=None):
+
+        """Resolves the metadata of the playlist videos concurrently, with up to self.max_metadata_workers at a time.
+        Videos are yielded as soon as they are resolved so work on them can start while the rest are still resolving.
+        Only twice as many videos as workers are resolved ahead of the caller, so a slow caller (i.e. downloading them)
+        keeps few resolved videos (and their pytube objects) in memory, however long the playlist.
+
+        Args:
+            vids (list): videos to resolve in that order, defaults to all videos of the playlist.
+
+        Yields:
+            (yt_downloader, exception or None) pairs in order of completion
+        """
+
+        self.prepare_vid()
+
+        workers = max(1, self.max_metadata_workers)
+        remaining = iter(self.vid if vids is None else vids)
+        futures = {}
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            try:
+                while True:
+                    for vid in remaining:
+                        futures[executor.submit(self.retry.call, vid.resolve, res, dirname, host=YOUTUBE_HOST)] = vid
+
+                        if len(futures) >= workers * 2:
+                            break
+
+                    if not futures:
+                        break
+
+                    done, not_done = wait(futures, return_when=FIRST_COMPLETED)
+
+                    for future in done:
+                        yield futures.pop(future), future.exception()
+
+            finally:
+                # stop resolving the remaining videos if the caller stops early
+                for future in futures:
+                    future.cancel()
+
+
+
+    def get_filesize_options(self):
+
+        """Shows the filesizes are with respect to the order found in self.res_options.
+        If a playlist, shows total filesizes given all videos are downloaded with the same resolution.
+
+        Returns:
+            list of strings
+            i.e. ['5.2MB', '9.8MB', '1.1MB']
+        """
+        
+        if self.filesize_options:
+            return self.filesize_options
+
+        if not self.isplaylist:
+            res_options = self.get_res_options()
+            audio_file_size = self.filesizes['audio']
+            self.filesize_options = [size(self.filesizes[res] + audio_file_size) + 'B' if res != 'audio' else size(audio_file_size) + 'B' for res in res_options]
+
+
+        else:
+            res_options = self.get_res_options()
+            estimate = playlist_size_estimate(len(self.vid))
+
+            for vid in self.vid:
+                estimate.add(vid.filesizes)
+
+            self.filesize_options = [size(estimate.estimate(res)[0]) + 'B' for res in res_options]
+
+
+        return self.filesize_options
+
+
+    
+    def iter_size_estimates(self, seed=None):
+
+        """Resolves the videos of the playlist in random order, yielding the refined size estimate after each one,
+        so that a usable estimate is available long before a big playlist is fully resolved.
+        Stopping the iteration stops resolving the remaining videos.
+
+        Yields:
+            size_estimate.playlist_size_estimate
+        """
+
+        self.prepare_vid()
+
+        vids = list(self.vid)
+        random.Random(seed).shuffle(vids)
+        estimate = playlist_size_estimate(len(vids))
+
+        for vid, error in self.iter_resolved(vids=vids):
+            if error is not None:
+                estimate.add_failed()
+            else:
+                estimate.add(vid.filesizes)
+
+            vid.release()
+
+            yield estimate
+
+
+
+    def set_progress_callback(self, progress_callback):
+
+        """Changes the progress callback, including the one of an already initialized YouTube stream.
+        """
+
+        self.progress_callback = progress_callback
+
+        if self.vid is not None and not self.isplaylist:
+            self.vid.register_on_progress_callback(progress_callback)
+
+
+
+    def select_streams(self, res):
+
+        """Picks the streams to download for the res specified with self.policy, once per res.
+        If the res is not available, the policy falls back to the highest available resolution.
+
+        Returns:
+            list of streams
+            i.e. [video_stream, audio_stream] or [audio_stream]
+        """
+
+        self.resolve_streams()
+
+        if res not in self.selected:
+            with self.timed('select', video_id=extract.video_id(self.url), res=res):
+                if res == 'audio':
+                    self.selected[res] = [self.policy.select_audio_as(self.formats, AUDIO_FORMATS[self.audio_format]).stream]
+                else:
+                    self.selected[res] = [fmt.stream for fmt in self.policy.select(self.formats, res)]
+
+        return self.selected[res]
+
+
+
+    def get_download_size(self, res):
+
+        """Returns the total bytes to download for a single video at the res specified.
+        """
+
+        return sum(stream.filesize for stream in self.select_streams(res))
+
+
+
+    def get_download_dir(self, dirname=None):
+
+        """Returns the download directory path, ~/Downloads[/dirname].
+        """
+
+        filepath = os.path.join(Path.home(), 'Downloads')
+
+        if dirname:
+            filepath = os.path.join(filepath, dirname)
+
+        return filepath
+
+
+
+    def prepare_dir(self, dirname=None):
+
+        """Creates the download directory if needed.
+        The working directory is never changed, so several downloads can run in the same process.
+
+        Returns:
+            string of the download directory path
+        """
+
+        filepath = self.get_download_dir(dirname)
+
+        os.makedirs(filepath, exist_ok=True)
+
+        return filepath
+
+
+
+    def get_work_dir(self, dirname=None):
+
+        """Returns the directory for the temp files of the video.
+        It is named after the video id so that an interrupted download of the video resumes from it.
+        """
+
+        if self.scratch_dir:
+            return os.path.join(self.scratch_dir, f'yt_downloader_{self.vid.video_id}')
+
+        return os.path.join(self.get_download_dir(dirname), f'temp_{self.vid.video_id}')
+
+
+
+    def get_filename(self):
+
+        """Returns the video title with chars that are invalid in filenames replaced.
+        Uses the cached title if available to avoid fetching the video.
+        """
+
+        cached = self.cache.get_video(extract.video_id(self.url)) if self.cache else None
+
+        if cached is not None:
+            filename = cached['title']
+
+        else:
+            self.prepare_vid()
+            filename = self.vid.title
+
+        filename = re.sub(r'[\\\/\:\*\?\<\>\|]', '_', filename)
+        filename = re.sub(r'[\"]', '\'', filename)
+
+        return filename
+
+
+
+    def get_extension(self, res):
+
+        """Returns the extension of the file downloaded at res.
+
+        Returns:
+            string
+            i.e. '.mp4', or '.opus' for audio with self.audio_format 'opus'
+        """
+
+        return f'.{self.audio_format}' if res == 'audio' else '.mp4'
+
+
+
+    def index_res(self, res):
+
+        """Returns the key of res in self.index and in sync states, which includes the audio format of audio not saved as mp4.
+
+        Returns:
+            string
+            i.e. '720p', 'audio' or 'audio.opus'
+        """
+
+        return f'audio.{self.audio_format}' if res == 'audio' and self.audio_format != 'mp4' else res
+
+
+
+    def get_tags(self):
+
+        """Returns the tags of the video for its audio file, from the cache if available to avoid fetching the video.
+
+        Returns:
+            dict
+            i.e. {'title': 'Some Title', 'artist': 'Some Channel', 'date': '2024-01-31', 'comment': 'https://www.youtube.com/watch?v=...'}
+        """
+
+        cached = self.cache.get_video(extract.video_id(self.url)) if self.cache else None
+
+        if cached is not None and 'author' in cached:
+            tags = {'title': cached['title'], 'artist': cached['author'], 'date': cached.get('date')}
+
+        else:
+            self.prepare_vid()
+            publish_date = self.vid.publish_date
+            tags = {'title': self.vid.title, 'artist': self.vid.author, 'date': publish_date.strftime('%Y-%m-%d') if publish_date else None}
+
+        tags['comment'] = f'https://www.youtube.com/watch?v={extract.video_id(self.url)}'
+
+        return tags
+
+
+
+    def is_downloaded(self, dirname=None, res=None):
+
+        """Checks if the video was already fully downloaded into the download directory.
+        """
+
+        return os.path.isfile(os.path.join(self.get_download_dir(dirname), f'{self.get_filename()}{self.get_extension(res)}'))
+
+
+
+    def find_indexed(self, res):
+
+        """Returns the path of a previous download of the video at res from self.index, without network access,
+        or None if there is none (or deduplication is off).
+        """
+
+        if self.index is None or self.dedupe not in DEDUPE_MODES:
+            return None
+
+        return self.index.find(extract.video_id(self.url), self.index_res(res))
+
+
+
+    def place_indexed(self, res, existing_path, dirname=None):
+
+        """Makes a previous download of the video available in the download directory according to self.dedupe,
+        under its previous filename so that the title needs not be fetched.
+
+        Returns:
+            string of the video's path
+        """
+
+        output_path = os.path.join(self.get_download_dir(dirname), os.path.basename(existing_path))
+
+        if self.dedupe == 'skip':
+            return existing_path
+
+        if os.path.exists(output_path):
+            return output_path
+
+        return self.index.place(extract.video_id(self.url), self.index_res(res), existing_path, output_path, self.dedupe)
+
+
+    
+    def download(self, res, dirname=None, finished_callback=None):
+
+        """Function that downloads the video at the res specified and inside an optional directory.
+        If playlist, this function will download all videos in the playlist, all with the same resolution,
+        with up to self.max_workers videos downloading at the same time.
+
+        If self.mux_queue is set (by the playlist), the merge is queued and its Future is returned.
+
+        Partially downloaded streams are kept and resumed by the next download of the same video.
+        The final file only appears once complete, so a video with an existing file is always skipped.
+        Videos in self.index are handled according to self.dedupe before anything is fetched.
+        """
+
+        if self.isplaylist:
+            self.check_cancelled()
+
+            # the cached video list of a playlist (up to an hour old) may miss its newest videos
+            self.prepare_vid(refresh=True)
+            self.prepare_dir(dirname)
+
+            return self.download_playlist(res, dirname)
+
+        state = self.start_download(res, dirname)
+
+        if state is None:
+            return
+
+        try:
+            if state.piped:
+                self.download_piped(state.streams, state.temp_merged)
+                self.finalize(state.work_dir, state.temp_merged, state.output_path, res)
+                return
+
+            if res != 'audio':
+                self.download_streams(state.streams, [state.temp_video, state.temp_audio])
+            else:
+                self.download_stream(state.streams[0], state.temp_audio, self.progress_callback)
+
+            return self.finish_download(state)
+
+        finally:
+            state.release()
+
+
+
+    async def download_async(self, res, dirname=None):
+
+        """Same as download() for a single video, as a coroutine on the asyncio engine's event loop (see make_engine):
+        its streams are downloaded by coroutines, and only the blocking steps before and after them
+        (i.e. waiting for disk space, saving the audio) take one of the loop's executor threads.
+        """
+
+        loop = asyncio.get_running_loop()
+        state = await loop.run_in_executor(None, self.start_download, res, dirname)
+
+        if state is None:
+            return
+
+        try:
+            engine = self.make_engine()
+
+            if state.piped:
+                await self.download_piped_async(engine, state.streams, state.temp_merged)
+                await loop.run_in_executor(None, self.finalize, state.work_dir, state.temp_merged, state.output_path, res)
+                return
+
+            if res != 'audio':
+                await self.download_streams_async(engine, state.streams, [state.temp_video, state.temp_audio])
+            else:
+                await self.download_stream_async(engine, state.streams[0], state.temp_audio, self.progress_callback)
+
+            return await loop.run_in_executor(None, self.finish_download, state)
+
+        finally:
+            state.release()
+
+
+
+    def start_download(self, res, dirname=None):
+
+        """Prepares the download of a single video: places it from self.index or an existing file if possible,
+        otherwise takes its temp files lock, picks its streams and reserves their disk space.
+
+        Returns:
+            download_state, or None if the video is already in place
+        """
+
+        self.check_cancelled()
+
+        existing_path = self.find_indexed(res)
+
+        if existing_path is not None:
+            output_path = self.place_indexed(res, existing_path, dirname)
+
+            if self.complete_callback:
+                self.complete_callback(None, output_path)
+            return None
+
+        self.prepare_vid()
+
+        filepath = self.prepare_dir(dirname)
+        output_path = os.path.join(filepath, f'{self.get_filename()}{self.get_extension(res)}')
+
+        # only one download at a time may use the temp files of a video
+        work_dir = self.get_work_dir(dirname)
+        state = download_state(res, work_dir, output_path, work_dir_lock(work_dir))
+
+        try:
+            if os.path.isfile(output_path):
+                self.record_download(res, output_path)
+
+                if self.complete_callback:
+                    self.complete_callback(None, output_path)
+
+                state.release()
+                return None
+
+            state.streams = self.select_streams(res)
+            state.piped = res != 'audio' and self.pipe_mux and pipe_muxer.is_supported()
+
+            if res == 'audio':
+                state.temp_merged = os.path.join(work_dir, f'merged{self.get_extension(res)}')
+
+            # streams muxed through pipes are only written once. Nothing is written before the space is reserved
+            state.reservation = self.disk.reserve(work_dir, filepath, sum(stream.filesize for stream in state.streams), mux_factor=1 if state.piped else 2)
+
+            os.makedirs(work_dir, exist_ok=True)
+
+        except BaseException:
+            state.release()
+            raise
+
+        return state
+
+
+
+    def finish_download(self, state):
+
+        """Merges (or saves the audio of) a single video whose streams are downloaded, and moves it in place.
+        If self.mux_queue is set (by the playlist), the merge is queued with the video's lock and disk space,
+        and its Future is returned.
+        """
+
+        if state.res == 'audio':
+            with self.timed('mux', video_id=extract.video_id(self.url), audio_format=self.audio_format):
+                self.save_audio(state.streams[0], state.temp_audio, state.temp_merged)
+
+            self.finalize(state.work_dir, state.temp_merged, state.output_path, state.res)
+            return None
+
+        # hand the merge over to the playlist's mux workers so the next video can start downloading
+        if self.mux_queue is not None:
+            future = self.mux_queue.submit(self.merge, state.work_dir, state.temp_video, state.temp_audio, state.temp_merged, state.output_path, state.res)
+            future.add_done_callback(state.hand_over())
+            return future
+
+        self.merge(state.work_dir, state.temp_video, state.temp_audio, state.temp_merged, state.output_path, state.res)
+
+
+
+    def download_streams(self, streams, file_paths):
+
+        """Downloads the video and audio streams at the same time into file_paths.
+        """
+
+        # download both streams at the same time, reporting their combined progress
+        progress = stream_pair_progress(streams, self.progress_callback)
+        self.vid.register_on_progress_callback(progress.callback)
+
+        try:
+            with ThreadPoolExecutor(max_workers=len(streams)) as executor:
+                futures = [executor.submit(self.download_stream, stream, file_path, progress.callback) for stream, file_path in zip(streams, file_paths)]
+
+            for future in futures:
+                future.result()
+
+        finally:
+            self.vid.register_on_progress_callback(self.progress_callback)
+
+
+
+    def merge(self, work_dir, temp_video, temp_audio, temp_merged, output_path, res=None):
+
+        """Merges the downloaded temp video and audio files into output_path, then removes the temp files.
+        """
+
+        with self.timed('mux', video_id=extract.video_id(self.url), bytes=os.path.getsize(temp_video) + os.path.getsize(temp_audio)):
+            mux(temp_video, temp_audio, temp_merged)
+
+        self.finalize(work_dir, temp_merged, output_path, res)
+
+
+
+    def save_audio(self, stream, temp_audio, output_path):
+
+        """Writes the downloaded audio stream to output_path in self.audio_format, tagged, without ffmpeg when the codec fits
+        (AAC into mp4/m4a, opus into Ogg Opus). Otherwise ffmpeg remuxes (opus into mp4) or converts (AAC into opus) it.
+        """
+
+        tags = self.get_tags()
+        fits = stream.audio_codec.startswith(AUDIO_FORMATS[self.audio_format])
+
+        if fits:
+            try:
+                if self.audio_format == 'opus':
+                    webm_to_opus(temp_audio, output_path, tags)
+                else:
+                    tag_mp4(temp_audio, output_path, tags)
+                return
+
+            except UnsupportedAudioError as e:
+                print(f'Remuxing {self.url} with ffmpeg: {e}', file=sys.stderr)
+
+        # opus fits in mp4 files as well
+        if fits or self.audio_format == 'mp4':
+            remux(temp_audio, output_path, tags)
+        else:
+            convert_audio(temp_audio, output_path, tags)
+
+
+
+    def finalize(self, work_dir, temp_path, output_path, res=None):
+
+        """Moves the complete file to output_path, records it in self.index, removes the video's temp files
+        and reports output_path to self.complete_callback, once per video.
+        """
+
+        with self.timed('cleanup', video_id=extract.video_id(self.url)):
+            shutil.move(temp_path, output_path)
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        self.record_download(res, output_path)
+
+        if self.complete_callback:
+            self.complete_callback(None, output_path)
+
+
+
+    def record_download(self, res, output_path):
+
+        if self.index is not None and res is not None:
+            self.index.add(extract.video_id(self.url), self.index_res(res), output_path)
+
+
+
+    def download_piped(self, streams, output_path):
+
+        """Downloads the video and audio streams at the same time straight into ffmpeg,
+        which merges them into output_path as the data arrives.
+        """
+
+        progress = stream_pair_progress(streams, self.progress_callback)
+        muxer = pipe_muxer(output_path)
+        engine = self.make_engine()
+
+        def pipe_stream(stream, fifo):
+            with self.timed('download', video_id=self.vid.video_id, itag=stream.itag, type=stream.type, bytes=stream.filesize, piped=True), muxer.open(fifo) as fh:
+                engine.download_to(stream.url, fh, stream.filesize, self.cancellable(lambda chunk, bytes_remaining: progress.callback(stream, chunk, bytes_remaining)))
+
+        muxer.start()
+
+        try:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                futures = [executor.submit(pipe_stream, streams[0], muxer.video_fifo), executor.submit(pipe_stream, streams[1], muxer.audio_fifo)]
+                done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+
+                # stop ffmpeg so that the other stream stops writing into its pipe
+                if any(future.exception() is not None for future in done):
+                    muxer.abort()
+
+            for future in futures:
+                future.result()
+
+            with self.timed('mux', video_id=self.vid.video_id, piped=True):
+                muxer.finish()
+
+        except BaseException:
+            muxer.abort()
+            raise
+
+
+
+    async def download_piped_async(self, engine, streams, output_path):
+
+        """Same as download_piped, with the streams downloaded into ffmpeg's pipes by coroutines of the asyncio engine.
+        """
+
+        progress = stream_pair_progress(streams, self.progress_callback)
+        muxer = pipe_muxer(output_path)
+        loop = asyncio.get_running_loop()
+
+        async def pipe_stream(stream, fifo):
+            with self.timed('download', video_id=self.vid.video_id, itag=stream.itag, type=stream.type, bytes=stream.filesize, piped=True):
+                # waits for ffmpeg to open the pipe
+                with await loop.run_in_executor(None, muxer.open, fifo) as fh:
+                    await engine.download_to_async(stream.url, fh, stream.filesize, self.cancellable(lambda chunk, bytes_remaining: progress.callback(stream, chunk, bytes_remaining)))
+
+        muxer.start()
+
+        try:
+            # stop the other stream as soon as one fails
+            await gather_or_cancel(pipe_stream(streams[0], muxer.video_fifo), pipe_stream(streams[1], muxer.audio_fifo))
+
+            with self.timed('mux', video_id=self.vid.video_id, piped=True):
+                await loop.run_in_executor(None, muxer.finish)
+
+        except BaseException:
+            muxer.abort()
+            raise
+
+
+
+    def download_stream(self, stream, file_path, progress_callback=None):
+
+        """Downloads a single stream into file_path, split over self.connections connections.
+        Resumes a previous partial download of the same stream into the same file.
+        """
+
+        identity = f'{self.vid.video_id}:{stream.itag}'
+
+        with self.timed('download', video_id=self.vid.video_id, itag=stream.itag, type=stream.type, bytes=stream.filesize):
+            return self.make_engine().download_stream(stream, file_path, progress_callback=self.cancellable(progress_callback), identity=identity)
+
+
+
+    async def download_streams_async(self, engine, streams, file_paths):
+
+        """Same as download_streams, with the streams downloaded by coroutines of the asyncio engine.
+        """
+
+        progress = stream_pair_progress(streams, self.progress_callback)
+        self.vid.register_on_progress_callback(progress.callback)
+
+        try:
+            await gather_or_cancel(*(self.download_stream_async(engine, stream, file_path, progress.callback) for stream, file_path in zip(streams, file_paths)))
+
+        finally:
+            self.vid.register_on_progress_callback(self.progress_callback)
+
+
+
+    async def download_stream_async(self, engine, stream, file_path, progress_callback=None):
+
+        identity = f'{self.vid.video_id}:{stream.itag}'
+
+        with self.timed('download', video_id=self.vid.video_id, itag=stream.itag, type=stream.type, bytes=stream.filesize):
+            return await engine.download_stream_async(stream, file_path, progress_callback=self.cancellable(progress_callback), identity=identity)
+
+
+
+    def make_engine(self):
+
+        if self.engine == 'asyncio':
+            return async_downloader(self.connections, throttle=self.throttle, retry=self.retry)
+
+        return segmented_downloader(self.connections, throttle=self.throttle, retry=self.retry)
+
+
+
+    def release(self):
+
+        """Drops the heavy objects of a playlist video once it is done or its options are known: its pytube.YouTube object
+        (watch page, player response and streams), format index, selected streams and playlist progress callback.
+        Only its url, filesizes and res options are kept, so a playlist's memory stays bounded however many videos it has.
+        The streams are fetched again if the video is downloaded later.
+        """
+
+        self.vid = None
+        self.formats = None
+        self.selected = {}
+        self.progress_callback = None
+
+
+
+    def check_disk_space(self, res, dirname=None):
+
+        """Checks that the videos of the playlist not downloaded yet fit on the disk before any is started:
+        all their files in the download directory, plus the temp files of the largest one while it is muxed
+        in self.scratch_dir (if set, i.e. a tmpfs) or the download directory.
+        Only done if all their sizes are in the metadata cache, otherwise each video is still admitted on its own.
+        Raises disk_space.InsufficientDiskSpaceError if they don't fit.
+        """
+
+        sizes = []
+        cached = self.cache.get_videos([extract.video_id(vid.url) for vid in self.vid if not vid.filesizes]) if self.cache else {}
+
+        for vid in self.vid:
+            if not vid.filesizes:
+                if extract.video_id(vid.url) not in cached:
+                    return
+
+                vid.load_cached(cached[extract.video_id(vid.url)])
+
+            # the title is cached too, so this needs no network access
+            if vid.find_indexed(res) is not None or vid.is_downloaded(dirname, res):
+                continue
+
+            sizes.append(download_size(vid.filesizes, res))
+
+        if sizes:
+            download_dir = self.get_download_dir(dirname)
+            piped = res != 'audio' and self.pipe_mux and pipe_muxer.is_supported()
+
+            self.disk.check(self.scratch_dir or download_dir, download_dir, sum(sizes), max(sizes), mux_factor=1 if piped else 2)
+
+
+
+    def download_playlist(self, res, dirname=None):
+
+        """Downloads the videos of a playlist concurrently, with up to self.max_workers videos at a time.
+        Videos start downloading as soon as their metadata is resolved.
+        At most twice as many videos as workers are resolved or queued ahead, and each video's pytube objects
+        are released once it is done, so memory stays flat however long the playlist.
+        A failed video does not stop the others; failures are collected in self.failed
+        and raised as a PlaylistDownloadError once every video has been attempted.
+        """
+
+        self.check_disk_space(res, dirname)
+
+        workers = max(1, self.max_workers)
+        progress = playlist_progress(len(self.vid), self.progress_callback)
+        merges = self.mux_pool
+        merge_futures = set()
+        self.failed = []
+
+        def video_failed(vid, e, stage='download'):
+            print(f'=============================\nFailed to {stage} {vid.url}\n=============================', file=sys.stderr)
+            traceback.print_exception(type(e), e, e.__traceback__)
+            self.failed.append((vid.url, e))
+
+        def video_done(vid):
+            progress.video_done(vid)
+            vid.release()
+
+        def merge_done(vid, future):
+            if future.exception() is not None:
+                video_failed(vid, future.exception(), 'merge')
+
+            merge_futures.discard(future)
+            video_done(vid)
+
+        def download_done(vid, future):
+            try:
+                result = future.result()
+
+            # not a failure, the video is resumed by the next download
+            except DownloadCancelledError:
+                video_done(vid)
+                return
+
+            except Exception as e:
+                video_failed(vid, e)
+                video_done(vid)
+                return
+
+            if isinstance(result, Future):
+                merge_futures.add(result)
+                result.add_done_callback(lambda merge_future, vid=vid: merge_done(vid, merge_future))
+            else:
+                video_done(vid)
+
+        # with the asyncio engine, each video downloads as a coroutine on the engine's event loop (see download_async)
+        # instead of holding a worker thread, so only self.max_workers of them are submitted at a time
+        if self.engine == 'asyncio':
+            loop_thread = self.make_engine().loop_thread
+            executor, window = nullcontext(), workers
+
+            def submit(vid):
+                return loop_thread.submit(self.retry.call_async(vid.download_async, res, dirname))
+
+        else:
+            executor, window = ThreadPoolExecutor(max_workers=workers), workers * 2
+
+            def submit(vid):
+                return executor.submit(self.retry.call, vid.download, res, dirname)
+
+        if self.mux_status_callback:
+            merges.watch(self.mux_status_callback)
+
+        futures = {}
+
+        try:
+            with executor:
+                # videos already downloaded by an interrupted run are not resolved again
+                for vid, error in self.iter_resolved(res, dirname):
+                    # the videos not started yet are neither resolved nor downloaded
+                    if self.cancelled.is_set():
+                        break
+
+                    if error is not None:
+                        video_failed(vid, error, 'resolve')
+                        video_done(vid)
+                        continue
+
+                    vid.set_progress_callback(progress.video_callback(vid, res))
+                    vid.mux_queue = merges
+                    # a video failing after its own segment retries (i.e. a dropped connection while fetching its metadata)
+                    # is retried on its own, resuming its partial streams, instead of failing the playlist
+                    futures[submit(vid)] = vid
+
+                    # resolving more videos waits for downloads to finish, instead of queueing the whole playlist
+                    while len(futures) >= window:
+                        done, not_done = wait(futures, return_when=FIRST_COMPLETED)
+
+                        for future in done:
+                            download_done(futures.pop(future), future)
+
+                while futures:
+                    done, not_done = wait(futures, return_when=FIRST_COMPLETED)
+
+                    for future in done:
+                        download_done(futures.pop(future), future)
+
+        except BaseException:
+            # i.e. interrupted, coroutines on the loop would go on downloading otherwise
+            for future in futures:
+                future.cancel()
+            raise
+
+        finally:
+            # the pool is shared, so only this playlist's merges are waited for
+            wait(list(merge_futures))
+
+            if self.mux_status_callback:
+                merges.unwatch(self.mux_status_callback)
+
+        self.check_cancelled()
+
+        if self.failed:
+            raise PlaylistDownloadError(self.failed)
+
+
+
+    def sync(self, res, state, dirname=None, prune=False):
+
+        """Downloads only the videos added to the playlist since its last sync into the same directory at the same res.
+        Only the new videos are resolved. Videos removed from the playlist are reported in the result
+        and, if prune is set, their downloaded files are deleted (requires self.index).
+
+        Args:
+            state (playlist_sync.sync_state): where the synced videos are remembered.
+
+        Returns:
+            dict of the new video urls, removed video ids and deleted file paths
+            i.e. {'new': ['https://www.youtube.com/watch?v=...'], 'removed': ['dQw4w9WgXcQ'], 'pruned': []}
+        """
+
+        result = self.prepare_sync(res, state, dirname)
+
+        try:
+            if self.vid:
+                self.download_playlist(res, dirname)
+
+        except PlaylistDownloadError as e:
+            # the videos which did download are synced, the failed ones are tried again by the next sync
+            self.finish_sync(res, state, dirname, failed=e.failures, prune=prune)
+            raise
+
+        # any other error (i.e. not enough disk space for the playlist) leaves the sync state as it was,
+        # so that the next sync tries all the new videos again
+        result['pruned'] = self.finish_sync(res, state, dirname, failed=[], prune=prune)
+
+        return result
+
+
+
+    def prepare_sync(self, res, state, dirname=None):
+
+        """Fetches the current video list of the playlist (never from the cache) and keeps only the videos
+        which were not synced yet in self.vid.
+
+        Returns:
+            dict of the new video urls and removed video ids
+        """
+
+        urls = self.retry.call(self.get_playlist_urls, refresh=True, host=YOUTUBE_HOST)
+        known = state.known(extract.playlist_id(self.url), self.sync_target(res, dirname))
+        current = {extract.video_id(url) for url in urls}
+
+        self.vid = [self.make_child(url) for url in urls if extract.video_id(url) not in known]
+        self.removed = sorted(known - current)
+
+        return {'new': [vid.url for vid in self.vid], 'removed': list(self.removed)}
+
+
+
+    def finish_sync(self, res, state, dirname=None, failed=None, prune=False):
+
+        """Remembers the videos of self.vid which did not fail as synced, and forgets the removed videos.
+        If prune is set, the indexed files of the removed videos inside the download directory are deleted.
+
+        Args:
+            failed (list): (url, exception) pairs, defaults to self.failed.
+
+        Returns:
+            list of deleted file paths
+        """
+
+        playlist_id = extract.playlist_id(self.url)
+        target = self.sync_target(res, dirname)
+        failed_urls = {url for url, error in (self.failed if failed is None else failed)}
+
+        state.add(playlist_id, target, [extract.video_id(vid.url) for vid in self.vid if vid.url not in failed_urls])
+
+        pruned = []
+
+        if prune and self.removed:
+            download_dir = os.path.abspath(self.get_download_dir(dirname))
+
+            for video_id in self.removed:
+                for path in (self.index.find_all(video_id, self.index_res(res)) if self.index is not None else []):
+                    if os.path.dirname(path) == download_dir:
+                        os.remove(path)
+                        self.index.remove(video_id, self.index_res(res), path)
+                        pruned.append(path)
+
+            state.remove(playlist_id, target, self.removed)
+
+        return pruned
+
+
+
+    def sync_target(self, res, dirname=None):
+
+        return f'{self.index_res(res)}:{os.path.abspath(self.get_download_dir(dirname))}'
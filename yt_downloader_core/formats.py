@@ -0,0 +1,395 @@
+"""Per-video index of the downloadable formats and the policies choosing among them.
+
+A format_index is built once per video from its pytube streams (or from the metadata cache, without streams),
+then any selection_policy picks the streams to download for a resolution from it without rescanning the streams.
+"""
+
+
+
+class NoSuitableStreamError(LookupError):
+    """Raised when a video has no format a selection_policy allows, i.e. only webm or AV1 formats for the mp4 policy.
+    The video fails the same way every time, so it is not retried.
+
+    Args:
+        stream_type (str): 'video' or 'audio'.
+        containers (tuple): containers allowed by the policy.
+    """
+
+    def __init__(self, stream_type, containers):
+        super().__init__(f'No {stream_type} format in {"/".join(containers)}')
+        self.stream_type = stream_type
+        self.containers = containers
+
+
+
+class stream_format():
+    """One adaptive (video only or audio only) format of a video.
+
+    Attributes:
+        type (str): 'video' or 'audio'.
+        res (str): resolution of a video format, i.e. '720p', None for audio.
+        container (str): 'mp4' or 'webm'.
+        codec (str): i.e. 'avc1.4d401f', 'vp9', 'mp4a.40.2' or 'opus'.
+        stream (pytube.Stream): None if loaded from the metadata cache.
+    """
+
+    __slots__ = ('itag', 'type', 'res', 'fps', 'container', 'codec', 'bitrate', 'stream', '_filesize')
+
+    def __init__(self, itag, type, res, fps, container, codec, bitrate, filesize=None, stream=None):
+
+        self.itag = itag
+        self.type = type
+        self.res = res
+        self.fps = fps
+        self.container = container
+        self.codec = codec
+        self.bitrate = bitrate
+        self.stream = stream
+
+        self._filesize = filesize or None
+
+
+
+    @classmethod
+    def from_stream(cls, stream):
+
+        codec = stream.video_codec if stream.type == 'video' else stream.audio_codec
+
+        # the size is only read from the stream when needed, pytube sends a request for it if YouTube left it out
+        return cls(stream.itag, stream.type, stream.resolution, getattr(stream, 'fps', None), stream.subtype, codec, stream.bitrate,
+                   stream._filesize, stream)
+
+
+
+    @property
+    def filesize(self):
+
+        if self._filesize is None and self.stream is not None:
+            self._filesize = self.stream.filesize
+
+        return self._filesize or 0
+
+
+
+    @property
+    def height(self):
+
+        return int(self.res[:-1]) if self.res else 0
+
+
+
+    def to_dict(self):
+
+        return {'itag': self.itag, 'type': self.type, 'res': self.res, 'fps': self.fps, 'container': self.container,
+                'codec': self.codec, 'bitrate': self.bitrate, 'filesize': self.filesize}
+
+
+
+class format_index():
+    """The adaptive formats of a video, in the order YouTube lists them, grouped once by type and resolution.
+
+    Args:
+        formats (list): stream_format objects.
+    """
+
+    __slots__ = ('formats', 'video', 'audio', 'by_res')
+
+    def __init__(self, formats):
+
+        self.formats = formats
+        self.video = [fmt for fmt in formats if fmt.type == 'video' and fmt.res is not None]
+        self.audio = [fmt for fmt in formats if fmt.type == 'audio']
+
+        self.by_res = {}
+
+        for fmt in self.video:
+            self.by_res.setdefault(fmt.res, []).append(fmt)
+
+
+
+    @classmethod
+    def from_streams(cls, streams):
+
+        """Builds the index of a video in a single pass over its pytube streams (i.e. YouTube.fmt_streams).
+        """
+
+        return cls([stream_format.from_stream(stream) for stream in streams if stream.is_adaptive])
+
+
+
+    @classmethod
+    def from_dicts(cls, formats):
+
+        """Builds the index of a video from the metadata cache (see stream_format.to_dict), without its streams.
+        """
+
+        return cls([stream_format(**fmt) for fmt in formats])
+
+
+
+    def to_dicts(self):
+
+        return [fmt.to_dict() for fmt in self.formats]
+
+
+
+    def resolutions(self):
+
+        """Returns the resolutions of the video formats, lowest first.
+
+        Returns:
+            list of strings
+            i.e. ['144p', '240p', '360p']
+        """
+
+        return sorted(self.by_res, key=(lambda x: int(x[:-1])))
+
+
+
+class selection_policy():
+    """Picks the formats to download for a resolution from a format_index.
+
+    The default picks H.264/AAC mp4 formats only, like the app always did: the last H.264 video format listed at the resolution
+    (the highest available resolution if there is none) and the last AAC audio format listed. YouTube also lists AV1
+    in mp4 (i.e. itags 394-399), which are left out by their codec.
+    Subclasses override select_video and pick_audio, or select for rules spanning both (i.e. a size cap).
+
+    Args:
+        containers (tuple): containers allowed, mp4 and webm formats can both be merged into an mp4 file.
+        codecs (tuple): codec prefixes allowed, i.e. ('avc1', 'mp4a'), None for any codec.
+    """
+
+    def __init__(self, containers=('mp4',), codecs=('avc1', 'mp4a')):
+
+        self.containers = containers
+        self.codecs = codecs
+
+
+
+    def select(self, index, res):
+
+        """Returns the formats to download for res, falling back to the highest available resolution.
+
+        Returns:
+            list of stream_format
+            i.e. [video_format, audio_format] or [audio_format]
+        """
+
+        audio = self.select_audio(index)
+
+        if res == 'audio':
+            return [audio]
+
+        return [self.select_video(index, res), audio]
+
+
+
+    def candidates(self, formats):
+
+        return [fmt for fmt in formats if fmt.container in self.containers and (self.codecs is None or (fmt.codec or '').startswith(self.codecs))]
+
+
+
+    def resolutions(self, index):
+
+        """Returns the resolutions with formats in the allowed containers, lowest first.
+        """
+
+        return [res for res in index.resolutions() if self.candidates(index.by_res[res])]
+
+
+
+    def highest_resolution(self, index):
+
+        """Returns the highest resolution with formats in the allowed containers, raises NoSuitableStreamError if none has.
+        """
+
+        resolutions = self.resolutions(index)
+
+        if not resolutions:
+            raise NoSuitableStreamError('video', self.containers)
+
+        return resolutions[-1]
+
+
+
+    def select_video(self, index, res):
+
+        candidates = self.candidates(index.by_res.get(res, []))
+
+        if not candidates:
+            return self.select_video(index, self.highest_resolution(index))
+
+        return candidates[-1]
+
+
+
+    def select_audio(self, index):
+
+        candidates = self.candidates(index.audio)
+
+        if not candidates:
+            raise NoSuitableStreamError('audio', self.containers)
+
+        return self.pick_audio(candidates)
+
+
+
+    def select_audio_as(self, index, codec):
+
+        """Returns the audio format to save in a file of its own codec (i.e. 'opus' or 'mp4a'), whatever its container,
+        or the usual audio format if none has the codec.
+        """
+
+        formats = [fmt for fmt in index.audio if fmt.codec and fmt.codec.startswith(codec)]
+
+        return self.pick_audio(formats) if formats else self.select_audio(index)
+
+
+
+    def pick_audio(self, formats):
+
+        return formats[-1]
+
+
+
+    def filesizes(self, index):
+
+        """Returns the bytes of the format picked for each resolution and for audio, i.e. yt_downloader.filesizes.
+
+        Returns:
+            dict
+            i.e. {'360p': 1234567, '720p': 2345678, 'audio': 345678}
+        """
+
+        filesizes = {res: self.select_video(index, res).filesize for res in self.resolutions(index)}
+
+        filesizes['audio'] = self.select_audio(index).filesize
+
+        return filesizes
+
+
+
+class smallest_policy(selection_policy):
+    """Picks the smallest format at the resolution, i.e. VP9/webm when it is smaller than H.264/mp4,
+    and the smallest audio format of the preferred audio codecs.
+
+    Args:
+        containers (tuple): containers allowed.
+        audio_codecs (tuple): codec prefixes to pick the audio from if available, i.e. ('opus',).
+        audio_quality (str): 'smallest' or 'best' (highest bitrate) audio.
+        codecs (tuple): codec prefixes allowed, None for any codec.
+    """
+
+    def __init__(self, containers=('mp4', 'webm'), audio_codecs=(), audio_quality='smallest', codecs=None):
+
+        super().__init__(containers, codecs)
+
+        self.audio_codecs = audio_codecs
+        self.audio_quality = audio_quality
+
+
+
+    def select_video(self, index, res):
+
+        candidates = self.candidates(index.by_res.get(res, []))
+
+        if not candidates:
+            return self.select_video(index, self.highest_resolution(index))
+
+        return min(candidates, key=(lambda fmt: fmt.filesize or float('inf')))
+
+
+
+    def pick_audio(self, formats):
+
+        preferred = [fmt for fmt in formats if fmt.codec and fmt.codec.startswith(self.audio_codecs)] if self.audio_codecs else []
+        candidates = preferred or formats
+
+        if self.audio_quality == 'best':
+            return max(candidates, key=(lambda fmt: fmt.bitrate or 0))
+
+        return min(candidates, key=(lambda fmt: fmt.filesize or float('inf')))
+
+
+
+class size_capped_policy(smallest_policy):
+    """Picks the highest resolution up to the one asked for whose download (video plus audio) fits in max_bytes,
+    the smallest format at each resolution, i.e. "best up to 1080p under 500 MB".
+    Falls back to the smallest download if none fits.
+
+    Args:
+        max_bytes (int): maximum bytes to download per video.
+    """
+
+    def __init__(self, max_bytes, containers=('mp4', 'webm'), audio_codecs=(), audio_quality='smallest', codecs=None):
+
+        super().__init__(containers, audio_codecs, audio_quality, codecs)
+
+        self.max_bytes = max_bytes
+
+
+
+    def select(self, index, res):
+
+        audio = self.select_audio(index)
+
+        if res == 'audio':
+            return [audio]
+
+        height = int(res[:-1]) if res[:-1].isdigit() else 0
+        resolutions = self.resolutions(index)[::-1]
+
+        if not resolutions:
+            raise NoSuitableStreamError('video', self.containers)
+
+        allowed = [option for option in resolutions if int(option[:-1]) <= height] or resolutions[-1:]
+
+        for option in allowed:
+            video = self.select_video(index, option)
+
+            if video.filesize + audio.filesize <= self.max_bytes:
+                return [video, audio]
+
+        return [self.select_video(index, allowed[-1]), audio]
+
+
+
+    def filesizes(self, index):
+
+        """Returns the bytes of the video format picked for each resolution under the cap and of the audio format,
+        so that the sizes shown and the disk space projected match what is downloaded.
+        """
+
+        filesizes = {res: self.select(index, res)[0].filesize for res in self.resolutions(index)}
+
+        filesizes['audio'] = self.select_audio(index).filesize
+
+        return filesizes
+
+
+
+# H.264 and VP9 video (VP9 is 'vp9' in webm and 'vp09.*' in mp4), AAC and opus audio
+SMALLEST_CODECS = ('avc1', 'vp9', 'vp09', 'mp4a', 'opus')
+
+# named policies (selection_policy keyword arguments), i.e. for the CLI's --formats
+POLICIES = {
+    'mp4': {'containers': ('mp4',), 'codecs': ('avc1', 'mp4a')},
+    'smallest': {'containers': ('mp4', 'webm'), 'codecs': SMALLEST_CODECS},
+    'opus': {'containers': ('mp4', 'webm'), 'audio_codecs': ('opus',), 'audio_quality': 'best', 'codecs': SMALLEST_CODECS},
+}
+
+
+
+def make_policy(name='mp4', max_bytes=None):
+
+    """Returns the named selection policy (see POLICIES), capped at max_bytes per video if given.
+    """
+
+    if max_bytes:
+        return size_capped_policy(max_bytes, **POLICIES[name])
+
+    if name == 'mp4':
+        return selection_policy(**POLICIES[name])
+
+    return smallest_policy(**POLICIES[name])
@@ -0,0 +1,215 @@
+import json, os, threading, time, uuid
+
+from yt_downloader_core.paths import user_data_dir
+
+
+
+class download_job():
+    """A video or playlist waiting in (or running from) the download queue.
+
+    Args:
+        priority (int): jobs with a higher priority start first, jobs with the same priority start in the order added.
+        rate_limit (int): bytes per second cap of the job, None for no cap besides the global one.
+    """
+
+    def __init__(self, url, isplaylist=False, res='360p', dirname=None, priority=0, job_id=None, added=None, state='queued', rate_limit=None):
+
+        self.url = url
+        self.isplaylist = bool(isplaylist)
+        self.res = res
+        self.dirname = dirname or None
+        self.priority = priority
+        self.job_id = job_id or uuid.uuid4().hex
+        self.added = added or time.time()
+        self.state = state
+        self.rate_limit = rate_limit
+
+
+
+    def to_dict(self):
+
+        return {
+            'url': self.url, 'isplaylist': self.isplaylist, 'res': self.res, 'dirname': self.dirname,
+            'priority': self.priority, 'job_id': self.job_id, 'added': self.added, 'state': self.state,
+            'rate_limit': self.rate_limit,
+        }
+
+
+
+    @classmethod
+    def from_dict(cls, data):
+
+        return cls(**data)
+
+
+
+def start_order(job):
+
+    # higher priority first, then the oldest
+    return -job.priority, job.added
+
+
+
+class job_queue():
+    """Persistent queue of download jobs, saved to a JSON file on every change.
+    Jobs that were running when the app closed are queued again when the queue is loaded.
+
+    Args:
+        path (str): path of the JSON file. Defaults to queue.json in the user data dir.
+    """
+
+    def __init__(self, path=None):
+
+        if path is None:
+            path = os.path.join(user_data_dir(), 'queue.json')
+
+        self.path = path
+        self.jobs = []
+
+        self._lock = threading.RLock()
+
+
+
+    @classmethod
+    def load(cls, path=None):
+
+        queue = cls(path)
+
+        try:
+            with open(queue.path, encoding='utf-8') as fh:
+                queue.jobs = [download_job.from_dict(data) for data in json.load(fh)]
+
+        except (OSError, ValueError, TypeError):
+            queue.jobs = []
+
+        for job in queue.jobs:
+            job.state = 'queued'
+
+        return queue
+
+
+
+    def save(self):
+
+        with self._lock:
+            data = json.dumps([job.to_dict() for job in self.jobs], indent=1)
+
+            with open(self.path + '.tmp', 'w', encoding='utf-8') as fh:
+                fh.write(data)
+
+            os.replace(self.path + '.tmp', self.path)
+
+
+
+    def add(self, url, isplaylist=False, res='360p', dirname=None, priority=0, rate_limit=None):
+
+        """Adds a job to the queue.
+
+        Returns:
+            download_job
+        """
+
+        job = download_job(url, isplaylist, res, dirname, priority, rate_limit=rate_limit)
+
+        with self._lock:
+            self.jobs.append(job)
+            self.save()
+
+        return job
+
+
+
+    def start_next(self, max_running):
+
+        """Marks the next job as running, unless max_running jobs are already running.
+
+        Returns:
+            download_job, or None if there is nothing to start
+        """
+
+        with self._lock:
+            if self.count('running') >= max_running:
+                return None
+
+            queued = [job for job in self.jobs if job.state == 'queued']
+
+            if not queued:
+                return None
+
+            job = min(queued, key=start_order)
+            job.state = 'running'
+            self.save()
+
+        return job
+
+
+
+    def requeue(self, job):
+
+        """Puts a running job back in the queue, i.e. to retry it.
+        """
+
+        with self._lock:
+            job.state = 'queued'
+            self.save()
+
+
+
+    def remove(self, job_id):
+
+        """Removes a queued job, i.e. one the user no longer wants. Running jobs are cancelled by their downloader instead.
+
+        Returns:
+            the removed download_job, or None if it is not queued
+        """
+
+        with self._lock:
+            job = self.get(job_id)
+
+            if job is None or job.state != 'queued':
+                return None
+
+            self.jobs.remove(job)
+            self.save()
+
+        return job
+
+
+
+    def get(self, job_id):
+
+        with self._lock:
+            return next((job for job in self.jobs if job.job_id == job_id), None)
+
+
+
+    def ordered(self):
+
+        """Returns the running jobs, then the queued ones in the order they will start.
+
+        Returns:
+            list of download_job
+        """
+
+        with self._lock:
+            return sorted(self.jobs, key=(lambda job: (job.state != 'running', start_order(job))))
+
+
+
+    def finish(self, job):
+
+        """Removes a finished (or failed) job from the queue.
+        """
+
+        with self._lock:
+            if job in self.jobs:
+                self.jobs.remove(job)
+
+            self.save()
+
+
+
+    def count(self, state):
+
+        with self._lock:
+            return sum(1 for job in self.jobs if job.state == state)
@@ -0,0 +1,221 @@
+import sqlite3, json, os, time, threading
+
+from yt_downloader_core.paths import user_cache_dir
+
+
+# reads only note their access time in memory, written with the next write or once this many are pending
+ACCESS_FLUSH = 1000
+
+# bound parameters per query, under SQLite's default limit of 999
+MAX_PARAMS = 500
+
+
+
+class metadata_cache():
+    """Persistent SQLite cache of video metadata (title and format index) and playlist video lists.
+
+    Entries older than their ttl are ignored and evicted. Once the cache holds more than
+    max_bytes of metadata, the least recently used entries are evicted. Reads never commit, their access times
+    are written in batches, so that the GUI thread can look up a whole playlist at once.
+    Stream urls are never cached since YouTube expires them after a few hours.
+
+    Args:
+        path (str): path of the SQLite file. Defaults to metadata.sqlite3 in the user cache dir.
+        ttl (int): seconds a video entry stays valid.
+        playlist_ttl (int): seconds a playlist entry stays valid. Shorter since playlists change more often.
+        max_bytes (int): maximum total size of the cached metadata.
+    """
+
+    def __init__(self, path=None, ttl=7 * 24 * 3600, playlist_ttl=3600, max_bytes=32 * 1024 * 1024):
+
+        if path is None:
+            path = os.path.join(user_cache_dir(), 'metadata.sqlite3')
+
+        self.path = path
+        self.ttl = ttl
+        self.playlist_ttl = playlist_ttl
+        self.max_bytes = max_bytes
+
+        # key -> access time of the reads not written yet
+        self._accessed = {}
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+
+        # commits (only done by writes) don't wait for the disk
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'key TEXT PRIMARY KEY, data TEXT NOT NULL, size INTEGER NOT NULL, '
+            'created REAL NOT NULL, accessed REAL NOT NULL)'
+        )
+        self._conn.commit()
+
+        self.prune()
+
+
+
+    def get_video(self, video_id):
+
+        """Returns the cached metadata of a video, or None if not cached or expired.
+
+        Returns:
+            dict
+            i.e. {'title': 'Some Title', 'author': 'Some Channel', 'date': '2024-01-31',
+                  'formats': [{'itag': 134, 'type': 'video', 'res': '360p', 'filesize': 1234, ...}, ...]}
+        """
+
+        return self._get(f'video:{video_id}', self.ttl)
+
+
+
+    def get_videos(self, video_ids):
+
+        """Returns the cached metadata of several videos (i.e. all videos of a playlist) with a single query per MAX_PARAMS videos.
+
+        Returns:
+            dict of video id -> metadata (see get_video), without the videos not cached or expired
+        """
+
+        entries = self._get_many([f'video:{video_id}' for video_id in video_ids], self.ttl)
+
+        return {key[len('video:'):]: data for key, data in entries.items()}
+
+
+
+    def put_video(self, video_id, title, formats, author=None, date=None):
+
+        """Caches the metadata of a video given its formats.format_index, so that any selection policy can be applied to it later.
+        The author and publish date (i.e. '2024-01-31') are kept for the tags of audio files.
+        """
+
+        self._put(f'video:{video_id}', {'title': title, 'author': author, 'date': date, 'formats': formats.to_dicts()})
+
+
+
+    def get_playlist(self, playlist_id):
+
+        """Returns the cached video urls of a playlist, or None if not cached or expired.
+        """
+
+        data = self._get(f'playlist:{playlist_id}', self.playlist_ttl)
+        return data['urls'] if data is not None else None
+
+
+
+    def put_playlist(self, playlist_id, urls):
+
+        """Caches the video urls of a playlist.
+        """
+
+        self._put(f'playlist:{playlist_id}', {'urls': list(urls)})
+
+
+
+    def prune(self):
+
+        """Evicts expired entries, then the least recently used entries until the cache fits in max_bytes.
+        """
+
+        now = time.time()
+
+        with self._lock:
+            # least recently used as of the last read
+            self._flush_accessed()
+
+            self._conn.execute("DELETE FROM entries WHERE key LIKE 'video:%' AND created < ?", (now - self.ttl,))
+            self._conn.execute("DELETE FROM entries WHERE key LIKE 'playlist:%' AND created < ?", (now - self.playlist_ttl,))
+
+            total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+            if total > self.max_bytes:
+                for key, size in self._conn.execute('SELECT key, size FROM entries ORDER BY accessed').fetchall():
+                    self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                    total -= size
+
+                    if total <= self.max_bytes:
+                        break
+
+            self._conn.commit()
+
+
+
+    def clear(self):
+
+        with self._lock:
+            self._accessed.clear()
+            self._conn.execute('DELETE FROM entries')
+            self._conn.commit()
+
+
+
+    def close(self):
+
+        with self._lock:
+            self._flush_accessed()
+            self._conn.commit()
+            self._conn.close()
+
+
+
+    def _get(self, key, ttl):
+
+        return self._get_many([key], ttl).get(key)
+
+
+
+    def _get_many(self, keys, ttl):
+
+        """Returns key -> data of the keys cached and not expired. Reads never commit, expired entries are left to prune.
+        """
+
+        now = time.time()
+        rows = []
+
+        with self._lock:
+            for start in range(0, len(keys), MAX_PARAMS):
+                batch = keys[start:start + MAX_PARAMS]
+                rows.extend(self._conn.execute(
+                    f'SELECT key, data FROM entries WHERE key IN ({", ".join("?" * len(batch))}) AND created >= ?', (*batch, now - ttl)
+                ).fetchall())
+
+            for key, data in rows:
+                self._accessed[key] = now
+
+            if len(self._accessed) >= ACCESS_FLUSH:
+                self._flush_accessed()
+                self._conn.commit()
+
+        return {key: json.loads(data) for key, data in rows}
+
+
+
+    def _flush_accessed(self):
+
+        """Writes the access times noted by reads, without committing. Called with self._lock held.
+        """
+
+        if self._accessed:
+            self._conn.executemany('UPDATE entries SET accessed = ? WHERE key = ?', [(accessed, key) for key, accessed in self._accessed.items()])
+            self._accessed.clear()
+
+
+
+    def _put(self, key, data):
+
+        data = json.dumps(data)
+        now = time.time()
+
+        with self._lock:
+            self._flush_accessed()
+            self._conn.execute(
+                'INSERT OR REPLACE INTO entries (key, data, size, created, accessed) VALUES (?, ?, ?, ?, ?)',
+                (key, data, len(data), now, now)
+            )
+            self._conn.commit()
+
+            total = self._conn.execute('SELECT SUM(size) FROM entries').fetchone()[0]
+
+        if total > self.max_bytes:
+            self.prune()
@@ -0,0 +1,254 @@
+from contextlib import contextmanager
+import os, threading, time
+
+
+# upper bounds in seconds of the stage duration histograms, from a cached lookup to a long download
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+METRIC_PREFIX = 'yt_downloader'
+
+
+
+class histogram():
+    """Cumulative histogram of durations, like a Prometheus histogram.
+
+    Args:
+        buckets (tuple): sorted upper bounds in seconds, an +Inf bucket is always added.
+    """
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+
+
+    def observe(self, value):
+
+        self.count += 1
+        self.sum += value
+
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+
+    def quantile(self, q):
+
+        """Returns an upper bound of the q quantile (0 to 1), the bound of the first bucket reaching it.
+
+        Returns:
+            float, inf if it is past the last bucket, None if empty
+            i.e. 0.25 for a p95 of 0.1 to 0.25 seconds
+        """
+
+        if not self.count:
+            return None
+
+        for bound, count in zip(self.buckets, self.counts):
+            if count >= q * self.count:
+                return bound
+
+        return float('inf')
+
+
+
+class _stage_totals():
+
+    __slots__ = ('durations', 'errors', 'bytes')
+
+    def __init__(self, buckets):
+
+        self.durations = histogram(buckets)
+        self.errors = 0
+        self.bytes = 0
+
+
+
+class stage_metrics():
+    """Times the stages of downloads (i.e. 'metadata', 'parse', 'download', 'mux') into histograms per stage,
+    and reports each timed stage as an event, so that slow downloads can be traced to the network, pytube or ffmpeg.
+
+    Can be shared by any number of downloads and threads. Exports the histograms in the Prometheus text format,
+    as a string, a file or an HTTP endpoint.
+
+    Args:
+        event_callback (function): called with a dict per timed stage from the thread that ran it,
+            i.e. {'stage': 'mux', 'seconds': 0.412, 'ok': True, 'video_id': 'dQw4w9WgXcQ'}
+        buckets (tuple): upper bounds in seconds of the histograms.
+    """
+
+    def __init__(self, event_callback=None, buckets=DURATION_BUCKETS):
+
+        self.event_callback = event_callback
+        self.buckets = buckets
+
+        self._stages = {}
+        self._lock = threading.Lock()
+
+
+
+    @contextmanager
+    def time(self, stage, **fields):
+
+        """Times the with block as one run of stage. Fields (i.e. video_id, bytes) are added to its event,
+        a bytes field is also added to the stage's byte count. An exception marks the run as failed.
+        """
+
+        start = time.perf_counter()
+
+        try:
+            yield
+
+        except BaseException as e:
+            self.observe(stage, time.perf_counter() - start, error=type(e).__name__, **fields)
+            raise
+
+        self.observe(stage, time.perf_counter() - start, **fields)
+
+
+
+    def observe(self, stage, seconds, error=None, **fields):
+
+        """Records a run of stage which took seconds, failed with the error name if given.
+        """
+
+        with self._lock:
+            totals = self._stages.get(stage)
+
+            if totals is None:
+                totals = self._stages[stage] = _stage_totals(self.buckets)
+
+            totals.durations.observe(seconds)
+
+            if error is not None:
+                totals.errors += 1
+            elif fields.get('bytes'):
+                totals.bytes += fields['bytes']
+
+        if self.event_callback:
+            event = {'stage': stage, 'seconds': round(seconds, 6), 'ok': error is None, **fields}
+
+            if error is not None:
+                event['error'] = error
+
+            self.event_callback(event)
+
+
+
+    def summary(self):
+
+        """Returns the totals of each stage timed so far.
+
+        Returns:
+            dict of dicts
+            i.e. {'mux': {'count': 12, 'seconds': 4.9, 'p50': 0.5, 'p95': 1, 'errors': 0, 'bytes': 0}}
+        """
+
+        with self._lock:
+            return {
+                stage: {
+                    'count': totals.durations.count,
+                    'seconds': round(totals.durations.sum, 6),
+                    'p50': totals.durations.quantile(0.5),
+                    'p95': totals.durations.quantile(0.95),
+                    'errors': totals.errors,
+                    'bytes': totals.bytes,
+                }
+                for stage, totals in self._stages.items()
+            }
+
+
+
+    def prometheus_text(self):
+
+        """Returns the metrics in the Prometheus text exposition format.
+        """
+
+        name = f'{METRIC_PREFIX}_stage_seconds'
+        lines = [
+            f'# HELP {name} Time spent in each download stage.',
+            f'# TYPE {name} histogram',
+        ]
+        errors = [
+            f'# HELP {METRIC_PREFIX}_stage_errors_total Failed runs of each download stage.',
+            f'# TYPE {METRIC_PREFIX}_stage_errors_total counter',
+        ]
+        transferred = [
+            f'# HELP {METRIC_PREFIX}_stage_bytes_total Bytes handled by the successful runs of each download stage.',
+            f'# TYPE {METRIC_PREFIX}_stage_bytes_total counter',
+        ]
+
+        with self._lock:
+            for stage, totals in sorted(self._stages.items()):
+                label = f'stage="{stage}"'
+
+                for bound, count in zip(totals.durations.buckets, totals.durations.counts):
+                    lines.append(f'{name}_bucket{{{label},le="{bound}"}} {count}')
+
+                lines.append(f'{name}_bucket{{{label},le="+Inf"}} {totals.durations.count}')
+                lines.append(f'{name}_sum{{{label}}} {totals.durations.sum:.6f}')
+                lines.append(f'{name}_count{{{label}}} {totals.durations.count}')
+                errors.append(f'{METRIC_PREFIX}_stage_errors_total{{{label}}} {totals.errors}')
+                transferred.append(f'{METRIC_PREFIX}_stage_bytes_total{{{label}}} {totals.bytes}')
+
+        return '\n'.join(lines + errors + transferred) + '\n'
+
+
+
+    def write_prometheus(self, path):
+
+        """Writes the Prometheus text to path (i.e. for node_exporter's textfile collector),
+        replacing it at once so that readers never see a partial file.
+        """
+
+        temp_path = f'{path}.tmp'
+
+        with open(temp_path, 'w', encoding='utf-8') as fh:
+            fh.write(self.prometheus_text())
+
+        os.replace(temp_path, path)
+
+
+
+    def serve(self, port, address='127.0.0.1'):
+
+        """Serves the Prometheus text at http://address:port/metrics from a daemon thread.
+
+        Returns:
+            the http.server.ThreadingHTTPServer, shutdown() stops it
+        """
+
+        # only imported when serving, importing it takes longer than the rest of this module
+        import http.server
+
+        metrics = self
+
+        class handler(http.server.BaseHTTPRequestHandler):
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+
+                data = metrics.prometheus_text().encode('utf-8')
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        server = http.server.ThreadingHTTPServer((address, port), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name='yt_downloader-metrics', daemon=True).start()
+
+        return server
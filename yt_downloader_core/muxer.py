@@ -0,0 +1,294 @@
+from concurrent.futures import ThreadPoolExecutor
+import ffmpeg, os, errno, shutil, tempfile, threading, time
+
+
+
+def mux(video_path, audio_path, output_path):
+
+    """Merges a video and an audio file into output_path.
+    Streams are copied as they are, never re-encoded.
+    """
+
+    video_stream = ffmpeg.input(video_path)
+    audio_stream = ffmpeg.input(audio_path)
+
+    ffmpeg.output(audio_stream, video_stream, output_path, c='copy').overwrite_output().run()
+
+
+
+def _metadata_args(tags):
+
+    # a -metadata option per tag, ffmpeg-python takes each option name once
+    values = [f'{name}={value}' for name, value in (tags or {}).items() if value]
+
+    return {f'metadata:g:{i}': value for i, value in enumerate(values)}
+
+
+
+def remux(input_path, output_path, tags=None):
+
+    """Copies the streams of a file into the container of output_path's extension, i.e. webm/opus audio into mp4,
+    with the tags (i.e. {'title': 'Some Title'}) as its metadata.
+    """
+
+    ffmpeg.input(input_path).output(output_path, c='copy', **_metadata_args(tags)).overwrite_output().run()
+
+
+
+def convert_audio(input_path, output_path, tags=None):
+
+    """Re-encodes an audio file into the codec of output_path's extension (i.e. AAC into opus), with the tags as its metadata.
+    Only used for audio which is not available in that codec.
+    """
+
+    ffmpeg.input(input_path).output(output_path, vn=None, **_metadata_args(tags)).overwrite_output().run()
+
+
+
+class pipe_muxer():
+    """Merges a video and an audio stream into output_path while they download, without temp files.
+
+    The streams are written in order into two named pipes (FIFOs) read by an ffmpeg process
+    which copies them into the output file. Named pipes are only available on POSIX systems.
+
+    Args:
+        output_path (str): path of the merged file.
+    """
+
+    def __init__(self, output_path):
+
+        self.output_path = output_path
+        self.process = None
+
+        self._dir = tempfile.mkdtemp(prefix='yt_downloader_')
+        self._aborted = threading.Event()
+
+        self.video_fifo = os.path.join(self._dir, 'video.mp4')
+        self.audio_fifo = os.path.join(self._dir, 'audio.mp4')
+
+        os.mkfifo(self.video_fifo)
+        os.mkfifo(self.audio_fifo)
+
+
+
+    @staticmethod
+    def is_supported():
+
+        return hasattr(os, 'mkfifo')
+
+
+
+    def start(self):
+
+        video_stream = ffmpeg.input(self.video_fifo)
+        audio_stream = ffmpeg.input(self.audio_fifo)
+
+        self.process = ffmpeg.output(audio_stream, video_stream, self.output_path, c='copy').overwrite_output().run_async()
+
+
+
+    def open(self, fifo):
+
+        """Opens one of the pipes for writing once ffmpeg opens it for reading.
+
+        Returns:
+            file object
+        """
+
+        while True:
+            try:
+                fd = os.open(fifo, os.O_WRONLY | os.O_NONBLOCK)
+                break
+
+            # no reader yet, polling instead of blocking so that abort() can't leave the writer stuck
+            except OSError as e:
+                if e.errno != errno.ENXIO or self._aborted.is_set() or self.process.poll() is not None:
+                    raise BrokenPipeError(f'ffmpeg is not reading {fifo}') from e
+
+                time.sleep(0.05)
+
+        os.set_blocking(fd, True)
+
+        return os.fdopen(fd, 'wb')
+
+
+
+    def finish(self):
+
+        """Waits for ffmpeg to finish writing the output file, once both pipes were written and closed.
+        """
+
+        try:
+            retcode = self.process.wait()
+
+            if retcode:
+                raise ffmpeg.Error('ffmpeg', None, None)
+
+        finally:
+            self._cleanup()
+
+
+
+    def abort(self):
+
+        """Stops ffmpeg and removes the partial output file.
+        """
+
+        self._aborted.set()
+
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+        if os.path.isfile(self.output_path):
+            os.remove(self.output_path)
+
+        self._cleanup()
+
+
+
+    def _cleanup(self):
+
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+
+
+class mux_queue():
+    """Pool of merge workers separate from the download workers, so that the next videos download
+    while the previous ones merge. By default, one pool is shared by all playlists of the process (see default()).
+
+    Once max_pending jobs wait for a free worker, submit() blocks, which keeps the downloads
+    from running too far ahead of the merges (and from piling up temp files).
+
+    Args:
+        workers (int): number of merges running at the same time. Defaults to the number of CPU cores.
+        max_pending (int): number of merges that can wait for a free worker.
+        status_callback (function): called as status_callback(mux_queue) whenever running or pending change.
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, workers=None, max_pending=2, status_callback=None):
+
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.status_callback = status_callback
+
+        self.running = 0
+        self.pending = 0
+
+        self._watchers = []
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+
+
+
+    @classmethod
+    def default(cls):
+
+        """Returns the merge pool shared by the whole process.
+        """
+
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+
+            return cls._default
+
+
+
+    def configure(self, workers=None, max_pending=2):
+
+        """Changes the number of merge workers and of merges waiting for them, i.e. from the app's settings.
+        Merges already submitted finish on the previous workers.
+        """
+
+        with self._condition:
+            workers = workers or os.cpu_count() or 1
+
+            if workers != self.workers:
+                self._executor.shutdown(wait=False)
+                self._executor = ThreadPoolExecutor(max_workers=workers)
+
+            self.workers = workers
+            self.max_pending = max_pending
+            self._condition.notify_all()
+
+
+
+    def watch(self, callback):
+
+        """Also calls callback(mux_queue) whenever running or pending change, until unwatch(callback).
+        """
+
+        with self._condition:
+            self._watchers.append(callback)
+
+
+
+    def unwatch(self, callback):
+
+        with self._condition:
+            if callback in self._watchers:
+                self._watchers.remove(callback)
+
+
+
+    def submit(self, fn, *args, **kwargs):
+
+        """Queues fn(*args, **kwargs) for a merge worker, waiting for room in the queue if it is full.
+
+        Returns:
+            concurrent.futures.Future
+        """
+
+        with self._condition:
+            while self.running + self.pending >= self.workers + self.max_pending:
+                self._condition.wait()
+
+            self.pending += 1
+            future = self._executor.submit(self._run, fn, *args, **kwargs)
+
+        self._notify()
+
+        return future
+
+
+
+    def shutdown(self, wait=True):
+
+        self._executor.shutdown(wait=wait)
+
+
+
+    def _run(self, fn, *args, **kwargs):
+
+        self._update(pending=-1, running=1)
+
+        try:
+            return fn(*args, **kwargs)
+
+        finally:
+            self._update(running=-1)
+
+
+
+    def _update(self, pending=0, running=0):
+
+        with self._condition:
+            self.pending += pending
+            self.running += running
+            self._condition.notify_all()
+
+        self._notify()
+
+
+
+    def _notify(self):
+
+        with self._condition:
+            callbacks = ([self.status_callback] if self.status_callback else []) + self._watchers
+
+        for callback in callbacks:
+            callback(self)
@@ -0,0 +1,47 @@
+from pathlib import Path
+import sys, os
+
+
+APP_NAME = 'yt_downloader'
+
+
+
+def user_cache_dir():
+
+    """Returns the per-user directory for the app's cache files, creating it if needed.
+    """
+
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA', os.path.join(Path.home(), 'AppData', 'Local'))
+
+    elif sys.platform == 'darwin':
+        base = os.path.join(Path.home(), 'Library', 'Caches')
+
+    else:
+        base = os.environ.get('XDG_CACHE_HOME', os.path.join(Path.home(), '.cache'))
+
+    path = os.path.join(base, APP_NAME)
+    os.makedirs(path, exist_ok=True)
+
+    return path
+
+
+
+def user_data_dir():
+
+    """Returns the per-user directory for the app's persistent data (i.e. the download queue), creating it if needed.
+    """
+
+    if sys.platform == 'win32':
+        base = os.environ.get('APPDATA', os.path.join(Path.home(), 'AppData', 'Roaming'))
+
+    elif sys.platform == 'darwin':
+        base = os.path.join(Path.home(), 'Library', 'Application Support')
+
+    else:
+        base = os.environ.get('XDG_DATA_HOME', os.path.join(Path.home(), '.local', 'share'))
+
+    path = os.path.join(base, APP_NAME)
+    os.makedirs(path, exist_ok=True)
+
+    return path
@@ -0,0 +1,78 @@
+import sqlite3, os, time, threading
+
+from yt_downloader_core.paths import user_data_dir
+
+
+
+class sync_state():
+    """Persistent SQLite record of which videos of each synced playlist were downloaded,
+    per resolution and download directory, so that the next sync only downloads new videos.
+
+    Args:
+        path (str): path of the SQLite file. Defaults to sync.sqlite3 in the user data dir.
+    """
+
+    def __init__(self, path=None):
+
+        if path is None:
+            path = os.path.join(user_data_dir(), 'sync.sqlite3')
+
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS synced ('
+            'playlist_id TEXT NOT NULL, target TEXT NOT NULL, video_id TEXT NOT NULL, '
+            'added REAL NOT NULL, PRIMARY KEY (playlist_id, target, video_id))'
+        )
+        self._conn.commit()
+
+
+
+    def known(self, playlist_id, target):
+
+        """Returns the ids of the videos of the playlist already synced into target.
+
+        Args:
+            target (str): identifies where and how the playlist is synced, i.e. '720p:/home/user/Downloads/music'.
+
+        Returns:
+            set of strings
+        """
+
+        with self._lock:
+            rows = self._conn.execute('SELECT video_id FROM synced WHERE playlist_id = ? AND target = ?', (playlist_id, target)).fetchall()
+
+        return {video_id for video_id, in rows}
+
+
+
+    def add(self, playlist_id, target, video_ids):
+
+        now = time.time()
+
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO synced (playlist_id, target, video_id, added) VALUES (?, ?, ?, ?)',
+                [(playlist_id, target, video_id, now) for video_id in video_ids]
+            )
+            self._conn.commit()
+
+
+
+    def remove(self, playlist_id, target, video_ids):
+
+        with self._lock:
+            self._conn.executemany(
+                'DELETE FROM synced WHERE playlist_id = ? AND target = ? AND video_id = ?',
+                [(playlist_id, target, video_id) for video_id in video_ids]
+            )
+            self._conn.commit()
+
+
+
+    def close(self):
+
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,146 @@
+import threading, time
+
+
+# minimum seconds between two speed measurements, shorter ones are too noisy
+MIN_SAMPLE_INTERVAL = 0.05
+
+
+
+class job_progress():
+    """Snapshot of the progress of a single download job.
+
+    Attributes:
+        type (str): type of the last reported stream, i.e. 'video+audio', 'audio' or 'playlist'.
+        percent (float): progress of the last reported stream.
+        speed (float): smoothed bytes per second.
+        eta (float): smoothed seconds left, None if unknown.
+    """
+
+    __slots__ = ('job_key', 'title', 'type', 'completed', 'total', 'percent', 'speed', 'eta')
+
+    def __init__(self, job_key, title, type, completed, total, percent, speed, eta):
+
+        self.job_key = job_key
+        self.title = title
+        self.type = type
+        self.completed = completed
+        self.total = total
+        self.percent = percent
+        self.speed = speed
+        self.eta = eta
+
+
+
+class _job_state():
+
+    def __init__(self):
+
+        self.title = ''
+        self.type = None
+        self.completed = 0
+        self.total = 0
+        self.fraction = 0
+        self.bytes = 0
+
+        self.speed = None
+        self.fraction_rate = None
+        self.last_tick = time.monotonic()
+        self.last_bytes = 0
+        self.last_fraction = 0
+
+
+
+class progress_aggregator():
+    """Coalesces the progress callbacks of download jobs.
+
+    Callbacks only record the latest state of their job (no I/O, no UI calls), however often they are called.
+    Readers take snapshots at their own pace (i.e. a 10 Hz timer), which also computes exponentially
+    smoothed speeds and ETAs.
+
+    Args:
+        smoothing (float): weight of the newest measurement in the smoothed speed and ETA, between 0 and 1.
+    """
+
+    def __init__(self, smoothing=0.3):
+
+        self.smoothing = smoothing
+
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+
+
+    def callback(self, job_key):
+
+        """Returns a progress callback for a job, called as callback(stream, chunk, bytes_remaining) like pytube's.
+        """
+
+        with self._lock:
+            self._jobs.setdefault(job_key, _job_state())
+
+        def callback(stream, chunk, bytes_remaining):
+            with self._lock:
+                state = self._jobs.get(job_key)
+
+                if state is None:
+                    return
+
+                state.title = stream.title
+                state.type = stream.type
+                state.completed = getattr(stream, 'completed', 0)
+                state.total = stream.filesize
+                state.fraction = (stream.filesize - bytes_remaining) / stream.filesize if stream.filesize else 0
+                state.bytes += len(chunk)
+
+        return callback
+
+
+
+    def remove(self, job_key):
+
+        with self._lock:
+            self._jobs.pop(job_key, None)
+
+
+
+    def snapshot(self):
+
+        """Returns the progress of the jobs which reported any, in the order they were added.
+
+        Returns:
+            list of job_progress
+        """
+
+        now = time.monotonic()
+        snapshots = []
+
+        with self._lock:
+            for job_key, state in self._jobs.items():
+                elapsed = now - state.last_tick
+
+                if elapsed >= MIN_SAMPLE_INTERVAL:
+                    speed = (state.bytes - state.last_bytes) / elapsed
+                    fraction_rate = max(state.fraction - state.last_fraction, 0) / elapsed
+
+                    # the first measurement is taken as is instead of being smoothed from 0
+                    if state.speed is None:
+                        state.speed, state.fraction_rate = speed, fraction_rate
+                    else:
+                        state.speed = self.smoothing * speed + (1 - self.smoothing) * state.speed
+                        state.fraction_rate = self.smoothing * fraction_rate + (1 - self.smoothing) * state.fraction_rate
+
+                    state.last_tick = now
+                    state.last_bytes = state.bytes
+                    state.last_fraction = state.fraction
+
+                if state.type is None:
+                    continue
+
+                eta = (1 - state.fraction) / state.fraction_rate if state.fraction_rate else None
+
+                snapshots.append(job_progress(
+                    job_key, state.title, state.type, state.completed, state.total,
+                    round(state.fraction * 100, 2), state.speed or 0, eta,
+                ))
+
+        return snapshots
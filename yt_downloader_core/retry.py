@@ -0,0 +1,392 @@
+from urllib.parse import urlsplit
+import random, socket, sys, threading, time
+
+
+# failure classes, see classify
+TRANSIENT = 'transient'
+THROTTLED = 'throttled'
+UNAVAILABLE = 'unavailable'
+MISSING_FFMPEG = 'missing_ffmpeg'
+FATAL = 'fatal'
+
+# failure classes worth retrying, the others fail the same way every time
+RETRYABLE = (TRANSIENT, THROTTLED)
+
+# longest Retry-After honored, in seconds
+MAX_RETRY_AFTER = 300
+
+
+
+class CircuitOpenError(ConnectionError):
+    """Raised instead of sending a request to a host which failed too often recently.
+
+    Args:
+        host (str): the failing host.
+        retry_in (float): seconds until the host may be tried again.
+    """
+
+    def __init__(self, host, retry_in):
+        super().__init__(f'Too many failures from {host}, retrying in {retry_in:.0f} s')
+        self.host = host
+        self.retry_in = retry_in
+
+
+
+def classify(error):
+
+    """Returns the failure class of an exception raised while downloading a video:
+    TRANSIENT (network errors, timeouts, 5xx), THROTTLED (HTTP 429 or an open circuit),
+    UNAVAILABLE (private, removed or blocked videos, HTTP 404/410), MISSING_FFMPEG or FATAL.
+
+    Returns:
+        string
+        i.e. 'transient'
+    """
+
+    # the errors of modules which were never imported can't have been raised, so they are only looked up
+    # in sys.modules, which keeps this module (imported by the GUI at startup) from importing pytube, asyncio, etc.
+    modules = sys.modules
+
+    if isinstance(error, CircuitOpenError):
+        return THROTTLED
+
+    if 'urllib.error' in modules and isinstance(error, modules['urllib.error'].HTTPError):
+        if error.code == 429:
+            return THROTTLED
+
+        if error.code in (404, 410):
+            return UNAVAILABLE
+
+        return TRANSIENT if error.code >= 500 or error.code == 408 else FATAL
+
+    if 'pytube.exceptions' in modules and isinstance(error, modules['pytube.exceptions'].VideoUnavailable):
+        return UNAVAILABLE
+
+    # the video has no format the selection policy allows (i.e. webm only for the mp4 policy)
+    if 'yt_downloader_core.formats' in modules and isinstance(error, modules['yt_downloader_core.formats'].NoSuitableStreamError):
+        return UNAVAILABLE
+
+    if isinstance(error, FileNotFoundError) and 'ffmpeg' in str(error.filename or ''):
+        return MISSING_FFMPEG
+
+    network_errors = [ConnectionError, socket.timeout, socket.gaierror, TimeoutError]
+
+    if 'urllib.error' in modules:
+        network_errors.append(modules['urllib.error'].URLError)
+
+    if 'http.client' in modules:
+        network_errors.append(modules['http.client'].HTTPException)
+
+    if 'asyncio' in modules:
+        network_errors.extend((modules['asyncio'].TimeoutError, modules['asyncio'].IncompleteReadError))
+
+    if isinstance(error, tuple(network_errors)):
+        return TRANSIENT
+
+    # a playlist (i.e. PlaylistDownloadError) is worth retrying if any of its failed videos is,
+    # its other videos are skipped by the retry
+    failures = getattr(error, 'failures', None)
+
+    if failures:
+        classes = {classify(failure) for url, failure in failures}
+
+        for failure_class in (MISSING_FFMPEG, TRANSIENT, THROTTLED, UNAVAILABLE):
+            if failure_class in classes:
+                return failure_class
+
+    return FATAL
+
+
+
+def given_up(error):
+
+    """Checks if a failure already ran out of retries at a lower level (see retry_policy.should_retry).
+    """
+
+    return getattr(error, 'retries_exhausted', False)
+
+
+
+def retry_after(error):
+
+    """Returns the seconds to wait asked by a throttling response's Retry-After header, or None.
+    """
+
+    headers = getattr(error, 'headers', None)
+    value = headers.get('Retry-After') if headers is not None else None
+
+    if not value:
+        return None
+
+    try:
+        seconds = float(value)
+
+    except ValueError:
+        from email.utils import parsedate_to_datetime
+
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+
+    return min(max(seconds, 0), MAX_RETRY_AFTER)
+
+
+
+class circuit_breaker():
+    """Per-host circuit breakers shared by all downloads of the process.
+
+    After failure_threshold consecutive retryable failures from a host, requests to it fail right away
+    with CircuitOpenError for reset_timeout seconds (doubling while the host keeps failing), then a single
+    request is let through to probe it. A success closes the circuit again.
+    This keeps many parallel segments and videos from hammering a host which is down or throttling.
+
+    Args:
+        failure_threshold (int): consecutive failures which open a host's circuit.
+        reset_timeout (float): seconds a circuit first stays open.
+        max_reset_timeout (float): longest a circuit stays open.
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, failure_threshold=5, reset_timeout=10, max_reset_timeout=120):
+
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+
+        # host -> [consecutive failures, open until, times opened in a row, probe deadline] (monotonic times)
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+
+
+    @classmethod
+    def default(cls):
+
+        """Returns the circuit breaker shared by the whole process.
+        """
+
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+
+            return cls._default
+
+
+
+    def before(self, host):
+
+        """Checks that a request may be sent to host, raises CircuitOpenError if not.
+        """
+
+        with self._lock:
+            state = self._hosts.get(host)
+
+            if state is None or state[0] < self.failure_threshold:
+                return
+
+            now = time.monotonic()
+            retry_in = state[1] - now
+
+            # half-open: one request probes the host, the others keep waiting (unless the probe never reports back)
+            if retry_in <= 0 and state[3] <= now:
+                state[3] = now + self.reset_timeout
+                return
+
+            raise CircuitOpenError(host, max(retry_in, 0) or self.reset_timeout)
+
+
+
+    def success(self, host):
+
+        with self._lock:
+            self._hosts.pop(host, None)
+
+
+
+    def failure(self, host):
+
+        """Counts a retryable failure of a request to host, opening its circuit at failure_threshold.
+        """
+
+        with self._lock:
+            state = self._hosts.setdefault(host, [0, 0, 0, 0])
+            state[0] += 1
+            now = time.monotonic()
+
+            if state[0] >= self.failure_threshold and state[1] <= now:
+                state[1] = now + min(self.reset_timeout * 2 ** state[2], self.max_reset_timeout)
+                state[2] += 1
+                state[3] = 0
+
+
+
+    def is_open(self, host):
+
+        with self._lock:
+            state = self._hosts.get(host)
+
+            return state is not None and state[0] >= self.failure_threshold and state[1] > time.monotonic()
+
+
+
+class retry_policy():
+    """Decides whether and when a failed request, segment or video is retried.
+
+    Only retryable failures (see classify) are retried, up to max_retries times, after a jittered exponential
+    backoff ("full jitter": a random delay up to base_delay * 2 ** retry, capped at max_delay) so that
+    parallel downloads failing together don't retry together. Throttled requests wait at least
+    throttled_delay or the server's Retry-After. Failures are reported to the per-host circuit breaker.
+
+    Args:
+        max_retries (int): retries after the first attempt.
+        base_delay (float): seconds of the first backoff.
+        max_delay (float): longest backoff in seconds.
+        throttled_delay (float): minimum seconds waited after HTTP 429.
+        breaker (circuit_breaker): defaults to the one shared by the process.
+    """
+
+    def __init__(self, max_retries=3, base_delay=1, max_delay=30, throttled_delay=5, breaker=None):
+
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.throttled_delay = throttled_delay
+        self.breaker = breaker or circuit_breaker.default()
+
+
+
+    def should_retry(self, error, tries):
+
+        """Checks if a failure is worth retrying after tries retries so far.
+        A retryable failure which ran out of retries is marked as given up, so that the levels above the one
+        that retried it (the video of a segment, the app's job of a video) raise it right away instead of retrying it again.
+        """
+
+        if given_up(error) or classify(error) not in RETRYABLE:
+            return False
+
+        if tries < self.max_retries:
+            return True
+
+        error.retries_exhausted = True
+
+        return False
+
+
+
+    def delay(self, error, tries):
+
+        """Returns the seconds to wait before retry number tries + 1.
+        """
+
+        if isinstance(error, CircuitOpenError):
+            return error.retry_in + random.uniform(0, self.base_delay)
+
+        delay = random.uniform(0, min(self.base_delay * 2 ** tries, self.max_delay))
+
+        if classify(error) == THROTTLED:
+            delay = max(delay, retry_after(error) or 0, self.throttled_delay * random.uniform(1, 2))
+
+        return delay
+
+
+
+    def failed(self, error, url=None, host=None):
+
+        """Reports a failure to the circuit breaker of the url's host.
+        Failures which are not retryable mean that the host answered, so they count as successes.
+        """
+
+        host = host or (urlsplit(url).hostname if url else None)
+
+        if not host or isinstance(error, CircuitOpenError):
+            return
+
+        if classify(error) in RETRYABLE:
+            self.breaker.failure(host)
+        else:
+            self.breaker.success(host)
+
+
+
+    def before(self, url):
+
+        """Checks the circuit breaker of the url's host before sending a request, raises CircuitOpenError if open.
+        """
+
+        self.breaker.before(urlsplit(url).hostname)
+
+
+
+    def succeeded(self, url):
+
+        self.breaker.success(urlsplit(url).hostname)
+
+
+
+    def call(self, fn, *args, host=None, **kwargs):
+
+        """Calls fn(*args, **kwargs), retrying retryable failures with backoff.
+        Requests to an open circuit's host wait for it to close (counted as retries).
+        """
+
+        tries = 0
+
+        while True:
+            try:
+                if host:
+                    self.breaker.before(host)
+
+                result = fn(*args, **kwargs)
+
+            except Exception as e:
+                self.failed(e, host=host)
+
+                if not self.should_retry(e, tries):
+                    raise
+
+                time.sleep(self.delay(e, tries))
+                tries += 1
+                continue
+
+            if host:
+                self.breaker.success(host)
+
+            return result
+
+
+
+    async def call_async(self, coro_fn, *args, host=None, **kwargs):
+
+        """Same as call, awaiting coro_fn(*args, **kwargs) and the backoff on the event loop.
+        """
+
+        # only imported by the callers running an event loop
+        import asyncio
+
+        tries = 0
+
+        while True:
+            try:
+                if host:
+                    self.breaker.before(host)
+
+                result = await coro_fn(*args, **kwargs)
+
+            except Exception as e:
+                self.failed(e, host=host)
+
+                if not self.should_retry(e, tries):
+                    raise
+
+                await asyncio.sleep(self.delay(e, tries))
+                tries += 1
+                continue
+
+            if host:
+                self.breaker.success(host)
+
+            return result
@@ -0,0 +1,426 @@
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from collections import deque
+import http.client, threading, time, math, json, os
+
+from yt_downloader_core.retry import retry_policy
+from yt_downloader_core.disk_space import preallocate
+
+
+# same size as pytube's range requests, YouTube throttles bigger ranges
+DEFAULT_SEGMENT_SIZE = 9 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+# minimum seconds between checkpoint saves
+CHECKPOINT_INTERVAL = 1
+
+HEADERS = {'User-Agent': 'Mozilla/5.0', 'accept-language': 'en-US,en'}
+
+
+
+class RangeNotSupportedError(Exception):
+    """Raised when the server ignores Range requests, i.e. responds with the whole file.
+    """
+
+
+
+class segmented_downloader():
+    """Download engine that splits a file into byte ranges and fetches them on several connections at once.
+
+    Segments are written at their offsets into a preallocated output file, and a failed segment
+    is retried on its own, resuming from the last byte it received.
+
+    Progress is saved in a sidecar checkpoint file (file_path + '.checkpoint.json') while downloading,
+    so an interrupted download of the same stream into the same file resumes instead of starting over.
+
+    Args:
+        connections (int): number of segments downloaded at the same time.
+        segment_size (int): maximum bytes per segment (Range request).
+        max_retries (int): retries per segment after a connection error, timeout, 5xx or 429, unless retry is given.
+        timeout (int): socket timeout in seconds.
+        throttle (bandwidth.throttle): optional bandwidth limit shared by all connections.
+        retry (retry.retry_policy): backoff and per-host circuit breaking of the segments' requests.
+    """
+
+    def __init__(self, connections=4, segment_size=DEFAULT_SEGMENT_SIZE, max_retries=3, timeout=30, throttle=None, retry=None):
+
+        self.connections = connections
+        self.segment_size = segment_size
+        self.timeout = timeout
+        self.throttle = throttle
+        self.retry = retry or retry_policy(max_retries)
+
+
+
+    def download_stream(self, stream, file_path, progress_callback=None, identity=None):
+
+        """Downloads a pytube stream into file_path, in place of pytube's Stream.download.
+        Falls back to Stream.download if the stream's filesize is unknown or the server does not support Range requests.
+
+        Args:
+            progress_callback (function): called as progress_callback(stream, chunk, bytes_remaining), like pytube's callbacks.
+            identity (str): identifies the stream across runs (stream urls expire), i.e. 'video_id:itag'. Defaults to the itag.
+
+        Returns:
+            string of the downloaded file path
+        """
+
+        filesize = self.stream_filesize(stream)
+
+        if not filesize:
+            return self.fallback_download(stream, file_path)
+
+        if identity is None:
+            identity = str(stream.itag)
+
+        try:
+            self.download(stream.url, file_path, filesize, self.stream_callback(stream, progress_callback), identity)
+
+        except RangeNotSupportedError:
+            return self.fallback_download(stream, file_path)
+
+        return file_path
+
+
+
+    @staticmethod
+    def stream_filesize(stream):
+
+        """Returns the filesize of a pytube stream (which may be fetched with a HEAD request), 0 if unknown.
+        """
+
+        try:
+            return stream.filesize
+
+        except HTTPError:
+            return 0
+
+
+
+    @staticmethod
+    def stream_callback(stream, progress_callback=None):
+
+        """Returns a progress_callback(chunk, bytes_remaining) calling progress_callback(stream, chunk, bytes_remaining).
+        """
+
+        def callback(chunk, bytes_remaining):
+            if progress_callback:
+                progress_callback(stream, chunk, bytes_remaining)
+
+        return callback
+
+
+
+    def fallback_download(self, stream, file_path):
+
+        """Downloads a pytube stream over a single connection with Stream.download.
+        """
+
+        # older pytube versions add the extension to the filename
+        downloaded_path = stream.download(output_path=os.path.dirname(file_path), filename=os.path.basename(file_path), skip_existing=False)
+
+        if os.path.abspath(downloaded_path) != os.path.abspath(file_path):
+            os.replace(downloaded_path, file_path)
+
+        return file_path
+
+
+
+    def download(self, url, file_path, filesize, progress_callback=None, identity=None):
+
+        """Downloads url into file_path using up to self.connections Range requests at once.
+        Resumes from the checkpoint of a previous interrupted download if it matches identity and filesize.
+
+        Args:
+            progress_callback (function): called as progress_callback(chunk, bytes_remaining).
+            identity (str): identifies the downloaded content across runs. Defaults to url.
+        """
+
+        if identity is None:
+            identity = url
+
+        checkpoint = download_checkpoint.load(file_path, identity, filesize)
+
+        if checkpoint is None:
+            with open(file_path, 'wb') as fh:
+                preallocate(fh, filesize)
+
+            checkpoint = download_checkpoint(file_path, identity, filesize, self.split(filesize))
+
+        pending = checkpoint.pending()
+        progress = _progress(checkpoint.bytes_remaining(), progress_callback)
+
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.connections, len(pending)))) as executor:
+                futures = [executor.submit(self.download_segment, url, file_path, checkpoint, index, progress) for index in pending]
+                done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+
+                for future in not_done:
+                    future.cancel()
+
+            for future in futures:
+                if not future.cancelled():
+                    future.result()
+
+        except RangeNotSupportedError:
+            checkpoint.remove()
+            raise
+
+        except BaseException:
+            checkpoint.save()
+            raise
+
+        checkpoint.remove()
+
+
+
+    def split(self, filesize):
+
+        """Splits filesize bytes into (start, end) inclusive byte ranges,
+        with at least one segment per connection.
+
+        Returns:
+            list of tuples
+            i.e. [(0, 999), (1000, 1999), (2000, 2499)]
+        """
+
+        segment_size = max(1, min(self.segment_size, math.ceil(filesize / max(1, self.connections))))
+
+        return [(start, min(start + segment_size, filesize) - 1) for start in range(0, filesize, segment_size)]
+
+
+
+    def download_to(self, url, fh, filesize, progress_callback=None):
+
+        """Downloads url in order into a writable file-like object, i.e. a pipe.
+        Up to self.connections segments are fetched ahead at once and written as soon as their turn comes.
+
+        Args:
+            progress_callback (function): called as progress_callback(chunk, bytes_remaining).
+        """
+
+        progress = _progress(filesize, progress_callback)
+        pending = deque()
+
+        with ThreadPoolExecutor(max_workers=max(1, self.connections)) as executor:
+            try:
+                for start, end in self.split(filesize):
+                    pending.append(executor.submit(self.fetch_segment, url, start, end))
+
+                    if len(pending) >= self.connections:
+                        chunk = pending.popleft().result()
+                        fh.write(chunk)
+                        progress.update(chunk)
+
+                while pending:
+                    chunk = pending.popleft().result()
+                    fh.write(chunk)
+                    progress.update(chunk)
+
+            finally:
+                for future in pending:
+                    future.cancel()
+
+
+
+    def download_segment(self, url, file_path, checkpoint, index, progress):
+
+        """Downloads a segment of url into file_path at the same offset.
+        """
+
+        start, end, pos = checkpoint.segments[index]
+
+        # unbuffered so that bytes recorded in the checkpoint are always written to the file
+        with open(file_path, 'r+b', buffering=0) as fh:
+            fh.seek(pos)
+
+            def write(chunk, pos):
+                fh.write(chunk)
+                checkpoint.update(index, pos)
+                progress.update(chunk)
+
+            self.read_range(url, pos, end, write)
+
+
+
+    def fetch_segment(self, url, start, end):
+
+        """Returns bytes start to end (inclusive) of url.
+        """
+
+        data = bytearray()
+        self.read_range(url, start, end, lambda chunk, pos: data.extend(chunk))
+
+        return bytes(data)
+
+
+
+    def read_range(self, url, start, end, on_chunk):
+
+        """Reads bytes start to end (inclusive) of url, passing them in order to on_chunk(chunk, next_pos).
+        Retryable failures (see retry.classify) are retried as self.retry decides, resuming after the last byte received.
+        """
+
+        pos = start
+        tries = 0
+
+        while pos <= end:
+            try:
+                self.retry.before(url)
+                request = Request(url, headers={**HEADERS, 'Range': f'bytes={pos}-{end}'})
+
+                with urlopen(request, timeout=self.timeout) as response:
+
+                    # the whole file is only acceptable if it is what was asked for
+                    if response.status != 206 and pos != 0:
+                        raise RangeNotSupportedError(url)
+
+                    while pos <= end:
+                        chunk = response.read(min(CHUNK_SIZE, end - pos + 1))
+
+                        if not chunk:
+                            break
+
+                        pos += len(chunk)
+                        on_chunk(chunk, pos)
+
+                        if self.throttle is not None:
+                            self.throttle.consume(len(chunk))
+
+                if pos <= end:
+                    raise http.client.IncompleteRead(b'', end - pos + 1)
+
+                self.retry.succeeded(url)
+
+            except RangeNotSupportedError:
+                raise
+
+            except Exception as e:
+                self.retry.failed(e, url)
+
+                if not self.retry.should_retry(e, tries):
+                    raise
+
+                time.sleep(self.retry.delay(e, tries))
+                tries += 1
+
+
+
+class download_checkpoint():
+    """Sidecar file recording how far each segment of a partial download got.
+
+    Args:
+        file_path (str): path of the partial file, the checkpoint is saved next to it.
+        identity (str): identifies the downloaded content, i.e. 'video_id:itag'.
+        filesize (int): expected size of the complete file.
+        segments (list): [start, end, pos] lists, pos being the next byte to download.
+    """
+
+    def __init__(self, file_path, identity, filesize, segments):
+
+        self.path = file_path + '.checkpoint.json'
+        self.identity = identity
+        self.filesize = filesize
+        self.segments = [list(segment) for segment in segments]
+
+        for segment in self.segments:
+            if len(segment) == 2:
+                segment.append(segment[0])
+
+        self._last_save = 0
+        self._lock = threading.Lock()
+
+
+
+    @classmethod
+    def load(cls, file_path, identity, filesize):
+
+        """Returns the checkpoint of a previous download of the same content into file_path,
+        or None if there is none or it does not match.
+        """
+
+        try:
+            with open(file_path + '.checkpoint.json') as fh:
+                data = json.load(fh)
+
+            if data['identity'] != identity or data['filesize'] != filesize or os.path.getsize(file_path) != filesize:
+                return None
+
+            return cls(file_path, identity, filesize, data['segments'])
+
+        except (OSError, ValueError, KeyError):
+            return None
+
+
+
+    def pending(self):
+
+        """Returns the indexes of the segments which are not yet complete.
+        """
+
+        return [index for index, (start, end, pos) in enumerate(self.segments) if pos <= end]
+
+
+
+    def bytes_remaining(self):
+
+        return sum(end - pos + 1 for start, end, pos in self.segments if pos <= end)
+
+
+
+    def update(self, index, pos):
+
+        """Records that a segment got up to pos, saving the checkpoint at most once every CHECKPOINT_INTERVAL seconds.
+        """
+
+        with self._lock:
+            self.segments[index][2] = pos
+
+            if time.monotonic() - self._last_save < CHECKPOINT_INTERVAL:
+                return
+
+        self.save()
+
+
+
+    def save(self):
+
+        with self._lock:
+            data = json.dumps({'identity': self.identity, 'filesize': self.filesize, 'segments': self.segments})
+            self._last_save = time.monotonic()
+
+            with open(self.path + '.tmp', 'w') as fh:
+                fh.write(data)
+
+            os.replace(self.path + '.tmp', self.path)
+
+
+
+    def remove(self):
+
+        with self._lock:
+            if os.path.isfile(self.path):
+                os.remove(self.path)
+
+
+
+class _progress():
+    """Thread-safe byte counter shared by the segments of a download."""
+
+    def __init__(self, filesize, callback=None):
+
+        self.bytes_remaining = filesize
+        self.callback = callback
+        self._lock = threading.Lock()
+
+
+
+    def update(self, chunk):
+
+        with self._lock:
+            self.bytes_remaining -= len(chunk)
+            bytes_remaining = self.bytes_remaining
+
+        if self.callback:
+            self.callback(chunk, bytes_remaining)
@@ -0,0 +1,132 @@
+import math
+
+
+# z-score of the confidence interval of the estimates (95%)
+CONFIDENCE_Z = 1.96
+
+
+
+def download_size(filesizes, res):
+
+    """Returns the bytes to download for a video at res given its resolution -> filesize dict,
+    falling back to the highest available resolution like yt_downloader.select_streams does.
+    """
+
+    audio = filesizes.get('audio', 0)
+
+    if res == 'audio':
+        return audio
+
+    if res not in filesizes:
+        video_res = [option for option in filesizes if option != 'audio']
+
+        if not video_res:
+            return audio
+
+        res = max(video_res, key=(lambda x: int(x[:-1])))
+
+    return filesizes[res] + audio
+
+
+
+class playlist_size_estimate():
+    """Running estimate of the download size of a playlist, refined as its videos are resolved.
+
+    Videos should be added in random order so that the first ones are a fair sample of the playlist.
+    The total is extrapolated from the average of the videos added so far, with a confidence interval
+    that narrows to the exact total once every video is added.
+
+    Args:
+        video_count (int): number of videos in the playlist.
+    """
+
+    def __init__(self, video_count):
+
+        self.video_count = video_count
+        self.resolved = 0
+        self.failed = 0
+
+        # per res: [sum, sum of squares] of the download sizes of the resolved videos
+        self._sums = {}
+        self._filesizes = []
+
+
+
+    def add(self, filesizes):
+
+        """Adds a resolved video given its resolution -> filesize dict, i.e. yt_downloader.filesizes.
+        """
+
+        self.resolved += 1
+        self._filesizes.append(filesizes)
+
+        for res in set(self._sums) | set(filesizes):
+            if res not in self._sums:
+                # a res first seen now, the videos before it fall back to their highest resolution
+                self._sums[res] = [0, 0]
+
+                for previous in self._filesizes[:-1]:
+                    self._add_size(res, download_size(previous, res))
+
+            self._add_size(res, download_size(filesizes, res))
+
+
+
+    def add_failed(self):
+
+        """Counts a video which could not be resolved, it is left out of the estimate.
+        """
+
+        self.failed += 1
+
+
+
+    def estimate(self, res):
+
+        """Returns the estimated total bytes to download the playlist at res, and the margin of error.
+        The margin is 0 once all videos are resolved, and None before any is.
+
+        Returns:
+            tuple of ints
+            i.e. (1234567890, 61728394) for 1.23GB +- 62MB
+        """
+
+        if not self.resolved:
+            return 0, None
+
+        if res not in self._sums:
+            self._sums[res] = [0, 0]
+
+            for filesizes in self._filesizes:
+                self._add_size(res, download_size(filesizes, res))
+
+        total, squares = self._sums[res]
+        count = self.video_count - self.failed
+        n = self.resolved
+
+        if n >= count:
+            return total, 0
+
+        mean = total / n
+        variance = max(squares / n - mean ** 2, 0) * n / (n - 1) if n > 1 else mean ** 2
+
+        # finite population correction, the margin shrinks to 0 as the sample grows to the whole playlist
+        margin = CONFIDENCE_Z * count * math.sqrt(variance / n * (count - n) / max(count - 1, 1))
+
+        return round(mean * count), round(margin)
+
+
+
+    def confidence(self):
+
+        """Returns the fraction of the playlist's videos that were resolved (or failed), from 0 to 1.
+        """
+
+        return (self.resolved + self.failed) / self.video_count if self.video_count else 1
+
+
+
+    def _add_size(self, res, filesize):
+
+        self._sums[res][0] += filesize
+        self._sums[res][1] += filesize ** 2
@@ -1,10 +1,11 @@
 # -*- coding: utf-8 -*-
 
-# Form implementation generated from reading ui file 'yt_downloader_gui\mainwindow.ui'
+# Form implementation generated from reading ui file 'yt_downloader_gui/mainwindow.ui'
 #
-# Created by: PyQt5 UI code generator 5.14.2
+# Created by: PyQt5 UI code generator 5.15.11
 #
-# WARNING! All changes made in this file will be lost!
+# WARNING: Any manual changes made to this file will be lost when pyuic5 is
+# run again.  Do not edit this file unless you know what you are doing.
 
 
 from PyQt5 import QtCore, QtGui, QtWidgets
@@ -13,7 +14,7 @@ from PyQt5 import QtCore, QtGui, QtWidgets
 class Ui_MainWindow(object):
     def setupUi(self, MainWindow):
         MainWindow.setObjectName("MainWindow")
-        MainWindow.resize(391, 305)
+        MainWindow.resize(391, 480)
         sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Fixed, QtWidgets.QSizePolicy.Fixed)
         sizePolicy.setHorizontalStretch(0)
         sizePolicy.setVerticalStretch(0)
@@ -43,8 +44,16 @@ class Ui_MainWindow(object):
         self.is_playlist_check.setObjectName("is_playlist_check")
         self.download_button = QtWidgets.QPushButton(self.centralwidget)
         self.download_button.setEnabled(False)
-        self.download_button.setGeometry(QtCore.QRect(10, 130, 371, 28))
+        self.download_button.setGeometry(QtCore.QRect(10, 130, 231, 28))
         self.download_button.setObjectName("download_button")
+        self.rate_limit_box = QtWidgets.QLineEdit(self.centralwidget)
+        self.rate_limit_box.setGeometry(QtCore.QRect(246, 130, 65, 28))
+        self.rate_limit_box.setObjectName("rate_limit_box")
+        self.priority_box = QtWidgets.QSpinBox(self.centralwidget)
+        self.priority_box.setGeometry(QtCore.QRect(316, 130, 65, 28))
+        self.priority_box.setMinimum(-9)
+        self.priority_box.setMaximum(9)
+        self.priority_box.setObjectName("priority_box")
         self.custom_dir_name_check = QtWidgets.QCheckBox(self.centralwidget)
         self.custom_dir_name_check.setGeometry(QtCore.QRect(10, 90, 151, 20))
         font = QtGui.QFont()
@@ -117,14 +126,52 @@ class Ui_MainWindow(object):
         self.download_setting_option.addItem("")
         self.download_setting_option.addItem("")
         self.download_setting_option.addItem("")
+        self.queue_line = QtWidgets.QLabel(self.centralwidget)
+        self.queue_line.setGeometry(QtCore.QRect(10, 260, 131, 21))
+        font = QtGui.QFont()
+        font.setPointSize(9)
+        self.queue_line.setFont(font)
+        self.queue_line.setObjectName("queue_line")
+        self.queue_list = QtWidgets.QListWidget(self.centralwidget)
+        self.queue_list.setGeometry(QtCore.QRect(10, 285, 371, 101))
+        font = QtGui.QFont()
+        font.setPointSize(9)
+        self.queue_list.setFont(font)
+        self.queue_list.setObjectName("queue_list")
+        self.remove_job_button = QtWidgets.QPushButton(self.centralwidget)
+        self.remove_job_button.setEnabled(False)
+        self.remove_job_button.setGeometry(QtCore.QRect(10, 392, 181, 28))
+        self.remove_job_button.setObjectName("remove_job_button")
+        self.cancel_job_button = QtWidgets.QPushButton(self.centralwidget)
+        self.cancel_job_button.setEnabled(False)
+        self.cancel_job_button.setGeometry(QtCore.QRect(200, 392, 181, 28))
+        self.cancel_job_button.setObjectName("cancel_job_button")
         MainWindow.setCentralWidget(self.centralwidget)
         self.menubar = QtWidgets.QMenuBar(MainWindow)
         self.menubar.setGeometry(QtCore.QRect(0, 0, 391, 26))
         self.menubar.setObjectName("menubar")
+        self.settings_menu = QtWidgets.QMenu(self.menubar)
+        self.settings_menu.setObjectName("settings_menu")
         MainWindow.setMenuBar(self.menubar)
         self.statusbar = QtWidgets.QStatusBar(MainWindow)
         self.statusbar.setObjectName("statusbar")
         MainWindow.setStatusBar(self.statusbar)
+        self.speed_limit_action = QtWidgets.QAction(MainWindow)
+        self.speed_limit_action.setObjectName("speed_limit_action")
+        self.concurrent_jobs_action = QtWidgets.QAction(MainWindow)
+        self.concurrent_jobs_action.setObjectName("concurrent_jobs_action")
+        self.engine_action = QtWidgets.QAction(MainWindow)
+        self.engine_action.setObjectName("engine_action")
+        self.mux_workers_action = QtWidgets.QAction(MainWindow)
+        self.mux_workers_action.setObjectName("mux_workers_action")
+        self.mux_queue_depth_action = QtWidgets.QAction(MainWindow)
+        self.mux_queue_depth_action.setObjectName("mux_queue_depth_action")
+        self.settings_menu.addAction(self.speed_limit_action)
+        self.settings_menu.addAction(self.concurrent_jobs_action)
+        self.settings_menu.addAction(self.engine_action)
+        self.settings_menu.addAction(self.mux_workers_action)
+        self.settings_menu.addAction(self.mux_queue_depth_action)
+        self.menubar.addAction(self.settings_menu.menuAction())
 
         self.retranslateUi(MainWindow)
         self.download_setting_option.setCurrentIndex(2)
@@ -136,6 +183,9 @@ class Ui_MainWindow(object):
         self.url_text.setText(_translate("MainWindow", "URL: "))
         self.is_playlist_check.setText(_translate("MainWindow", "Playlist Download"))
         self.download_button.setText(_translate("MainWindow", "Download"))
+        self.rate_limit_box.setToolTip(_translate("MainWindow", "Speed limit of this download in bytes per second, i.e. 500K or 2M, on top of the global one"))
+        self.rate_limit_box.setPlaceholderText(_translate("MainWindow", "Limit"))
+        self.priority_box.setToolTip(_translate("MainWindow", "Priority: queued downloads with a higher priority start first"))
         self.custom_dir_name_check.setText(_translate("MainWindow", "Custom Dir Name"))
         self.curr_download_line.setText(_translate("MainWindow", "Current Download:"))
         self.curr_download_text.setText(_translate("MainWindow", "None"))
@@ -150,3 +200,14 @@ class Ui_MainWindow(object):
         self.download_setting_option.setItemText(4, _translate("MainWindow", "720p"))
         self.download_setting_option.setItemText(5, _translate("MainWindow", "1080p"))
         self.download_setting_option.setItemText(6, _translate("MainWindow", "audio"))
+        self.queue_line.setText(_translate("MainWindow", "Download Queue:"))
+        self.remove_job_button.setToolTip(_translate("MainWindow", "Removes the selected download from the queue"))
+        self.remove_job_button.setText(_translate("MainWindow", "Remove"))
+        self.cancel_job_button.setToolTip(_translate("MainWindow", "Stops the selected running download, its partial files are resumed if it is added again"))
+        self.cancel_job_button.setText(_translate("MainWindow", "Cancel"))
+        self.settings_menu.setTitle(_translate("MainWindow", "Settings"))
+        self.speed_limit_action.setText(_translate("MainWindow", "Speed Limit: None"))
+        self.concurrent_jobs_action.setText(_translate("MainWindow", "Concurrent Downloads: 2"))
+        self.engine_action.setText(_translate("MainWindow", "Download Engine: threads"))
+        self.mux_workers_action.setText(_translate("MainWindow", "Merge Workers: Auto"))
+        self.mux_queue_depth_action.setText(_translate("MainWindow", "Merge Queue Depth: 2"))